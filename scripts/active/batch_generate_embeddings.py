@@ -16,17 +16,43 @@ Process:
 6. Update Supabase with embeddings
 
 Cost for 461K products: ~$9 (vs $18 sync)
+
+Step 6 runs with synchronous_commit off: a crash can lose the last few
+chunks' updates, which rerunning the script (results are kept on disk) redoes.
 """
 
+import io
+import asyncio
 import os
 import re
+import csv
 import json
 import time
+import queue
+import struct
+import threading
+from functools import lru_cache
+import numpy as np
 import psycopg2
-import psycopg2.extras
-from openai import OpenAI
+import psycopg2.pool
+from contextlib import contextmanager
+from openai import OpenAI, AsyncOpenAI
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    import orjson  # Optional: several times faster than json for batch input/output files
+
+    def dumps_line(obj):
+        return orjson.dumps(obj) + b'\n'
+
+    loads_line = orjson.loads
+except ImportError:
+    def dumps_line(obj):
+        return (json.dumps(obj) + '\n').encode()
+
+    loads_line = json.loads
+
 load_dotenv()
 
 client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
@@ -38,28 +64,69 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
+DOWNLOAD_CONCURRENCY = 4  # Result files downloading at once (bandwidth, not CPU, is the limit)
+
+# Supabase connections are shared by every helper, opened on first use
+_pool = None
+
+
+@contextmanager
+def pg():
+    """
+    Borrow a pooled Supabase connection
+
+    An open transaction is rolled back when it is returned. After an error
+    the connection is closed instead, so no temp tables or held cursors
+    leak into the next borrower.
+    """
+    global _pool
+    if _pool is None:
+        _pool = psycopg2.pool.ThreadedConnectionPool(
+            1, 4, application_name='batch_generate_embeddings', **SUPABASE_CONFIG
+        )
+    conn = _pool.getconn()
+    failed = True
+    try:
+        yield conn
+        failed = False
+    except GeneratorExit:
+        failed = False  # A generator borrowing it was closed early: not an error
+        raise
+    finally:
+        _pool.putconn(conn, close=failed)
+
+
+# Compiled once; the normalizer runs for every product
+_WMNS_RE = re.compile(r'\bWmns\b', re.IGNORECASE)
+_PARENW_RE = re.compile(r'\(W\)', re.IGNORECASE)
+_WS_RE = re.compile(r'\s+')
+_TRANS = str.maketrans({'(': '', ')': '', "'": '', '-': ' ', '_': ' '})
+_STYLE_TRANS = str.maketrans({' ': '', '-': '', '_': '', '/': ' '})
+
 
+@lru_cache(maxsize=200_000)  # Colorways repeat the same model names
 def normalize_text_for_embedding(text):
     """Normalize text for embeddings (lowercase, case insensitive)"""
     if not text:
         return ""
 
     # Expand abbreviations first (before removing punctuation)
-    text = re.sub(r'\bWmns\b', 'womens', text, flags=re.IGNORECASE)
-    text = re.sub(r'\(W\)', 'womens', text, flags=re.IGNORECASE)
+    text = _WMNS_RE.sub('womens', text)
+    text = _PARENW_RE.sub('womens', text)
 
     # Remove parentheses, single quotes, hyphens, underscores
-    text = text.replace('(', '').replace(')', '').replace("'", '').replace('-', ' ').replace('_', ' ')
+    text = text.translate(_TRANS)
 
     # Lowercase everything for case-insensitive matching
     text = text.lower()
 
     # Normalize multiple spaces
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
 
     return text.strip()
 
 
+@lru_cache(maxsize=200_000)
 def generate_embedding_text(name, style_id=None):
     """
     Generate embedding text with delimiter (works for both StockX and Alias)
@@ -73,10 +140,8 @@ def generate_embedding_text(name, style_id=None):
     normalized_name = normalize_text_for_embedding(name) if name else ""
 
     if style_id:
-        # Remove spaces, dashes, underscores first
-        normalized_style = style_id.replace(' ', '').replace('-', '').replace('_', '')
-        # THEN replace slashes with spaces (for multi-SKU products)
-        normalized_style = normalized_style.replace('/', ' ').lower()
+        # Remove spaces, dashes, underscores; slashes become spaces (for multi-SKU products)
+        normalized_style = style_id.translate(_STYLE_TRANS).lower()
         return f"{normalized_style} | {normalized_name}".strip()
 
     return normalized_name
@@ -86,82 +151,124 @@ def update_all_embedding_texts():
     """Update embedding_text for ALL products with normalized format"""
     print("\n🔄 Updating embedding_text for all products...")
 
-    conn = psycopg2.connect(**SUPABASE_CONFIG)
-    cur = conn.cursor()
+    with pg() as conn:
+        cur = conn.cursor()
 
-    # Fetch all products
-    cur.execute("""
-        SELECT product_id_internal, product_name_platform, style_id_platform
-        FROM products
-    """)
-
-    products = cur.fetchall()
-    total = len(products)
-    print(f"   ✅ Found {total:,} products to update\n")
-
-    # Update in batches
-    batch_size = 1000
-    updated = 0
+        cur.execute("SELECT count(*) FROM products")
+        total = cur.fetchone()[0]
+        print(f"   ✅ Found {total:,} products to update\n")
 
-    for i in range(0, total, batch_size):
-        batch = products[i:i + batch_size]
+        # Staging table for the batched UPDATE; columns take products' types
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS text_stage ON COMMIT DELETE ROWS AS
+            SELECT product_id_internal AS id, embedding_text AS etext
+            FROM products
+            WITH NO DATA
+        """)
+        conn.commit()
 
-        for product_id, name, style_id in batch:
-            embedding_text = generate_embedding_text(name, style_id)
+        # Stream products from a server-side cursor (WITH HOLD survives the
+        # per-batch commits) instead of loading all of them up front
+        batch_size = 5000
+        stream = conn.cursor(name='embedding_text_stream', withhold=True)
+        stream.itersize = batch_size
+        stream.execute("""
+            SELECT product_id_internal, product_name_platform, style_id_platform
+            FROM products
+        """)
 
+        # Update in batches
+        updated = 0
+
+        while True:
+            batch = stream.fetchmany(batch_size)
+            if not batch:
+                break
+
+            # COPY the batch into text_stage, then one UPDATE ... FROM
+            buf = io.StringIO()
+            csv.writer(buf).writerows(
+                (product_id, generate_embedding_text(name, style_id))
+                for product_id, name, style_id in batch
+            )
+            buf.seek(0)
+            cur.copy_expert("COPY text_stage (id, etext) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
             cur.execute("""
                 UPDATE products
-                SET embedding_text = %s
-                WHERE product_id_internal = %s
-            """, (embedding_text, product_id))
+                SET embedding_text = s.etext
+                FROM text_stage s
+                WHERE products.product_id_internal = s.id
+            """)
 
-        conn.commit()
-        updated += len(batch)
-        print(f"   Progress: {updated:,}/{total:,} ({updated/total*100:.1f}%)")
+            conn.commit()  # Also empties text_stage
+            updated += len(batch)
+            print(f"   Progress: {updated:,}/{total:,} ({updated/total*100:.1f}%)")
 
-    cur.close()
-    conn.close()
+        stream.close()
+        cur.close()
 
     print(f"\n✅ Updated {updated:,} embedding_text values\n")
     return updated
 
 
-def fetch_products_needing_embeddings(regenerate_all=False):
+# WHERE clause per mode: regenerate ALL, or NULL embeddings only
+PRODUCTS_NEEDING_EMBEDDINGS = {
+    True: "embedding_text IS NOT NULL",
+    False: "embedding IS NULL AND embedding_text IS NOT NULL",
+}
+
+
+def count_products_needing_embeddings(regenerate_all=False):
     """
-    Fetch products needing embeddings
+    Count products needing embeddings
 
     Args:
-        regenerate_all: If True, fetch ALL products (regenerate embeddings)
-                       If False, only fetch products with NULL embeddings
+        regenerate_all: If True, count ALL products (regenerate embeddings)
+                       If False, only count products with NULL embeddings
     """
-    print("\n📦 Fetching products needing embeddings...")
+    print("\n📦 Counting products needing embeddings...")
 
-    conn = psycopg2.connect(**SUPABASE_CONFIG)
-    cur = conn.cursor()
+    with pg() as conn:
+        cur = conn.cursor()
 
-    if regenerate_all:
-        print("   🔄 Mode: REGENERATE ALL (including existing embeddings)\n")
-        cur.execute("""
-            SELECT product_id_internal, embedding_text
-            FROM products
-            WHERE embedding_text IS NOT NULL
-            ORDER BY product_id_internal
-        """)
-    else:
-        print("   ➕ Mode: NEW ONLY (NULL embeddings)\n")
-        cur.execute("""
-            SELECT product_id_internal, embedding_text
-            FROM products
-            WHERE embedding IS NULL AND embedding_text IS NOT NULL
-            ORDER BY product_id_internal
-        """)
+        if regenerate_all:
+            print("   🔄 Mode: REGENERATE ALL (including existing embeddings)\n")
+        else:
+            print("   ➕ Mode: NEW ONLY (NULL embeddings)\n")
+        cur.execute(f"SELECT count(*) FROM products WHERE {PRODUCTS_NEEDING_EMBEDDINGS[regenerate_all]}")
+
+        total = cur.fetchone()[0]
+        cur.close()
 
-    products = cur.fetchall()
-    cur.close()
-    conn.close()
+    print(f"   ✅ Found {total:,} products\n")
+    return total
 
-    print(f"   ✅ Found {len(products):,} products\n")
-    return products
+
+def iter_products_needing_embeddings(regenerate_all=False, chunk=50000):
+    """
+    Yield lists of up to `chunk` (product_id, embedding_text) rows
+
+    Rows stream from a server-side cursor, so only one batch is held in
+    memory instead of every product.
+    """
+    with pg() as conn:
+        cur = conn.cursor(name='prod_iter')
+        cur.itersize = chunk
+
+        try:
+            cur.execute(f"""
+                SELECT product_id_internal, embedding_text
+                FROM products
+                WHERE {PRODUCTS_NEEDING_EMBEDDINGS[regenerate_all]}
+                ORDER BY product_id_internal
+            """)
+            while True:
+                rows = cur.fetchmany(chunk)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
 
 
 def create_batch_file(products, batch_num=1, filename_prefix='batch_input'):
@@ -169,18 +276,22 @@ def create_batch_file(products, batch_num=1, filename_prefix='batch_input'):
     filename = f"{filename_prefix}_{batch_num}.jsonl"
     print(f"📝 Creating batch file {batch_num}: {filename}")
 
-    with open(filename, 'w') as f:
-        for product_id, embedding_text in products:
-            request = {
-                "custom_id": str(product_id),
-                "method": "POST",
-                "url": "/v1/embeddings",
-                "body": {
-                    "model": "text-embedding-3-small",
-                    "input": embedding_text
-                }
-            }
-            f.write(json.dumps(request) + '\n')
+    # Binary with a 1MB buffer: one write syscall per ~thousands of lines.
+    # Lines are serialized 1000 at a time and written with one join.
+    with open(filename, 'wb', buffering=1 << 20) as f:
+        for start in range(0, len(products), 1000):
+            f.write(b''.join([
+                dumps_line({
+                    "custom_id": str(product_id),
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {
+                        "model": "text-embedding-3-small",
+                        "input": embedding_text
+                    }
+                })
+                for product_id, embedding_text in products[start:start + 1000]
+            ]))
 
     print(f"   ✅ Created {filename} with {len(products):,} requests\n")
     return filename
@@ -212,10 +323,14 @@ def upload_batch(filename, batch_num=1):
     return batch.id
 
 
-def check_batch_status(batch_id):
-    """Check status of batch job - returns ('status', output_file_id or None)"""
-    batch = client.batches.retrieve(batch_id)
+async def retrieve_batches(batch_ids):
+    """Fetch several batch jobs concurrently (one round trip's latency instead of one per job)"""
+    async with AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY')) as aclient:
+        return await asyncio.gather(*(aclient.batches.retrieve(batch_id) for batch_id in batch_ids))
+
 
+def check_batch_status(batch):
+    """Report status of a retrieved batch job - returns ('status', output_file_id or None)"""
     print(f"\n📊 Batch Status: {batch.status}")
     print(f"   Total requests: {batch.request_counts.total}")
     print(f"   Completed: {batch.request_counts.completed}")
@@ -232,41 +347,154 @@ def check_batch_status(batch_id):
         return (batch.status, None)
 
 
-def download_results(output_file_id, filename='batch_output.jsonl'):
-    """Download batch results (skip if already downloaded)"""
+def download_to(output_file_id, filename, chunks=None, stop=None):
+    """
+    Stream a results file to disk
+
+    Given `chunks`, each chunk is also put on it, followed by a None sentinel.
+    """
+    part = filename + '.part'
+    try:
+        with client.files.with_streaming_response.content(output_file_id) as response:
+            with open(part, 'wb') as f:
+                for chunk in response.iter_bytes(1 << 20):
+                    if stop is not None and stop.is_set():
+                        return
+                    f.write(chunk)
+                    if chunks is not None:
+                        chunks.put(chunk)
+        # Only a complete download is kept for a later rerun to reuse
+        os.replace(part, filename)
+    finally:
+        if chunks is not None:
+            chunks.put(None)
+
+
+def stream_results(output_file_id, filename='batch_output.jsonl'):
+    """
+    Yield batch result lines, downloading them if needed
+
+    A file left by an earlier run is read as is. Otherwise a background
+    thread downloads into `filename` while lines are yielded as chunks
+    arrive, so the Supabase update starts on the first MB instead of
+    waiting for the whole file.
+    """
 
     # Check if file already exists
     if os.path.exists(filename):
         print(f"📥 Results file already exists: {filename}")
         print(f"   ⏭️  Skipping download\n")
-        return filename
+        with open(filename, 'rb') as f:
+            yield from f
+        return
 
-    print(f"📥 Downloading results...")
+    print(f"📥 Streaming results into {filename}...")
+
+    chunks = queue.Queue(maxsize=4)
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        downloader = ex.submit(download_to, output_file_id, filename, chunks, stop)
+        try:
+            pending = b''
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                *lines, pending = (pending + chunk).split(b'\n')
+                for line in lines:
+                    if line:
+                        yield line
+            if pending:
+                yield pending
+        except BaseException:
+            # Unblock the downloader so the executor can shut down
+            stop.set()
+            while chunks.get() is not None:
+                pass
+            raise
+        downloader.result()  # Re-raise any download error
 
-    content = client.files.content(output_file_id)
+    print(f"   ✅ Downloaded: {filename}\n")
 
-    with open(filename, 'wb') as f:
-        f.write(content.read())
 
-    print(f"   ✅ Downloaded: {filename}\n")
-    return filename
+# Binary COPY framing: file header/trailer, and per row the field count,
+# an int8 id and a halfvec (int16 dim, int16 unused, big-endian float16s)
+_PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_PGCOPY_TRAILER = struct.pack('>h', -1)
+
+
+def embedding_column_type(cur):
+    """Type of products.embedding, e.g. 'halfvec(1536)' or 'vector(1536)'"""
+    cur.execute("""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    return cur.fetchone()[0]
+
+
+def flush_embeddings(conn, cur, chunk, binary):
+    """
+    COPY one chunk of (product_id, embedding) rows into upd_stage, then one UPDATE ... FROM
+
+    For a halfvec column (binary=True) rows go over in binary COPY format:
+    2 bytes per dimension (~3KB per product) instead of a ~10KB text
+    literal. A vector column gets full-precision text literals instead,
+    so float32 values aren't rounded to float16.
+    """
+    if binary:
+        buf = io.BytesIO()
+        buf.write(_PGCOPY_HEADER)
+        for product_id, embedding in chunk:
+            vec = np.asarray(embedding, dtype='>f2')
+            buf.write(struct.pack('>hiqihh', 2, 8, product_id, 4 + 2 * len(vec), len(vec), 0))
+            buf.write(vec.tobytes())
+        buf.write(_PGCOPY_TRAILER)
+        buf.seek(0)
+        cur.copy_expert("COPY upd_stage (id, emb) FROM STDIN WITH (FORMAT binary)", buf)
+    else:
+        buf = io.StringIO()
+        for product_id, embedding in chunk:
+            buf.write(f"{product_id}\t[{','.join(map(str, embedding))}]\n")
+        buf.seek(0)
+        cur.copy_expert("COPY upd_stage (id, emb) FROM STDIN", buf)
+    cur.execute("""
+        UPDATE products
+        SET embedding = s.emb
+        FROM upd_stage s
+        WHERE products.product_id_internal = s.id
+    """)
+    conn.commit()  # Also empties upd_stage
 
 
-def update_supabase_with_embeddings(results_file):
-    """Update Supabase products with embeddings from batch results"""
+def update_supabase_with_embeddings(results_lines):
+    """Update Supabase products with embeddings from batch result lines (see stream_results)"""
     print("💾 Updating Supabase with embeddings...")
 
-    conn = psycopg2.connect(**SUPABASE_CONFIG)
-    cur = conn.cursor()
+    with pg() as conn:
+        cur = conn.cursor()
+        # One-off bulk update: a crash just means re-running, so skip the WAL flush per commit
+        cur.execute("SET synchronous_commit = off")
+
+        # Staging table for the chunked UPDATE. Binary COPY (halfvec only)
+        # needs exact column types, so the id is fixed to bigint; emb always
+        # takes the column's own type
+        column_type = embedding_column_type(cur)
+        binary = column_type.startswith('halfvec')
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS upd_stage (id bigint, emb {column_type})
+            ON COMMIT DELETE ROWS
+        """)
+        conn.commit()
 
-    updated = 0
-    failed = 0
-    batch_updates = []
-    BATCH_SIZE = 5000  # Increased from 1000
+        updated = 0
+        failed = 0
+        chunk = []
+        CHUNK_SIZE = 10000  # Rows per COPY + UPDATE + commit
 
-    with open(results_file, 'r') as f:
-        for line in f:
-            result = json.loads(line)
+        for line in results_lines:
+            result = loads_line(line)
 
             if result.get('error'):
                 failed += 1
@@ -274,42 +502,22 @@ def update_supabase_with_embeddings(results_file):
 
             product_id = int(result['custom_id'])
             embedding = result['response']['body']['data'][0]['embedding']
-            batch_updates.append((embedding, product_id))
-
-            # Batch update every 5000 records
-            if len(batch_updates) >= BATCH_SIZE:
-                psycopg2.extras.execute_values(
-                    cur,
-                    """
-                    UPDATE products
-                    SET embedding = updates.embedding::vector
-                    FROM (VALUES %s) AS updates(embedding, product_id)
-                    WHERE products.product_id_internal = updates.product_id::integer
-                    """,
-                    batch_updates
-                )
-                conn.commit()
-                updated += len(batch_updates)
+            chunk.append((product_id, embedding))
+
+            if len(chunk) >= CHUNK_SIZE:
+                flush_embeddings(conn, cur, chunk, binary)
+                updated += len(chunk)
                 print(f"   Progress: {updated:,} updated")
-                batch_updates = []
-
-    # Insert remaining records
-    if batch_updates:
-        psycopg2.extras.execute_values(
-            cur,
-            """
-            UPDATE products
-            SET embedding = updates.embedding::vector
-            FROM (VALUES %s) AS updates(embedding, product_id)
-            WHERE products.product_id_internal = updates.product_id::integer
-            """,
-            batch_updates
-        )
-        conn.commit()
-        updated += len(batch_updates)
+                chunk = []
+
+        # Flush remaining records
+        if chunk:
+            flush_embeddings(conn, cur, chunk, binary)
+            updated += len(chunk)
 
-    cur.close()
-    conn.close()
+        cur.execute("RESET synchronous_commit")  # The connection goes back to the pool
+        conn.commit()
+        cur.close()
 
     print(f"\n✅ Updated {updated:,} products")
     print(f"❌ Failed {failed:,} products\n")
@@ -317,6 +525,27 @@ def update_supabase_with_embeddings(results_file):
     return updated, failed
 
 
+def countdown(seconds):
+    """Sleep `seconds`, printing the minutes left once a minute (against a deadline, so it doesn't drift)"""
+    deadline = time.monotonic() + seconds
+    while True:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        print(f"   ⏳ {int(left // 60) + 1} minutes remaining...", end='\r')
+        time.sleep(min(60, left))
+
+
+def save_batch_ids(batch_ids, total_batches, processed=()):
+    """Persist batch IDs, and which batch numbers are already in Supabase, for the next run"""
+    with open('batch_ids.json', 'w') as f:
+        json.dump({
+            'batch_ids': batch_ids,
+            'total_batches': total_batches,
+            'processed': list(processed)
+        }, f, indent=2)
+
+
 def main():
     print("\n" + "="*80)
     print("BATCH EMBEDDINGS GENERATION")
@@ -338,33 +567,77 @@ def main():
             batch_data = json.load(f)
             batch_ids = batch_data['batch_ids']
             total_batches = batch_data['total_batches']
+            processed = batch_data.get('processed', [])
 
         print(f"🔄 Found {len(batch_ids)} existing batch IDs")
         print("   Checking status of all batches...\n")
 
-        all_completed = True
         output_files = []
         failed_batches = []
 
+        # Poll every pending batch at once, then report in order
+        pending = [(i, batch_id) for i, batch_id in enumerate(batch_ids, 1) if i not in processed]
+        retrieved = dict(zip(
+            (i for i, _ in pending),
+            asyncio.run(retrieve_batches([batch_id for _, batch_id in pending]))
+        ))
+
         for i, batch_id in enumerate(batch_ids, 1):
+            if i in processed:
+                print(f"📊 Batch {i}/{total_batches}: {batch_id} (already in Supabase)")
+                continue
+
             print(f"📊 Batch {i}/{total_batches}: {batch_id}")
-            status, output_file_id = check_batch_status(batch_id)
+            status, output_file_id = check_batch_status(retrieved[i])
 
             if status == 'completed':
                 output_files.append((i, output_file_id))
             elif status == 'failed':
                 failed_batches.append(i)
-                all_completed = False
-            else:
-                all_completed = False
 
         # Show summary
         print(f"\n{'='*80}")
         print("BATCH STATUS SUMMARY")
         print(f"{'='*80}")
+        print(f"💾 Already in Supabase: {len(processed)}/{total_batches}")
         print(f"✅ Completed: {len(output_files)}/{total_batches}")
         print(f"❌ Failed: {len(failed_batches)}/{total_batches}")
-        print(f"⏳ Processing: {total_batches - len(output_files) - len(failed_batches)}/{total_batches}")
+        print(f"⏳ Processing: {total_batches - len(processed) - len(output_files) - len(failed_batches)}/{total_batches}")
+
+        # Ingest every batch that has finished, without waiting for the rest:
+        # each file is written to Supabase while it is still downloading
+        if output_files:
+            print(f"\n📥 Downloading results for {len(output_files)} completed batches...\n")
+
+            total_updated = 0
+            total_failed = 0
+
+            # The first file streams straight into Supabase; the rest download
+            # to disk in the background meanwhile (DOWNLOAD_CONCURRENCY at a time)
+            with ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as downloader:
+                prefetched = {
+                    batch_num: downloader.submit(download_to, output_file_id, f'batch_output_{batch_num}.jsonl')
+                    for batch_num, output_file_id in output_files[1:]
+                    if not os.path.exists(f'batch_output_{batch_num}.jsonl')
+                }
+
+                for batch_num, output_file_id in output_files:
+                    if batch_num in prefetched:
+                        prefetched[batch_num].result()  # Re-raise any download error
+                    results_lines = stream_results(output_file_id, filename=f'batch_output_{batch_num}.jsonl')
+                    updated, failed = update_supabase_with_embeddings(results_lines)
+                    total_updated += updated
+                    total_failed += failed
+
+                    processed.append(batch_num)
+                    save_batch_ids(batch_ids, total_batches, processed)
+
+            print(f"\n{'='*80}")
+            print("RESULTS - COMPLETED BATCHES")
+            print(f"{'='*80}")
+            print(f"✅ Total updated: {total_updated:,}")
+            print(f"❌ Total failed: {total_failed:,}")
+            print(f"📊 Batches processed: {len(processed)}/{total_batches}")
 
         if failed_batches:
             print(f"\n❌ Failed batch numbers: {failed_batches}")
@@ -374,35 +647,21 @@ def main():
             response = input("Choice (y/n): ")
 
             if response.lower() == 'y':
-                # Fetch products for failed batches
-                products = fetch_products_needing_embeddings(regenerate_all=False)
-
-                if not products:
-                    print("✅ No products need embeddings!")
-                    return
-
-                BATCH_SIZE_LIMIT = 50000
                 new_batch_ids = []
 
-                # Resubmit only failed batches
+                # Resubmit only failed batches, re-uploading the input file each
+                # was created from (other batches may already be in Supabase, so
+                # re-slicing the products still needing embeddings would shift)
                 for batch_num in failed_batches:
-                    start_idx = (batch_num - 1) * BATCH_SIZE_LIMIT
-                    end_idx = min(batch_num * BATCH_SIZE_LIMIT, len(products))
-
-                    if start_idx >= len(products):
-                        print(f"⚠️  Batch {batch_num} out of range, skipping")
+                    batch_file = f"batch_input_{batch_num}.jsonl"
+                    if not os.path.exists(batch_file):
+                        print(f"⚠️  {batch_file} not found, skipping batch {batch_num}")
                         continue
 
-                    batch_products = products[start_idx:end_idx]
-
                     print(f"\n{'='*80}")
                     print(f"Resubmitting Batch {batch_num}/{total_batches}")
-                    print(f"Products: {start_idx:,} to {end_idx:,} ({len(batch_products):,} items)")
                     print(f"{'='*80}\n")
 
-                    # Create batch file
-                    batch_file = create_batch_file(batch_products, batch_num=batch_num)
-
                     # Upload to OpenAI
                     new_batch_id = upload_batch(batch_file, batch_num=batch_num)
                     new_batch_ids.append(new_batch_id)
@@ -415,53 +674,19 @@ def main():
                         print(f"\n⏰ Waiting 20 minutes before submitting final failed batch...")
                         print(f"   Started at: {time.strftime('%I:%M:%S %p')}")
 
-                        for remaining in range(1200, 0, -60):
-                            mins = remaining // 60
-                            print(f"   ⏳ {mins} minutes remaining...", end='\r')
-                            time.sleep(60)
+                        countdown(1200)  # 20 min
 
                         print(f"\n   ✅ Wait complete! Submitting final batch...")
                         print(f"   Current time: {time.strftime('%I:%M:%S %p')}\n")
 
                 # Save updated batch IDs
-                with open('batch_ids.json', 'w') as f:
-                    json.dump({
-                        'batch_ids': batch_ids,
-                        'total_batches': total_batches
-                    }, f, indent=2)
+                save_batch_ids(batch_ids, total_batches, processed)
 
                 print(f"\n✅ Resubmitted {len(new_batch_ids)} failed batches!")
                 print(f"💾 Updated batch_ids.json\n")
                 return
 
-        if all_completed and len(output_files) == len(batch_ids):
-            # Download and process all results
-            print(f"\n✅ All {total_batches} batches completed! Downloading results...\n")
-
-            all_results = []
-            for batch_num, output_file_id in output_files:
-                results_file = download_results(output_file_id, filename=f'batch_output_{batch_num}.jsonl')
-                all_results.append(results_file)
-
-            # Update Supabase with all results
-            total_updated = 0
-            total_failed = 0
-
-            for results_file in all_results:
-                updated, failed = update_supabase_with_embeddings(results_file)
-                total_updated += updated
-                total_failed += failed
-
-            print(f"\n{'='*80}")
-            print("FINAL RESULTS - ALL BATCHES")
-            print(f"{'='*80}")
-            print(f"✅ Total updated: {total_updated:,}")
-            print(f"❌ Total failed: {total_failed:,}")
-            print(f"📊 Batches processed: {total_batches}")
-
-            # Cleanup
-
-
+        if len(processed) == total_batches:
             print("\n✅ All batch processing complete!\n")
         else:
             print(f"\n⏳ Run this script again later to check status.\n")
@@ -489,23 +714,23 @@ def main():
 
     regenerate_all = (response == '2')
 
-    # Fetch products
-    products = fetch_products_needing_embeddings(regenerate_all=regenerate_all)
+    # Count products (they are streamed batch by batch below)
+    total_products = count_products_needing_embeddings(regenerate_all=regenerate_all)
 
-    if not products:
+    if not total_products:
         print("✅ No products need embeddings!")
         return
 
     # Calculate number of batches needed (50K limit per batch)
     BATCH_SIZE_LIMIT = 50000
-    num_batches = (len(products) + BATCH_SIZE_LIMIT - 1) // BATCH_SIZE_LIMIT
+    num_batches = (total_products + BATCH_SIZE_LIMIT - 1) // BATCH_SIZE_LIMIT
 
     # Estimate cost
-    total_tokens = len(products) * 10  # ~10 tokens per product
+    total_tokens = total_products * 10  # ~10 tokens per product
     cost = total_tokens / 1_000_000 * 0.01  # $0.01 per 1M tokens
 
     print(f"💰 Estimated cost: ${cost:.2f}")
-    print(f"📊 Total products: {len(products):,}")
+    print(f"📊 Total products: {total_products:,}")
     print(f"📦 Number of batches: {num_batches}")
     print(f"⏱️  Estimated time: 24 hours max\n")
 
@@ -514,21 +739,37 @@ def main():
         print("❌ Cancelled")
         return
 
-    # Split products into batches and upload each
+    # Stream products in batches and upload each. The next batch file is
+    # written in the background while the current one uploads.
     batch_ids = []
+    batches = iter_products_needing_embeddings(regenerate_all=regenerate_all, chunk=BATCH_SIZE_LIMIT)
+    file_writer = ThreadPoolExecutor(max_workers=1)
+
+    def write_batch_file(i):
+        batch_products = next(batches, None)
+        if i + 1 == num_batches:
+            batches.close()  # Release the server-side cursor before the final wait
+        if batch_products is None:
+            return None  # Fewer products than counted (changed meanwhile)
+        return file_writer.submit(create_batch_file, batch_products, batch_num=i+1)
+
+    next_file = write_batch_file(0)
 
     for i in range(num_batches):
         start_idx = i * BATCH_SIZE_LIMIT
-        end_idx = min((i + 1) * BATCH_SIZE_LIMIT, len(products))
-        batch_products = products[start_idx:end_idx]
+        end_idx = min((i + 1) * BATCH_SIZE_LIMIT, total_products)
 
         print(f"\n{'='*80}")
         print(f"Processing Batch {i+1}/{num_batches}")
-        print(f"Products: {start_idx:,} to {end_idx:,} ({len(batch_products):,} items)")
+        print(f"Products: {start_idx:,} to {end_idx:,} ({end_idx - start_idx:,} items)")
         print(f"{'='*80}\n")
 
-        # Create batch file
-        batch_file = create_batch_file(batch_products, batch_num=i+1)
+        # Create batch file (started during the previous upload)
+        if next_file is None:
+            break
+        batch_file = next_file.result()
+        if i + 1 < num_batches:
+            next_file = write_batch_file(i + 1)
 
         # Upload to OpenAI
         batch_id = upload_batch(batch_file, batch_num=i+1)
@@ -540,23 +781,19 @@ def main():
             print(f"   This prevents hitting the 3M token queue limit")
             print(f"   Started at: {time.strftime('%I:%M:%S %p')}")
 
-            for remaining in range(1200, 0, -60):  # 20 min = 1200 seconds
-                mins = remaining // 60
-                print(f"   ⏳ {mins} minutes remaining...", end='\r')
-                time.sleep(60)
+            countdown(1200)  # 20 min
 
             print(f"\n   ✅ Wait complete! Submitting final batch...")
             print(f"   Current time: {time.strftime('%I:%M:%S %p')}\n")
 
+    file_writer.shutdown()
+    batches.close()
+
     # Save all batch IDs for later
-    with open('batch_ids.json', 'w') as f:
-        json.dump({
-            'batch_ids': batch_ids,
-            'total_batches': num_batches
-        }, f, indent=2)
+    save_batch_ids(batch_ids, len(batch_ids))
 
     print(f"\n{'='*80}")
-    print(f"✅ All {num_batches} batches submitted!")
+    print(f"✅ All {len(batch_ids)} batches submitted!")
     print(f"{'='*80}")
     print(f"📊 Total batch IDs: {len(batch_ids)}")
     print(f"💾 Saved to: batch_ids.json")
@@ -3,9 +3,11 @@ CREATE HNSW INDEX FOR PRODUCT EMBEDDINGS
 =========================================
 
 Creates optimized HNSW index for vector similarity search.
-Two modes:
+Three modes:
 1. Max performance (3.5GB RAM) - Best quality, use when nothing else running
-2. Conservative (default settings) - Safer, can run alongside other operations
+2. Conservative (1GB RAM, 2 workers) - Safer, can run alongside other operations
+3. Max performance, exclusive - Plain CREATE INDEX (no CONCURRENTLY), about
+   twice as fast but blocks writes to products; for a maintenance window
 
 Requirements:
 - All embeddings must be inserted first
@@ -27,6 +29,17 @@ SUPABASE_CONFIG = {
 }
 
 
+def embedding_opclass(cur):
+    """Cosine operator class matching the embedding column type (vector or halfvec)"""
+    cur.execute("""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    column_type = cur.fetchone()[0]
+    return 'halfvec_cosine_ops' if column_type.startswith('halfvec') else 'vector_cosine_ops'
+
+
 def drop_existing_index():
     """Drop existing index if it exists"""
     print("🗑️  Checking for existing index...")
@@ -58,10 +71,17 @@ def drop_existing_index():
     conn.close()
 
 
-def create_index_max_performance():
-    """Create HNSW index with maximum performance settings (3.5GB RAM)"""
+def create_index_max_performance(exclusive=False):
+    """
+    Create HNSW index with maximum performance settings (3.5GB RAM)
+
+    With exclusive=True the index is built with a plain CREATE INDEX in one
+    transaction instead of CONCURRENTLY: writes to products are blocked
+    until it finishes, but the build is a single pass (about half the time)
+    and the settings are SET LOCAL. Only for a maintenance window.
+    """
     print("\n" + "="*80)
-    print("CREATING HNSW INDEX - MAX PERFORMANCE MODE")
+    print("CREATING HNSW INDEX - MAX PERFORMANCE MODE" + (" (EXCLUSIVE)" if exclusive else ""))
     print("="*80)
     print("⚙️  Settings:")
     print("   - maintenance_work_mem: 3.5GB")
@@ -69,36 +89,48 @@ def create_index_max_performance():
     print("   - m: 32 (high quality)")
     print("   - ef_construction: 200 (high accuracy)")
     print("\n⚠️  WARNING: This will use almost all available RAM (4GB)")
-    print("⏱️  Estimated time: 10-30 minutes for 461K products\n")
+    if exclusive:
+        print("⚠️  WARNING: Writes to products are blocked until the index is built")
+        print("⏱️  Estimated time: 5-15 minutes for 461K products\n")
+    else:
+        print("⏱️  Estimated time: 10-30 minutes for 461K products\n")
 
     conn = psycopg2.connect(**SUPABASE_CONFIG)
-    conn.autocommit = True
+    conn.autocommit = not exclusive
     cur = conn.cursor()
 
+    # In the exclusive transaction the settings end with it
+    set_cmd = "SET LOCAL" if exclusive else "SET"
+
     try:
         # Set statement timeout to unlimited
         print("📝 Setting statement timeout to unlimited...")
-        cur.execute("SET statement_timeout = '0'")
+        cur.execute(f"{set_cmd} statement_timeout = '0'")
 
         # Max out maintenance memory
         print("📝 Setting maintenance_work_mem to 3.5GB...")
-        cur.execute("SET maintenance_work_mem = '3.5GB'")
+        cur.execute(f"{set_cmd} maintenance_work_mem = '3.5GB'")
 
         # Enable parallel workers
         print("📝 Setting max_parallel_maintenance_workers to 4...")
-        cur.execute("SET max_parallel_maintenance_workers = 4")
+        cur.execute(f"{set_cmd} max_parallel_maintenance_workers = 4")
 
         # Create index
         print("\n🚀 Creating HNSW index...")
         print("   (This will take a while - don't interrupt!)\n")
 
-        cur.execute("""
-            CREATE INDEX CONCURRENTLY products_embedding_idx
+        cur.execute(f"""
+            CREATE INDEX {'' if exclusive else 'CONCURRENTLY '}products_embedding_idx
             ON products
-            USING hnsw (embedding vector_cosine_ops)
+            USING hnsw (embedding {embedding_opclass(cur)})
             WITH (m = 32, ef_construction = 200)
         """)
 
+        if exclusive:
+            conn.commit()  # Also ends the SET LOCALs
+            print("\n✅ Index created successfully!\n")
+            return
+
         print("\n✅ Index created successfully!")
 
         # Reset settings
@@ -117,15 +149,16 @@ def create_index_max_performance():
 
 
 def create_index_conservative():
-    """Create HNSW index with conservative settings (default RAM)"""
+    """Create HNSW index with conservative settings (1GB RAM, 2 parallel workers)"""
     print("\n" + "="*80)
     print("CREATING HNSW INDEX - CONSERVATIVE MODE")
     print("="*80)
     print("⚙️  Settings:")
-    print("   - maintenance_work_mem: default")
+    print("   - maintenance_work_mem: 1GB")
+    print("   - max_parallel_maintenance_workers: 2")
     print("   - m: 16 (standard quality)")
     print("   - ef_construction: 64 (standard accuracy)")
-    print("\n⏱️  Estimated time: 15-45 minutes for 461K products\n")
+    print("\n⏱️  Estimated time: 10-25 minutes for 461K products\n")
 
     conn = psycopg2.connect(**SUPABASE_CONFIG)
     conn.autocommit = True
@@ -136,14 +169,23 @@ def create_index_conservative():
         print("📝 Setting statement timeout to unlimited...")
         cur.execute("SET statement_timeout = '0'")
 
+        # Enough memory for the graph to be built in RAM, and a parallel
+        # build. Plain SET: CONCURRENTLY can't run inside the transaction
+        # SET LOCAL needs, and this connection is closed right after.
+        print("📝 Setting maintenance_work_mem to 1GB...")
+        cur.execute("SET maintenance_work_mem = '1GB'")
+
+        print("📝 Setting max_parallel_maintenance_workers to 2...")
+        cur.execute("SET max_parallel_maintenance_workers = 2")
+
         # Create index
         print("\n🚀 Creating HNSW index...")
         print("   (This will take a while - don't interrupt!)\n")
 
-        cur.execute("""
+        cur.execute(f"""
             CREATE INDEX CONCURRENTLY products_embedding_idx
             ON products
-            USING hnsw (embedding vector_cosine_ops)
+            USING hnsw (embedding {embedding_opclass(cur)})
             WITH (m = 16, ef_construction = 64)
         """)
 
@@ -210,20 +252,25 @@ def main():
     print("\nThis script will create an HNSW index for product embeddings.")
     print("\nOptions:")
     print("  1 = Max performance (3.5GB RAM, m=32, ef_construction=200)")
-    print("  2 = Conservative (default settings, m=16, ef_construction=64)")
+    print("  2 = Conservative (1GB RAM, 2 workers, m=16, ef_construction=64)")
     print("  3 = Drop existing index only")
     print("  4 = Check index status")
+    print("  5 = Max performance, exclusive (blocks writes - maintenance window only)")
 
-    choice = input("\nChoice (1/2/3/4): ").strip()
+    choice = input("\nChoice (1/2/3/4/5): ").strip()
 
-    if choice == '1':
-        confirm = input("\n⚠️  Max performance mode will use 3.5GB RAM. Continue? (y/n): ")
+    if choice in ('1', '5'):
+        exclusive = (choice == '5')
+        if exclusive:
+            confirm = input("\n⚠️  Exclusive mode blocks all writes to products and uses 3.5GB RAM. Continue? (y/n): ")
+        else:
+            confirm = input("\n⚠️  Max performance mode will use 3.5GB RAM. Continue? (y/n): ")
         if confirm.lower() != 'y':
             print("❌ Cancelled")
             return
 
         drop_existing_index()
-        create_index_max_performance()
+        create_index_max_performance(exclusive=exclusive)
         check_index_status()
 
     elif choice == '2':
@@ -248,6 +295,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\n\n⚠️  Interrupted by user")
         print("⚠️  Note: CONCURRENTLY indexes can be safely interrupted")
+        print("   (an exclusive build is rolled back)")
     except Exception as e:
         print(f"\n❌ Error: {e}")
         import traceback
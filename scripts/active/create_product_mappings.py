@@ -124,7 +124,8 @@ def map_by_embedding_similarity(min_similarity=0.85):
         cur.execute("""
             SELECT
                 product_id_internal,
-                1 - (embedding <=> %s::vector) AS similarity
+                -- Untyped literal: takes the column's type (vector or halfvec)
+                1 - (embedding <=> %s) AS similarity
             FROM products
             WHERE platform = 'stockx'
               AND embedding IS NOT NULL
@@ -7,15 +7,29 @@ With cleaned embedding text (no special characters)
 
 Estimated cost: ~$11.30
 Estimated time: ~10 minutes (with batch inserts)
+
+Embeddings are cached in EMBED_CACHE_PATH, so a rerun after a crash
+only pays for texts that were never embedded.
 """
 
+import io
 import os
 import re
+import csv
 import time
+import queue
+import asyncio
+import hashlib
+import sqlite3
+import itertools
+import threading
+import numpy as np
 import pymysql
 import psycopg2
 import psycopg2.extras
-from openai import OpenAI
+from psycopg2 import sql
+from openai import AsyncOpenAI
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -36,8 +50,18 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
-client = OpenAI(api_key=OPENAI_API_KEY)
 BATCH_SIZE = 500
+MIGRATED_ID_BATCH_SIZE = 10000
+COMMIT_EVERY = 10  # Batches per transaction; a rerun redoes at most this many
+REBUILD_MEMORY_LADDER = ['2GB', '1GB', '512MB', '256MB']  # maintenance_work_mem per vector index rebuild attempt
+EMBED_CONCURRENCY = 8  # Embedding requests in flight at once (well under the 3K RPM limit)
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', 'embed_cache.sqlite3')  # Reruns skip already-paid embeddings
+
+# Compiled once; the normalizer runs for every product
+_WMNS_RE = re.compile(r'\bWmns\b', re.IGNORECASE)
+_WS_RE = re.compile(r'\s+')
+_TRANS = str.maketrans({"'": '', '-': ' ', '_': ' '})
+_SKU_TRANS = str.maketrans('', '', '-_ ')
 
 
 def normalize_text_for_embedding(text):
@@ -59,13 +83,13 @@ def normalize_text_for_embedding(text):
 
     # Expand abbreviations (case-insensitive replacements)
     # Wmns → (Women's) - match StockX pattern
-    text = re.sub(r'\bWmns\b', "(Women's)", text, flags=re.IGNORECASE)
+    text = _WMNS_RE.sub("(Women's)", text)
 
     # Remove single quotes ('), hyphens, underscores
-    text = text.replace("'", '').replace('-', ' ').replace('_', ' ')
+    text = text.translate(_TRANS)
 
     # Normalize multiple spaces
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
 
     return text.strip()
 
@@ -85,7 +109,7 @@ def generate_embedding_text_alias(name, sku=None):
 
     if sku:
         # Normalize SKU: remove ALL spaces, dashes, underscores (SKU part only)
-        normalized_sku = sku.replace('-', '').replace('_', '').replace(' ', '')
+        normalized_sku = sku.translate(_SKU_TRANS)
         return f"{normalized_sku} {normalized_name}".strip()
 
     return normalized_name
@@ -110,11 +134,11 @@ def normalize_style_id(style_id):
     return normalized if normalized else None
 
 
-def generate_embeddings_batch(texts, retry_count=3):
+async def generate_embeddings_batch(client, texts, retry_count=3):
     """Generate embeddings for multiple texts in ONE API call"""
     for attempt in range(retry_count):
         try:
-            response = client.embeddings.create(
+            response = await client.embeddings.create(
                 input=texts,
                 model="text-embedding-3-small"
             )
@@ -122,43 +146,455 @@ def generate_embeddings_batch(texts, retry_count=3):
         except Exception as e:
             if attempt < retry_count - 1:
                 print(f"   ⚠️  Retry {attempt + 1}/{retry_count}: {e}")
-                time.sleep(2 ** attempt)
+                await asyncio.sleep(2 ** attempt)
             else:
                 print(f"   ❌ Batch failed: {e}")
                 return None
     return None
 
 
+async def gather_with_limit(batches, limit=EMBED_CONCURRENCY):
+    """
+    Embed several text batches concurrently
+
+    At most `limit` requests are in flight; results come back in the
+    same order as `batches` (None for a batch that failed all retries).
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async with AsyncOpenAI(api_key=OPENAI_API_KEY) as client:
+        async def embed(texts):
+            async with semaphore:
+                return await generate_embeddings_batch(client, texts)
+
+        return await asyncio.gather(*(embed(texts) for texts in batches))
+
+
+PRODUCT_COLUMNS = (
+    'product_id_platform',
+    'platform',
+    'product_name_platform',
+    'style_id_platform',
+    'style_id_normalized',
+    'embedding_text',
+    'embedding',
+    'keyword_used',
+)
+
+# Session-local and unlogged; truncated after every batch. Only the loaded
+# columns, without products' defaults: a copied product_id_internal
+# nextval() default would burn a sequence value per staged row
+CREATE_STAGING_SQL = f"""
+    CREATE TEMPORARY TABLE IF NOT EXISTS products_staging AS
+    SELECT {', '.join(PRODUCT_COLUMNS)} FROM products
+    WITH NO DATA
+"""
+COPY_STAGING_SQL = (
+    f"COPY products_staging ({', '.join(PRODUCT_COLUMNS)}) "
+    "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+)
+INSERT_FROM_STAGING_SQL = f"""
+    INSERT INTO products ({', '.join(PRODUCT_COLUMNS)})
+    SELECT {', '.join(PRODUCT_COLUMNS)} FROM products_staging
+    ON CONFLICT (product_id_platform, platform) DO NOTHING
+    RETURNING product_id_platform, product_id_internal
+"""
+
+
+def embedding_is_halfvec(cur):
+    """True if products.embedding is halfvec (float16), False for vector"""
+    cur.execute("""
+        SELECT format_type(atttypid, NULL)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    return cur.fetchone()[0] == 'halfvec'
+
+
+def format_embedding(embedding, halfvec):
+    """
+    pgvector literal for the column's type
+
+    For halfvec, ~4 significant digits is all the column keeps, so the
+    COPY payload is roughly half the size of full float32 repr. A vector
+    column gets the full repr, so nothing is lost.
+    """
+    if halfvec:
+        return '[' + ','.join([f'{x:.4g}' for x in embedding]) + ']'
+    return '[' + ','.join(map(repr, embedding)) + ']'
+
+
+def insert_products(cur, values_list, halfvec):
+    """
+    Bulk load a batch of products through COPY
+
+    Rows are streamed into products_staging with COPY (far cheaper than
+    INSERT parsing per row), then moved into products with one
+    INSERT ... SELECT. Returns {catalog_id: product_id_internal} for the
+    rows actually inserted (conflicts return nothing).
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for values in values_list:
+        row = []
+        for value in values:
+            if value is None:
+                row.append('\\N')
+            elif isinstance(value, list):
+                row.append(format_embedding(value, halfvec))
+            else:
+                row.append(value)
+        writer.writerow(row)
+    buf.seek(0)
+
+    cur.copy_expert(COPY_STAGING_SQL, buf)
+    cur.execute(INSERT_FROM_STAGING_SQL)
+    id_map = {row[0]: row[1] for row in cur.fetchall()}
+    cur.execute("TRUNCATE products_staging")
+    return id_map
+
+
+def link_inventory(cur, id_map):
+    """Set product_id_internal on unlinked inventory rows for a batch of catalog IDs"""
+    if not id_map:
+        return 0
+
+    psycopg2.extras.execute_values(
+        cur,
+        """
+        UPDATE inventory AS i
+        SET product_id_internal = v.product_id_internal
+        FROM (VALUES %s) AS v(catalog_id, product_id_internal)
+        WHERE i.alias_catalog_id = v.catalog_id AND i.product_id_internal IS NULL
+        """,
+        list(id_map.items()),
+        page_size=len(id_map)
+    )
+    return cur.rowcount
+
+
+def cache_format(halfvec):
+    """(table, numpy dtype) of the embedding cache for a halfvec or vector column"""
+    return ('embeddings', np.float16) if halfvec else ('embeddings_f32', np.float32)
+
+
+def open_embedding_cache(halfvec, path=EMBED_CACHE_PATH):
+    """
+    Open the on-disk embedding cache (sha256(text) -> vector bytes)
+
+    Vectors are kept at the column's precision, float16 for halfvec and
+    float32 for vector, each in its own table so neither reads the other.
+    """
+    table, _ = cache_format(halfvec)
+    cache = sqlite3.connect(path)
+    cache.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            text_hash BLOB PRIMARY KEY,
+            vector BLOB NOT NULL
+        )
+    """)
+    return cache
+
+
+def embed_with_cache(cache, batch_texts, halfvec):
+    """
+    Embed text batches, sending only cache misses to OpenAI
+
+    Returns one embedding list per batch in input order, or None for a
+    batch whose misses failed all retries. New vectors are cached (~3KB
+    each as float16, ~6KB as float32) so a rerun after a crash costs
+    nothing to re-embed.
+    """
+    table, dtype = cache_format(halfvec)
+    batch_hashes = [[hashlib.sha256(text.encode()).digest() for text in texts] for texts in batch_texts]
+
+    batch_results = []
+    batch_misses = []
+    for texts, hashes in zip(batch_texts, batch_hashes):
+        rows = cache.execute(
+            f"SELECT text_hash, vector FROM {table} WHERE text_hash IN ({','.join('?' * len(hashes))})",
+            hashes
+        ).fetchall()
+        cached = {text_hash: vector for text_hash, vector in rows}
+
+        results = [None] * len(texts)
+        misses = []
+        for i, (text, text_hash) in enumerate(zip(texts, hashes)):
+            if text_hash in cached:
+                results[i] = np.frombuffer(cached[text_hash], dtype=dtype).astype(np.float32).tolist()
+            else:
+                misses.append((i, text))
+
+        batch_results.append(results)
+        batch_misses.append(misses)
+
+    # Only batches with misses go to the API
+    pending = [b for b, misses in enumerate(batch_misses) if misses]
+    fetched = asyncio.run(gather_with_limit([[text for _, text in batch_misses[b]] for b in pending]))
+
+    for b, embeddings in zip(pending, fetched):
+        if not embeddings or len(embeddings) != len(batch_misses[b]):
+            batch_results[b] = None
+            continue
+
+        for (i, _), embedding in zip(batch_misses[b], embeddings):
+            batch_results[b][i] = embedding
+            cache.execute(
+                f"INSERT OR REPLACE INTO {table} (text_hash, vector) VALUES (?, ?)",
+                (batch_hashes[b][i], np.asarray(embedding, dtype=dtype).tobytes())
+            )
+    cache.commit()
+
+    return batch_results
+
+
+def embed_windows(products, windows, stop, halfvec):
+    """
+    Embed products EMBED_CONCURRENCY batches at a time onto `windows`, then a None sentinel
+
+    Each item is (window_start, batches, batch_embeddings), where every
+    batch is a list of product rows in PRODUCT_COLUMNS order minus the
+    embedding. Only the windows waiting in the queue are held in memory.
+    """
+    window_size = BATCH_SIZE * EMBED_CONCURRENCY
+    products = iter(products)
+    window_start = 0
+    cache = open_embedding_cache(halfvec)  # sqlite connections stay on the thread that opened them
+    try:
+        while not stop.is_set():
+            window = list(itertools.islice(products, window_size))
+            if not window:
+                break
+
+            # Build each product's row once; the embedding text is field 5
+            prepared = [
+                (p['catalogId'], 'alias', (p['name'] or '').upper(), p['sku'],
+                 normalize_style_id(p['sku']), generate_embedding_text_alias(p['name'], p['sku']),
+                 p.get('keywordUsed'))
+                for p in window
+            ]
+            batches = [prepared[i:i + BATCH_SIZE] for i in range(0, len(prepared), BATCH_SIZE)]
+            batch_texts = [[row[5] for row in batch] for batch in batches]
+
+            # Generate embeddings concurrently (cache misses only)
+            batch_embeddings = embed_with_cache(cache, batch_texts, halfvec)
+
+            windows.put((window_start, batches, batch_embeddings))
+            window_start += len(window)
+    finally:
+        cache.close()
+        windows.put(None)
+
+
+def insert_batch(cur, batch, embeddings, batch_start, batch_end, stats, halfvec):
+    """Insert one embedded batch and link its inventory, updating stats in place"""
+    if not embeddings or len(embeddings) != len(batch):
+        print(f"   ❌ Batch {batch_start:,}-{batch_end:,} failed")
+        stats['failed'] += len(batch)
+        return
+
+    values_list = [row[:6] + (embedding,) + row[6:] for row, embedding in zip(batch, embeddings)]
+
+    # Bulk load all 500 products via COPY. Commits are grouped across
+    # batches (see main), so a failure only rolls back to this batch's savepoint.
+    cur.execute("SAVEPOINT batch")
+    try:
+        id_map = insert_products(cur, values_list, halfvec)
+        cur.execute("RELEASE SAVEPOINT batch")
+    except Exception as e:
+        print(f"   ⚠️  Batch {batch_start:,}-{batch_end:,} insert failed ({e}), retrying row by row")
+        cur.execute("ROLLBACK TO SAVEPOINT batch")
+
+        id_map = {}
+        for values in values_list:
+            cur.execute("SAVEPOINT product")
+            try:
+                id_map.update(insert_products(cur, [values], halfvec))
+                cur.execute("RELEASE SAVEPOINT product")
+            except Exception as row_error:
+                print(f"   ❌ {values[0]} insert failed: {row_error}")
+                stats['failed'] += 1
+                cur.execute("ROLLBACK TO SAVEPOINT product")
+        cur.execute("RELEASE SAVEPOINT batch")
+
+    stats['inserted'] += len(id_map)
+
+    # Link inventory to the new products in one UPDATE
+    cur.execute("SAVEPOINT inventory")
+    try:
+        stats['inventory_updated'] += link_inventory(cur, id_map)
+        cur.execute("RELEASE SAVEPOINT inventory")
+    except Exception as e:
+        print(f"   ❌ Batch {batch_start:,}-{batch_end:,} inventory update failed: {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT inventory")
+
+
+def stream_alias_products(mysql_conn):
+    """Yield alias products missing from tmp_migrated, streamed from MySQL as they arrive"""
+    # SSDictCursor streams rows instead of buffering the whole result client-side
+    mysql_cur = mysql_conn.cursor(pymysql.cursors.SSDictCursor)
+    try:
+        # Rows are read at embedding pace; don't let the server give up on us
+        mysql_cur.execute("SET SESSION net_write_timeout = 3600")
+        mysql_cur.execute("""
+            SELECT a.catalogId, a.name, a.sku, a.keywordUsed
+            FROM alias_products a
+            LEFT JOIN tmp_migrated m ON m.id = a.catalogId
+            WHERE m.id IS NULL
+        """)
+        yield from mysql_cur
+    finally:
+        mysql_cur.close()
+        mysql_conn.close()
+
+
 def fetch_remaining_alias_products():
-    """Fetch alias products not yet migrated"""
+    """
+    Find alias products not yet migrated
+
+    Already-migrated IDs are copied from Supabase into a MySQL temp table so
+    the anti-join runs in MySQL and only remaining rows cross the wire.
+    Returns (total, products) where products is a generator streaming rows
+    over the same session (the temp table is session-local).
+    """
     print("\n📦 Fetching remaining alias products from MySQL...")
 
-    # Get migrated IDs from Supabase
+    mysql_conn = pymysql.connect(**MYSQL_CONFIG)
+    mysql_cur = mysql_conn.cursor()
+    mysql_cur.execute("""
+        CREATE TEMPORARY TABLE tmp_migrated (
+            id VARCHAR(255) NOT NULL PRIMARY KEY
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+
+    # Copy migrated IDs from Supabase in chunks
     supa_conn = psycopg2.connect(**SUPABASE_CONFIG)
-    supa_cur = supa_conn.cursor()
+    supa_cur = supa_conn.cursor(name='migrated_ids')
+    supa_cur.itersize = MIGRATED_ID_BATCH_SIZE
     supa_cur.execute("SELECT product_id_platform FROM products WHERE platform = 'alias'")
-    migrated_ids = {row[0] for row in supa_cur.fetchall()}
+
+    migrated = 0
+    while True:
+        rows = supa_cur.fetchmany(MIGRATED_ID_BATCH_SIZE)
+        if not rows:
+            break
+        mysql_cur.executemany("INSERT IGNORE INTO tmp_migrated (id) VALUES (%s)", rows)
+        migrated += len(rows)
+
     supa_cur.close()
     supa_conn.close()
 
-    print(f"   Found {len(migrated_ids):,} already migrated")
+    print(f"   Found {migrated:,} already migrated")
 
-    # Fetch all from MySQL
-    mysql_conn = pymysql.connect(**MYSQL_CONFIG, cursorclass=pymysql.cursors.DictCursor)
-    mysql_cur = mysql_conn.cursor()
     mysql_cur.execute("""
-        SELECT catalogId, name, sku, keywordUsed
-        FROM alias_products
+        SELECT COUNT(*)
+        FROM alias_products a
+        LEFT JOIN tmp_migrated m ON m.id = a.catalogId
+        WHERE m.id IS NULL
     """)
-    all_products = mysql_cur.fetchall()
+    remaining = mysql_cur.fetchone()[0]
     mysql_cur.close()
-    mysql_conn.close()
 
-    # Filter out migrated
-    remaining = [p for p in all_products if p['catalogId'] not in migrated_ids]
+    print(f"   ✅ Found {remaining:,} remaining products to migrate\n")
+    return remaining, stream_alias_products(mysql_conn)
+
+
+def drop_vector_indexes():
+    """
+    Drop the vector indexes on products for the duration of the bulk load
+
+    Every inserted embedding would otherwise be added to the HNSW/IVFFlat
+    graph one at a time; building once after the load is much cheaper.
+    Returns the dropped indexes' definitions so they can be rebuilt.
+    """
+    conn = psycopg2.connect(**SUPABASE_CONFIG)
+    conn.autocommit = True  # Required for DROP INDEX CONCURRENTLY
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = 'products'::regclass
+          AND am.amname IN ('hnsw', 'ivfflat')
+    """)
+    indexes = cur.fetchall()
+
+    for name, _ in indexes:
+        print(f"   🗑️  Dropping {name} for the bulk load")
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+
+    cur.close()
+    conn.close()
+    return indexes
+
 
-    print(f"   ✅ Found {len(remaining):,} remaining products to migrate\n")
-    return remaining
+def drop_invalid_index(name):
+    """Drop a half-built (INVALID) index a failed CREATE INDEX CONCURRENTLY left behind"""
+    conn = psycopg2.connect(**SUPABASE_CONFIG)
+    conn.autocommit = True  # Required for DROP INDEX CONCURRENTLY
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT 1
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = 'products'::regclass
+              AND c.relname = %s
+              AND NOT i.indisvalid
+        """, (name,))
+        if cur.fetchone():
+            print(f"   🗑️  Dropping invalid leftover {name}")
+            cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+    finally:
+        cur.close()
+        conn.close()
+
+
+def rebuild_vector_indexes(indexes):
+    """
+    Recreate indexes dropped by drop_vector_indexes() from their saved definitions
+
+    Each index steps down REBUILD_MEMORY_LADDER until a build succeeds
+    (Supabase instances can run out of memory at 2GB). Returns the
+    (name, definition) of any index no step could build.
+    """
+    unbuilt = []
+
+    for name, definition in indexes:
+        print(f"\n🔨 Rebuilding {name}...")
+
+        for memory in REBUILD_MEMORY_LADDER:
+            rebuild_start = time.time()
+            conn = None
+            try:
+                conn = psycopg2.connect(**SUPABASE_CONFIG)
+                conn.autocommit = True  # Required for CREATE INDEX CONCURRENTLY
+                cur = conn.cursor()
+                cur.execute("SET statement_timeout = '0'")
+                cur.execute(sql.SQL("SET maintenance_work_mem = {}").format(sql.Literal(memory)))
+                cur.execute(definition.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1))
+                print(f"   ✅ Rebuilt in {(time.time() - rebuild_start)/60:.1f} minutes (maintenance_work_mem {memory})")
+                break
+            except psycopg2.Error as e:
+                print(f"   ⚠️  Failed with maintenance_work_mem {memory}: {e}")
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            # Otherwise the next attempt fails with "already exists"
+            try:
+                drop_invalid_index(name)
+            except psycopg2.Error as e:
+                print(f"   ❌ Could not drop the invalid leftover: {e}")
+                unbuilt.append((name, definition))
+                break
+        else:
+            unbuilt.append((name, definition))
+
+    return unbuilt
 
 
 def main():
@@ -167,8 +603,7 @@ def main():
     print("="*80)
 
     # Fetch remaining products
-    products = fetch_remaining_alias_products()
-    total = len(products)
+    total, products = fetch_remaining_alias_products()
 
     if total == 0:
         print("✅ No remaining products to migrate!")
@@ -186,103 +621,71 @@ def main():
     print(f"\n🚀 Processing {total:,} products in batches of {BATCH_SIZE}...\n")
     start_time = time.time()
 
+    vector_indexes = drop_vector_indexes()
+
     conn = psycopg2.connect(**SUPABASE_CONFIG)
     cur = conn.cursor()
+    # One-off load: a crash just means re-running, so skip the WAL flush per commit
+    cur.execute("SET synchronous_commit = off")
+    cur.execute(CREATE_STAGING_SQL)
+    conn.commit()
+    halfvec = embedding_is_halfvec(cur)
 
     stats = {'inserted': 0, 'failed': 0, 'inventory_updated': 0}
+    processed = 0
+    batches_done = 0  # Since the last commit
 
-    # Process in batches
-    for batch_start in range(0, total, BATCH_SIZE):
-        batch_end = min(batch_start + BATCH_SIZE, total)
-        batch = products[batch_start:batch_end]
-
-        # Prepare embedding texts
-        texts = []
-        for p in batch:
-            embedding_text = generate_embedding_text_alias(p['name'], p['sku'])
-            texts.append(embedding_text)
-
-        # Generate embeddings
-        embeddings = generate_embeddings_batch(texts)
-
-        if not embeddings or len(embeddings) != len(batch):
-            print(f"   ❌ Batch {batch_start:,}-{batch_end:,} failed")
-            stats['failed'] += len(batch)
-            continue
-
-        # Batch insert into products using execute_values (FAST!)
-        try:
-            values_list = []
-            for product, embedding_text, embedding in zip(batch, texts, embeddings):
-                values_list.append((
-                    product['catalogId'],
-                    'alias',
-                    (product['name'] or '').upper(),
-                    product['sku'],
-                    normalize_style_id(product['sku']),
-                    embedding_text,
-                    embedding,
-                    product.get('keywordUsed')
-                ))
-
-            # Batch insert all 500 products in ONE query
-            psycopg2.extras.execute_values(
-                cur,
-                """
-                INSERT INTO products (
-                    product_id_platform,
-                    platform,
-                    product_name_platform,
-                    style_id_platform,
-                    style_id_normalized,
-                    embedding_text,
-                    embedding,
-                    keyword_used
-                ) VALUES %s
-                ON CONFLICT (product_id_platform, platform) DO NOTHING
-                """,
-                values_list,
-                template="(%s, %s, %s, %s, %s, %s, %s::vector, %s)"
-            )
-
-            stats['inserted'] += len(batch)
-            conn.commit()
-
-            # Update inventory in batch (get product_id_internal for each catalog_id)
-            catalog_ids = [p['catalogId'] for p in batch]
-            cur.execute("""
-                SELECT product_id_platform, product_id_internal
-                FROM products
-                WHERE product_id_platform = ANY(%s) AND platform = 'alias'
-            """, (catalog_ids,))
-
-            id_map = {row[0]: row[1] for row in cur.fetchall()}
-
-            # Batch update inventory
-            for catalog_id, product_id_internal in id_map.items():
-                cur.execute("""
-                    UPDATE inventory
-                    SET product_id_internal = %s
-                    WHERE alias_catalog_id = %s AND product_id_internal IS NULL
-                """, (product_id_internal, catalog_id))
+    # Embedding (OpenAI) and inserts (Supabase) run side by side: a producer
+    # thread embeds the next window while this thread inserts the previous one
+    windows = queue.Queue(maxsize=2)
+    stop = threading.Event()
 
-                if cur.rowcount > 0:
-                    stats['inventory_updated'] += cur.rowcount
-
-            conn.commit()
-
-        except Exception as e:
-            print(f"   ❌ Batch {batch_start:,}-{batch_end:,} insert failed: {e}")
-            stats['failed'] += len(batch)
-            conn.rollback()
-
-        # Progress
-        elapsed = time.time() - start_time
-        rate = batch_end / elapsed if elapsed > 0 else 0
-        eta = (total - batch_end) / rate if rate > 0 else 0
-
-        print(f"   Progress: {batch_end:,}/{total:,} ({batch_end/total*100:.1f}%)")
-        print(f"   Rate: {rate:.0f} products/sec | ETA: {eta/60:.1f}min\n")
+    loaded = False
+    try:
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            producer = ex.submit(embed_windows, products, windows, stop, halfvec)
+            try:
+                while True:
+                    item = windows.get()
+                    if item is None:
+                        break
+
+                    window_start, batches, batch_embeddings = item
+                    for i, (batch, embeddings) in enumerate(zip(batches, batch_embeddings)):
+                        batch_start = window_start + i * BATCH_SIZE
+                        batch_end = batch_start + len(batch)
+                        insert_batch(cur, batch, embeddings, batch_start, batch_end, stats, halfvec)
+
+                        # Group commit: one WAL flush per COMMIT_EVERY batches
+                        batches_done += 1
+                        if batches_done >= COMMIT_EVERY:
+                            conn.commit()
+                            batches_done = 0
+                    processed = batch_end
+
+                    # Progress
+                    elapsed = time.time() - start_time
+                    rate = batch_end / elapsed if elapsed > 0 else 0
+                    eta = (total - batch_end) / rate if rate > 0 else 0
+
+                    print(f"   Progress: {batch_end:,}/{total:,} ({batch_end/total*100:.1f}%)")
+                    print(f"   Rate: {rate:.0f} products/sec | ETA: {eta/60:.1f}min\n")
+            except BaseException:
+                # Unblock the producer so the executor can shut down
+                stop.set()
+                while windows.get() is not None:
+                    pass
+                raise
+            producer.result()  # Re-raise any embedding error
+        conn.commit()
+        loaded = True
+    finally:
+        if not loaded:
+            for name, definition in vector_indexes:
+                print(f"\n⚠️  {name} was dropped for the load; recreate it with:\n   {definition}")
+
+    for name, definition in rebuild_vector_indexes(vector_indexes):
+        print(f"\n❌ {name} could not be rebuilt; once memory allows, recreate it with:\n   {definition}")
 
     # Final stats
     elapsed = time.time() - start_time
@@ -293,8 +696,8 @@ def main():
     print(f"🔗 Inventory Updated:  {stats['inventory_updated']:,}")
     print(f"❌ Failed:             {stats['failed']:,}")
     print(f"\n⏱️  Total time: {elapsed/60:.2f} minutes")
-    print(f"⚡ Rate: {total/elapsed:.0f} products/sec")
-    print(f"💰 Actual cost: ${total * 0.02 / 1000000:.2f}")
+    print(f"⚡ Rate: {processed/elapsed:.0f} products/sec")
+    print(f"💰 Actual cost: ${processed * 0.02 / 1000000:.2f}")
 
     cur.close()
     conn.close()
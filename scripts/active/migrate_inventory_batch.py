@@ -5,18 +5,21 @@ Migrate Inventory from MySQL to Supabase - BATCH VERSION
 Optimizations:
 1. Batch product lookups (query multiple names at once)
 2. Batch database inserts (500 rows at once)
-3. Parallel processing where possible
+3. Parallel inserts over a small connection pool
 
 Speed: ~10-20x faster than v2
 """
 
 import os
 import re
+import functools
 import pymysql
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from operator import itemgetter
 from dotenv import load_dotenv
-from collections import defaultdict
 
 load_dotenv()
 
@@ -37,8 +40,36 @@ SUPABASE_CONFIG = {
 }
 
 BATCH_SIZE = 500  # Items per batch
+INSERT_WORKERS = 6  # Concurrent insert connections (each batch waits a full RTT otherwise)
+
+# Best product per item name, chosen server-side: exact name match (both
+# UPPERCASE), preferring a style_id_platform that contains the style ID
+# from the item's brackets. match_count drives exact vs multi-match stats.
+# Prepared once per connection so each batch skips parse/plan.
+PREPARE_BEST_MATCH_SQL = """
+    PREPARE best_match (text[], text[]) AS
+    SELECT DISTINCT ON (v.name)
+        v.name,
+        p.product_id_internal,
+        p.product_name_platform,
+        p.platform,
+        COUNT(*) OVER (PARTITION BY v.name) AS match_count
+    FROM unnest($1, $2) AS v(name, style_id)
+    JOIN products p ON p.product_name_platform = v.name
+    ORDER BY
+        v.name,
+        position(lower(v.style_id) IN lower(coalesce(p.style_id_platform, ''))) > 0 DESC NULLS LAST
+"""
+
+# Compiled once; the normalizers run for every inventory row.
+# Inventory repeats the same item names many times (one row per pair), so
+# the normalizers are also memoized per distinct name.
+_BRACKETS_RE = re.compile(r'\s*\[.*?\]\s*')
+_BRACKET_RE = re.compile(r'\[([^\]]+)\]')
+_WS_RE = re.compile(r'\s+')
 
 
+@functools.lru_cache(maxsize=None)
 def normalize_item_name(item_name):
     """
     Normalize item name for matching
@@ -48,21 +79,22 @@ def normalize_item_name(item_name):
         return None
 
     # Remove style ID in brackets
-    name = re.sub(r'\s*\[.*?\]\s*', '', item_name)
+    name = _BRACKETS_RE.sub('', item_name)
 
     # UPPERCASE, strip, normalize spaces
     name = name.upper().strip()
-    name = re.sub(r'\s+', ' ', name)
+    name = _WS_RE.sub(' ', name)
 
     return name
 
 
+@functools.lru_cache(maxsize=None)
 def extract_style_id_from_item(item_name):
     """Extract style ID from brackets if present"""
     if not item_name:
         return None
 
-    match = re.search(r'\[([^\]]+)\]', item_name)
+    match = _BRACKET_RE.search(item_name)
     return match.group(1) if match else None
 
 
@@ -90,6 +122,7 @@ def build_item_to_product_cache_batch(inventory_items):
     # Query Supabase in batches
     conn = psycopg2.connect(**SUPABASE_CONFIG)
     cur = conn.cursor()
+    cur.execute(PREPARE_BEST_MATCH_SQL)
 
     cache = {}
     stats = {'exact_match': 0, 'no_match': 0, 'multiple_match': 0}
@@ -99,67 +132,37 @@ def build_item_to_product_cache_batch(inventory_items):
 
     for batch_idx in range(0, len(unique_names), BATCH_SIZE):
         batch_names = unique_names[batch_idx:batch_idx + BATCH_SIZE]
+        batch_styles = [unique_items[name]['style_id'] for name in batch_names]
 
-        # Query multiple names at once using ANY array
-        cur.execute("""
-            SELECT product_id_internal, product_name_platform, platform, style_id_platform
-            FROM products
-            WHERE product_name_platform = ANY(%s::text[])
-        """, (batch_names,))
-
-        results = cur.fetchall()
-
-        # Group results by name
-        name_to_matches = defaultdict(list)
-        for row in results:
-            product_id, name, platform, style_id = row
-            name_to_matches[name].append({
-                'product_id_internal': product_id,
-                'matched_name': name,
-                'platform': platform,
-                'style_id_platform': style_id
-            })
-
-        # Process each name in batch
-        for normalized_name in batch_names:
-            matches = name_to_matches.get(normalized_name, [])
+        # Query multiple names at once; one row back per matched name
+        cur.execute("EXECUTE best_match (%s, %s)", (batch_names, batch_styles))
 
-            if len(matches) == 1:
+        for name, product_id, matched_name, platform, match_count in cur.fetchall():
+            if match_count == 1:
                 # Single exact match
                 stats['exact_match'] += 1
-                cache[normalized_name] = {
-                    'product_id_internal': matches[0]['product_id_internal'],
-                    'matched_name': matches[0]['matched_name'],
-                    'platform': matches[0]['platform'],
-                    'confidence': 'exact'
-                }
-            elif len(matches) > 1:
-                # Multiple matches - prioritize by style ID
-                stats['multiple_match'] += 1
-                extracted_style = unique_items[normalized_name]['style_id']
-
-                best_match = matches[0]
-                if extracted_style:
-                    for match in matches:
-                        style_id = match.get('style_id_platform', '')
-                        if style_id and extracted_style.lower() in style_id.lower():
-                            best_match = match
-                            break
-
-                cache[normalized_name] = {
-                    'product_id_internal': best_match['product_id_internal'],
-                    'matched_name': best_match['matched_name'],
-                    'platform': best_match['platform'],
-                    'confidence': 'multi-match'
-                }
+                confidence = 'exact'
             else:
-                # No match
-                stats['no_match'] += 1
-                cache[normalized_name] = None
+                # Multiple matches - best by style ID already picked in SQL
+                stats['multiple_match'] += 1
+                confidence = 'multi-match'
+
+            cache[name] = {
+                'product_id_internal': product_id,
+                'matched_name': matched_name,
+                'platform': platform,
+                'confidence': confidence
+            }
 
         batch_num = (batch_idx // BATCH_SIZE) + 1
         print(f"   Batch {batch_num}/{total_batches} complete ({batch_idx + len(batch_names):,}/{len(unique_names):,})")
 
+    # No match
+    for normalized_name in unique_names:
+        if normalized_name not in cache:
+            stats['no_match'] += 1
+            cache[normalized_name] = None
+
     cur.close()
     conn.close()
 
@@ -172,55 +175,57 @@ def build_item_to_product_cache_batch(inventory_items):
     return cache
 
 
+# MySQL camelCase -> Supabase snake_case inventory columns
+INVENTORY_COLUMN_MAP = {
+    'sku': 'sku',
+    'sold': 'sold',
+    'datePurchase': 'date_purchase',
+    'placeOfPurchase': 'place_of_purchase',
+    'item': 'item',
+    'size': 'size',
+    'costPrice': 'cost_price',
+    'salesTax': 'sales_tax',
+    'additionalCost': 'additional_cost',
+    'rebate': 'rebate',
+    'totalCost': 'total_cost',
+    'reshippingCost': 'reshipping_cost',
+    'reshippingDuties': 'reshipping_duties',
+    'reshippingReferenceNumber': 'reshipping_reference_number',
+    'paymentMethod': 'payment_method_primary',
+    'salesTaxRefunded': 'sales_tax_refunded',
+    'salesTaxRefundDepositDate': 'sales_tax_refund_deposit_date',
+    'salesTaxRefundDepositAccount': 'sales_tax_refund_deposit_account',
+    'salesTaxRefundReferenceNumber': 'sales_tax_refund_reference_number',
+    'salesTaxRefundTotalAmount': 'sales_tax_refund_total_amount',
+    'refundDate': 'refund_date',
+    'location': 'location',
+    'plannedSalesMethod': 'planned_sales_method',
+    'referenceNumber': 'reference_number',
+    'deliveryDate': 'delivery_date',
+    'verificationDate': 'verification_date',
+    'createdAt': 'created_at',
+    'stockx_productId': 'stockx_product_id',
+    'stockx_variantId': 'stockx_variant_id',
+    'alias_catalog_id': 'alias_catalog_id',
+    'styleId': 'style_id',
+    'poolId': 'pool_id',
+    'poolKey': 'pool_key',
+    'comment': 'comment',
+    'updatedVia': 'updated_via',
+    'saleTrackerRowIndex': 'sale_tracker_row_index',
+}
+INVENTORY_COLUMN_ITEMS = tuple(INVENTORY_COLUMN_MAP.items())
+BOOL_COLUMNS = ('sold', 'sales_tax_refunded')
+
+
 def transform_inventory_item(item, item_cache):
     """Transform MySQL inventory item to Supabase format"""
-    transformed = {}
-
-    # Column mapping
-    column_map = {
-        'sku': 'sku',
-        'sold': 'sold',
-        'datePurchase': 'date_purchase',
-        'placeOfPurchase': 'place_of_purchase',
-        'item': 'item',
-        'size': 'size',
-        'costPrice': 'cost_price',
-        'salesTax': 'sales_tax',
-        'additionalCost': 'additional_cost',
-        'rebate': 'rebate',
-        'totalCost': 'total_cost',
-        'reshippingCost': 'reshipping_cost',
-        'reshippingDuties': 'reshipping_duties',
-        'reshippingReferenceNumber': 'reshipping_reference_number',
-        'paymentMethod': 'payment_method_primary',
-        'salesTaxRefunded': 'sales_tax_refunded',
-        'salesTaxRefundDepositDate': 'sales_tax_refund_deposit_date',
-        'salesTaxRefundDepositAccount': 'sales_tax_refund_deposit_account',
-        'salesTaxRefundReferenceNumber': 'sales_tax_refund_reference_number',
-        'salesTaxRefundTotalAmount': 'sales_tax_refund_total_amount',
-        'refundDate': 'refund_date',
-        'location': 'location',
-        'plannedSalesMethod': 'planned_sales_method',
-        'referenceNumber': 'reference_number',
-        'deliveryDate': 'delivery_date',
-        'verificationDate': 'verification_date',
-        'createdAt': 'created_at',
-        'stockx_productId': 'stockx_product_id',
-        'stockx_variantId': 'stockx_variant_id',
-        'alias_catalog_id': 'alias_catalog_id',
-        'styleId': 'style_id',
-        'poolId': 'pool_id',
-        'poolKey': 'pool_key',
-        'comment': 'comment',
-        'updatedVia': 'updated_via',
-        'saleTrackerRowIndex': 'sale_tracker_row_index',
-    }
-
-    for mysql_col, supa_col in column_map.items():
-        value = item.get(mysql_col)
-        if supa_col in ['sold', 'sales_tax_refunded'] and value is not None:
-            value = bool(value)
-        transformed[supa_col] = value
+    # One comprehension over the prebuilt (mysql, supabase) pairs; only the two
+    # boolean columns need converting
+    transformed = {supa_col: item.get(mysql_col) for mysql_col, supa_col in INVENTORY_COLUMN_ITEMS}
+    for supa_col in BOOL_COLUMNS:
+        if transformed[supa_col] is not None:
+            transformed[supa_col] = bool(transformed[supa_col])
 
     # Link to products via item name cache
     item_name = item.get('item')
@@ -244,9 +249,6 @@ def insert_to_supabase_batch(inventory_items):
     """Insert transformed inventory into Supabase using BATCH inserts"""
     print(f"\n💾 Inserting {len(inventory_items):,} items into Supabase (BATCH MODE)...\n")
 
-    conn = psycopg2.connect(**SUPABASE_CONFIG)
-    cur = conn.cursor()
-
     stats = {'inserted': 0, 'failed': 0, 'linked': 0, 'unlinked': 0}
 
     columns = ['sku', 'sold', 'date_purchase', 'place_of_purchase', 'item', 'size',
@@ -264,6 +266,9 @@ def insert_to_supabase_batch(inventory_items):
     column_str = ', '.join(columns)
     placeholders = ', '.join(['%s'] * len(columns))
 
+    # transform_inventory_item sets every column, so one C-level call builds each row
+    get_row = itemgetter(*columns)
+
     insert_sql = f"""
         INSERT INTO inventory ({column_str})
         VALUES %s
@@ -275,41 +280,53 @@ def insert_to_supabase_batch(inventory_items):
 
     total_batches = (len(inventory_items) + BATCH_SIZE - 1) // BATCH_SIZE
 
-    for batch_idx in range(0, len(inventory_items), BATCH_SIZE):
-        batch = inventory_items[batch_idx:batch_idx + BATCH_SIZE]
+    def insert_batch(batch):
+        """Upsert one batch on a pooled connection"""
+        values_list = [get_row(item) for item in batch]
 
+        conn = pool.getconn()
         try:
-            # Prepare batch values
-            values_list = []
-            for item in batch:
-                values = tuple(item.get(col) for col in columns)
-                values_list.append(values)
-
-                if item['product_id_internal']:
-                    stats['linked'] += 1
-                else:
-                    stats['unlinked'] += 1
-
-            # Execute batch insert using execute_values
-            psycopg2.extras.execute_values(
-                cur, insert_sql, values_list,
-                template=f"({placeholders})",
-                page_size=BATCH_SIZE
-            )
-
-            stats['inserted'] += len(batch)
+            with conn.cursor() as cur:
+                # Execute batch insert using execute_values
+                psycopg2.extras.execute_values(
+                    cur, insert_sql, values_list,
+                    template=f"({placeholders})",
+                    page_size=BATCH_SIZE
+                )
             conn.commit()
-
-            batch_num = (batch_idx // BATCH_SIZE) + 1
-            print(f"   Batch {batch_num}/{total_batches} complete ({batch_idx + len(batch):,}/{len(inventory_items):,})")
-
-        except Exception as e:
-            stats['failed'] += len(batch)
-            print(f"   ❌ Batch failed: {e}")
+        except Exception:
             conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
 
-    cur.close()
-    conn.close()
+    for item in inventory_items:
+        if item['product_id_internal']:
+            stats['linked'] += 1
+        else:
+            stats['unlinked'] += 1
+
+    # Several batches in flight at once on separate connections, so the
+    # round-trip for one overlaps the server work for the others
+    pool = psycopg2.pool.ThreadedConnectionPool(INSERT_WORKERS, INSERT_WORKERS, **SUPABASE_CONFIG)
+    try:
+        with ThreadPoolExecutor(max_workers=INSERT_WORKERS) as ex:
+            futures = {
+                ex.submit(insert_batch, inventory_items[batch_idx:batch_idx + BATCH_SIZE]): batch_idx
+                for batch_idx in range(0, len(inventory_items), BATCH_SIZE)
+            }
+
+            for done, future in enumerate(as_completed(futures), 1):
+                batch_size = min(BATCH_SIZE, len(inventory_items) - futures[future])
+                try:
+                    future.result()
+                    stats['inserted'] += batch_size
+                    print(f"   Batch {done}/{total_batches} complete ({stats['inserted']:,}/{len(inventory_items):,})")
+                except Exception as e:
+                    stats['failed'] += batch_size
+                    print(f"   ❌ Batch failed: {e}")
+    finally:
+        pool.closeall()
 
     return stats
 
@@ -11,11 +11,17 @@ Steps:
 3. Regenerate embeddings using batch API
 """
 
+import io
 import os
 import re
+import csv
 import time
-from openai import OpenAI
+import queue
+import asyncio
+import threading
+from openai import AsyncOpenAI
 import psycopg2
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,8 +36,13 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
-client = OpenAI(api_key=OPENAI_API_KEY)
 BATCH_SIZE = 500
+EMBED_CONCURRENCY = 8  # Embedding requests in flight at once (well under the 3K RPM limit)
+
+# Compiled once; the cleaner runs for every product
+_WMNS_RE = re.compile(r'\bWmns\b', re.IGNORECASE)
+_WS_RE = re.compile(r'\s+')
+_TRANS = str.maketrans({"'": '', '-': ' ', '_': ' '})
 
 
 def clean_embedding_text(text):
@@ -49,36 +60,43 @@ def clean_embedding_text(text):
     if not text:
         return text
 
-    # Split into SKU and name parts
-    parts = text.split(' ', 1)
+    # Split into SKU and name parts (no space means it's just a name)
+    sku_part, sep, name_part = text.partition(' ')
+    if not sep:
+        name_part = text
 
-    if len(parts) == 2:
-        sku_part = parts[0]
-        name_part = parts[1]
+    # Expand Wmns, drop quotes, hyphens/underscores to spaces, normalize spaces
+    name_part = _WMNS_RE.sub("(Women's)", name_part).translate(_TRANS)
+    name_part = _WS_RE.sub(' ', name_part).strip()
 
-        # Expand Wmns in name
-        name_part = re.sub(r'\bWmns\b', "(Women's)", name_part, flags=re.IGNORECASE)
+    return f"{sku_part} {name_part}" if sep else name_part
 
-        # Remove single quotes, hyphens, underscores from name
-        name_part = name_part.replace("'", '').replace('-', ' ').replace('_', ' ')
 
-        # Normalize spaces in name
-        name_part = re.sub(r'\s+', ' ', name_part).strip()
+def embedding_is_halfvec(cur):
+    """True if products.embedding is halfvec (float16), False for vector"""
+    cur.execute("""
+        SELECT format_type(atttypid, NULL)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    return cur.fetchone()[0] == 'halfvec'
 
-        return f"{sku_part} {name_part}"
-    else:
-        # Just name, no SKU
-        text = re.sub(r'\bWmns\b', "(Women's)", text, flags=re.IGNORECASE)
-        text = text.replace("'", '').replace('-', ' ').replace('_', ' ')
-        text = re.sub(r'\s+', ' ', text).strip()
-        return text
 
+def format_embedding(embedding, halfvec):
+    """
+    pgvector literal: float16 precision (~4 significant digits) for a
+    halfvec column, which is all it keeps; full float repr for vector
+    """
+    if halfvec:
+        return '[' + ','.join([f'{x:.4g}' for x in embedding]) + ']'
+    return '[' + ','.join(map(repr, embedding)) + ']'
 
-def generate_embeddings_batch(texts, retry_count=3):
+
+async def generate_embeddings_batch(client, texts, retry_count=3):
     """Generate embeddings for multiple texts in ONE API call"""
     for attempt in range(retry_count):
         try:
-            response = client.embeddings.create(
+            response = await client.embeddings.create(
                 input=texts,
                 model="text-embedding-3-small"
             )
@@ -86,13 +104,92 @@ def generate_embeddings_batch(texts, retry_count=3):
         except Exception as e:
             if attempt < retry_count - 1:
                 print(f"   ⚠️  Retry {attempt + 1}/{retry_count}: {e}")
-                time.sleep(2 ** attempt)
+                await asyncio.sleep(2 ** attempt)
             else:
                 print(f"   ❌ Batch failed: {e}")
                 return None
     return None
 
 
+async def gather_with_limit(batches, limit=EMBED_CONCURRENCY):
+    """
+    Embed several text batches concurrently
+
+    At most `limit` requests are in flight; results come back in the
+    same order as `batches` (None for a batch that failed all retries).
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async with AsyncOpenAI(api_key=OPENAI_API_KEY) as client:
+        async def embed(texts):
+            async with semaphore:
+                return await generate_embeddings_batch(client, texts)
+
+        return await asyncio.gather(*(embed(texts) for texts in batches))
+
+
+def embed_windows(products, windows, stop):
+    """
+    Embed products EMBED_CONCURRENCY batches at a time onto `windows`, then a None sentinel
+
+    Each item is (window_start, batches, batch_embeddings), where every
+    batch is a (product_ids, new_texts) pair.
+    """
+    window_size = BATCH_SIZE * EMBED_CONCURRENCY
+    try:
+        for window_start in range(0, len(products), window_size):
+            if stop.is_set():
+                break
+            window = products[window_start:window_start + window_size]
+
+            batches = []
+            for i in range(0, len(window), BATCH_SIZE):
+                batch = window[i:i + BATCH_SIZE]
+                product_ids = [p[0] for p in batch]
+                new_texts = [clean_embedding_text(p[1]) if p[1] else "" for p in batch]
+                batches.append((product_ids, new_texts))
+
+            # Generate embeddings for cleaned texts, several batches at once
+            batch_embeddings = asyncio.run(gather_with_limit([texts for _, texts in batches]))
+
+            windows.put((window_start, batches, batch_embeddings))
+    finally:
+        windows.put(None)
+
+
+def update_batch(conn, cur, product_ids, new_texts, embeddings, batch_start, batch_end, stats, halfvec):
+    """Write one embedded batch to products, updating stats in place"""
+    if not embeddings or len(embeddings) != len(product_ids):
+        print(f"   ❌ Batch {batch_start:,}-{batch_end:,} failed")
+        stats['failed'] += len(product_ids)
+        return
+
+    # Update database (embedding_text + embedding): stage the batch
+    # with COPY, then one UPDATE ... FROM instead of an UPDATE per product
+    try:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(
+            (product_id, new_text, format_embedding(embedding, halfvec))
+            for product_id, new_text, embedding in zip(product_ids, new_texts, embeddings)
+        )
+        buf.seek(0)
+        cur.copy_expert("COPY upd_stage (id, etext, emb) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+        cur.execute("""
+            UPDATE products p
+            SET embedding_text = s.etext,
+                embedding = s.emb
+            FROM upd_stage s
+            WHERE p.product_id_internal = s.id
+        """)
+        conn.commit()  # Also empties upd_stage
+        stats['updated_text'] += len(product_ids)
+        stats['updated_embedding'] += len(product_ids)
+    except Exception as e:
+        print(f"   ❌ Update failed for batch {batch_start:,}-{batch_end:,}: {e}")
+        conn.rollback()
+        stats['failed'] += len(product_ids)
+
+
 def main():
     print("\n" + "="*80)
     print("REGENERATE ALIAS EMBEDDINGS - Remove Special Characters")
@@ -141,48 +238,49 @@ def main():
 
     stats = {'updated_text': 0, 'updated_embedding': 0, 'failed': 0}
 
-    # Process in batches
-    for batch_start in range(0, total, BATCH_SIZE):
-        batch_end = min(batch_start + BATCH_SIZE, total)
-        batch = products[batch_start:batch_end]
-
-        # Prepare batch
-        product_ids = [p[0] for p in batch]
-        old_texts = [p[1] for p in batch]
-        new_texts = [clean_embedding_text(t) if t else "" for t in old_texts]
-
-        # Generate embeddings for cleaned texts
-        embeddings = generate_embeddings_batch(new_texts)
-
-        if not embeddings or len(embeddings) != len(batch):
-            print(f"   ❌ Batch {batch_start:,}-{batch_end:,} failed")
-            stats['failed'] += len(batch)
-            continue
-
-        # Update database (embedding_text + embedding)
-        for product_id, new_text, embedding in zip(product_ids, new_texts, embeddings):
-            try:
-                cur.execute("""
-                    UPDATE products
-                    SET embedding_text = %s,
-                        embedding = %s::vector
-                    WHERE product_id_internal = %s
-                """, (new_text, embedding, product_id))
-                stats['updated_text'] += 1
-                stats['updated_embedding'] += 1
-            except Exception as e:
-                print(f"   ❌ Update failed for product {product_id}: {e}")
-                stats['failed'] += 1
-
-        conn.commit()
-
-        # Progress
-        elapsed = time.time() - start_time
-        rate = batch_end / elapsed if elapsed > 0 else 0
-        eta = (total - batch_end) / rate if rate > 0 else 0
-
-        print(f"   Progress: {batch_end:,}/{total:,} ({batch_end/total*100:.1f}%)")
-        print(f"   Rate: {rate:.0f} products/sec | ETA: {eta:.0f}s\n")
+    # Staging table for the batched UPDATE; columns take products' types
+    cur.execute("""
+        CREATE TEMP TABLE upd_stage ON COMMIT DELETE ROWS AS
+        SELECT product_id_internal AS id, embedding_text AS etext, embedding AS emb
+        FROM products
+        WITH NO DATA
+    """)
+    conn.commit()
+    halfvec = embedding_is_halfvec(cur)
+
+    # Embedding (OpenAI) and updates (Supabase) run side by side: a producer
+    # thread embeds the next window while this thread writes the previous one
+    windows = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        producer = ex.submit(embed_windows, products, windows, stop)
+        try:
+            while True:
+                item = windows.get()
+                if item is None:
+                    break
+
+                window_start, batches, batch_embeddings = item
+                for i, ((product_ids, new_texts), embeddings) in enumerate(zip(batches, batch_embeddings)):
+                    batch_start = window_start + i * BATCH_SIZE
+                    batch_end = batch_start + len(product_ids)
+                    update_batch(conn, cur, product_ids, new_texts, embeddings, batch_start, batch_end, stats, halfvec)
+
+                # Progress
+                elapsed = time.time() - start_time
+                rate = batch_end / elapsed if elapsed > 0 else 0
+                eta = (total - batch_end) / rate if rate > 0 else 0
+
+                print(f"   Progress: {batch_end:,}/{total:,} ({batch_end/total*100:.1f}%)")
+                print(f"   Rate: {rate:.0f} products/sec | ETA: {eta:.0f}s\n")
+        except BaseException:
+            # Unblock the producer so the executor can shut down
+            stop.set()
+            while windows.get() is not None:
+                pass
+            raise
+        producer.result()  # Re-raise any embedding error
 
     # Final stats
     elapsed = time.time() - start_time
@@ -12,39 +12,48 @@ Total cost: ~$11.30
 Safe to run unattended overnight.
 """
 
-import subprocess
+import os
 import sys
 import time
+import traceback
 
-def run_script(script_name, description):
-    """Run a Python script and capture output"""
+# Index creation lives with the shared vector_index helpers in deprecated/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'deprecated'))
+
+from regenerate_alias_embeddings import main as run_regenerate_alias_embeddings
+from migrate_alias_remaining import main as run_migrate_alias_remaining
+from create_indexes_safe import main as run_create_indexes_safe
+
+
+def run_step(step_main, description):
+    """
+    Run a pipeline script's main() in this process
+
+    A step fails if it raises or its main() returns False. Running in-process
+    skips a fresh interpreter (and openai/psycopg2 imports) per step.
+    """
     print("\n" + "="*80)
     print(f"🚀 Starting: {description}")
     print("="*80 + "\n")
 
-    start_time = time.time()
+    start_time = time.perf_counter()
 
     try:
-        # Run the script
-        result = subprocess.run(
-            [sys.executable, script_name],
-            capture_output=False,  # Show output in real-time
-            text=True
-        )
-
-        elapsed = time.time() - start_time
-
-        if result.returncode == 0:
-            print(f"\n✅ {description} completed in {elapsed/60:.2f} minutes")
-            return True
-        else:
-            print(f"\n❌ {description} failed with exit code {result.returncode}")
-            return False
-
+        result = step_main()
     except Exception as e:
         print(f"\n❌ Error running {description}: {e}")
+        traceback.print_exc()
         return False
 
+    elapsed = time.perf_counter() - start_time
+
+    if result is False:
+        print(f"\n❌ {description} failed")
+        return False
+
+    print(f"\n✅ {description} completed in {elapsed/60:.2f} minutes")
+    return True
+
 
 def main():
     print("\n" + "="*80)
@@ -60,8 +69,8 @@ def main():
     overall_start = time.time()
 
     # Step 1: Fix existing alias products
-    success = run_script(
-        "regenerate_alias_embeddings.py",
+    success = run_step(
+        run_regenerate_alias_embeddings,
         "Fix Existing Alias Products"
     )
 
@@ -69,8 +78,8 @@ def main():
         print("\n⚠️  Fixing existing products failed, but continuing...")
 
     # Step 2: Migrate new alias products
-    success = run_script(
-        "migrate_alias_remaining.py",
+    success = run_step(
+        run_migrate_alias_remaining,
         "Migrate New Alias Products"
     )
 
@@ -79,12 +88,12 @@ def main():
         print("You can fix the issue and run the scripts individually:")
         print("  python regenerate_alias_embeddings.py")
         print("  python migrate_alias_remaining.py")
-        print("  python create_indexes_safe.py")
+        print("  python ../deprecated/create_indexes_safe.py")
         sys.exit(1)
 
     # Step 3: Create indexes
-    success = run_script(
-        "create_indexes_safe.py",
+    success = run_step(
+        run_create_indexes_safe,
         "Index Creation"
     )
 
@@ -113,6 +122,5 @@ if __name__ == "__main__":
         sys.exit(1)
     except Exception as e:
         print(f"\n❌ Fatal error: {e}")
-        import traceback
         traceback.print_exc()
         sys.exit(1)
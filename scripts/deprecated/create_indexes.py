@@ -5,8 +5,12 @@ Run this after migration completes
 
 import os
 import psycopg2
+from psycopg2 import sql
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
+from vector_index import CREATE_IVFFLAT_SQL, configure_ivfflat_params, set_default_probes, configure_async_io, embedding_opclass
+
 load_dotenv()
 
 # Configuration
@@ -23,6 +27,34 @@ def get_supabase_connection():
     return psycopg2.connect(conn_string)
 
 
+def _run_one(idx):
+    """Build a single index on its own connection (one backend per CREATE INDEX CONCURRENTLY)"""
+    conn = get_supabase_connection()
+    conn.autocommit = True  # Required for CREATE INDEX CONCURRENTLY
+    cursor = conn.cursor()
+
+    try:
+        try:
+            cursor.execute("SET maintenance_work_mem = '256MB'")
+            cursor.execute("SET max_parallel_maintenance_workers = 7")
+            cursor.execute("SET max_parallel_workers = 8")
+        except Exception:
+            pass
+
+        configure_async_io(cursor)
+
+        try:
+            cursor.execute(idx["sql"])
+            return f"   ✅ {idx['name']} created successfully"
+        except Exception as e:
+            if "already exists" in str(e):
+                return f"   ⚠️  {idx['name']} already exists, skipping"
+            raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
 def create_indexes():
     """Create all indexes for products table"""
     conn = get_supabase_connection()
@@ -40,32 +72,26 @@ def create_indexes():
         print(f"   ⚠️  Could not increase memory: {e}")
         print("   Continuing with default settings...\n")
 
-    # Check product count first
-    cursor.execute("SELECT COUNT(*) FROM products")
-    product_count = cursor.fetchone()[0]
+    # Estimate product count first (planner stats, not a COUNT(*) scan)
+    cursor.execute("ANALYZE products")
+    cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass")
+    product_count = max(0, cursor.fetchone()[0])
     print(f"📊 Total products in table: {product_count:,}\n")
 
-    # Determine optimal lists parameter based on product count
-    if product_count < 10000:
-        lists = 50
-    elif product_count < 100000:
-        lists = 100
-    elif product_count < 500000:
-        lists = 500
-    else:
-        lists = 1000
+    # Determine lists/probes for the IVFFlat index from product count
+    ivfflat = configure_ivfflat_params(product_count)
+    lists = ivfflat['lists']
 
-    print(f"🎯 Using lists = {lists} for IVFFlat index (optimal for {product_count:,} products)\n")
+    print(f"🎯 Using lists = {lists}, probes = {ivfflat['probes']} for IVFFlat index ({product_count:,} products)\n")
 
     indexes = [
         {
             "name": "products_embedding_idx",
-            "sql": f"""
-                CREATE INDEX CONCURRENTLY IF NOT EXISTS products_embedding_idx
-                ON products
-                USING ivfflat (embedding vector_cosine_ops)
-                WITH (lists = {lists})
-            """,
+            "sql": CREATE_IVFFLAT_SQL.format(
+                idx=sql.Identifier("products_embedding_idx"),
+                opclass=sql.SQL(embedding_opclass(cursor)),
+                lists=sql.Literal(lists),
+            ),
             "description": "Vector similarity index (IVFFlat)"
         },
         {
@@ -94,16 +120,30 @@ def create_indexes():
         }
     ]
 
+    # Each CREATE INDEX CONCURRENTLY gets its own connection (and session
+    # settings). They still build one after another: CIC takes a SHARE UPDATE
+    # EXCLUSIVE lock on products, which conflicts with itself, so total time
+    # is the sum of the builds
     for idx in indexes:
-        try:
-            print(f"🔨 Creating {idx['name']}... ({idx['description']})")
-            cursor.execute(idx["sql"])
-            print(f"   ✅ {idx['name']} created successfully\n")
-        except Exception as e:
-            if "already exists" in str(e):
-                print(f"   ⚠️  {idx['name']} already exists, skipping\n")
-            else:
-                print(f"   ❌ Error creating {idx['name']}: {e}\n")
+        print(f"🔨 Creating {idx['name']}... ({idx['description']})")
+    print()
+
+    # Let the IVFFlat build use more than the planner's default worker count
+    cursor.execute("ALTER TABLE products SET (parallel_workers = 8)")
+    try:
+        with ThreadPoolExecutor(max_workers=len(indexes)) as ex:
+            futs = {ex.submit(_run_one, idx): idx for idx in indexes}
+            for fut in as_completed(futs):
+                idx = futs[fut]
+                try:
+                    print(fut.result())
+                except Exception as e:
+                    print(f"   ❌ Error creating {idx['name']}: {e}")
+    finally:
+        cursor.execute("ALTER TABLE products RESET (parallel_workers)")
+    print()
+
+    set_default_probes(cursor, lists)
 
     # Verify indexes
     print("\n📋 Verifying indexes on products table:\n")
@@ -114,11 +154,12 @@ def create_indexes():
         ORDER BY indexname
     """)
 
-    indexes = cursor.fetchall()
-    for idx_name, idx_def in indexes:
+    existing_indexes = 0
+    for idx_name, idx_def in cursor:
         print(f"   ✓ {idx_name}")
+        existing_indexes += 1
 
-    print(f"\n✅ Index creation complete! Total indexes: {len(indexes)}\n")
+    print(f"\n✅ Index creation complete! Total indexes: {existing_indexes}\n")
 
     cursor.close()
     conn.close()
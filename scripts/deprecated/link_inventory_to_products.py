@@ -9,11 +9,18 @@ products table in Supabase.
 Run this AFTER:
 1. Running inventory_redesign.sql
 2. Completing product migration to Supabase
+
+Pass --full-rebuild to relink every row from scratch (e.g. after the
+products table was re-migrated and product_id_internal values changed).
 """
 
 import os
+import queue
+import argparse
+import threading
 import pymysql
 import psycopg2
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -34,8 +41,131 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
-def link_inventory_products():
-    """Link inventory items to Supabase products via product_id_internal"""
+LOOKUP_BATCH_SIZE = 50000
+UPDATE_BATCH_SIZE = 10000
+
+
+def sku_chunks(mysql_cur, only_unlinked=True):
+    """
+    Yield (after_sku, upto_sku) bounds covering UPDATE_BATCH_SIZE inventory rows each
+
+    upto_sku is None for the final, open-ended chunk. With only_unlinked the
+    bounds are taken from rows where product_id_internal IS NULL (range scan
+    on idx_product_id_internal, which carries sku); otherwise from the
+    primary key.
+    """
+    where = "product_id_internal IS NULL AND sku > %s" if only_unlinked else "sku > %s"
+    last_sku = ''
+
+    while True:
+        mysql_cur.execute(f"""
+            SELECT sku FROM inventory
+            WHERE {where}
+            ORDER BY sku
+            LIMIT 1 OFFSET %s
+        """, (last_sku, UPDATE_BATCH_SIZE - 1))
+        row = mysql_cur.fetchone()
+        upper_sku = row['sku'] if row else None
+
+        yield last_sku, upper_sku
+
+        if upper_sku is None:
+            break
+        last_sku = upper_sku
+
+
+def update_chunked(mysql_conn, mysql_cur, sql, params, only_unlinked=True):
+    """
+    Run an UPDATE restricted to `i.sku` chunks, committing after each one
+
+    Keeps any single UPDATE from locking (or binlogging) the whole table.
+    Returns the total number of rows changed.
+    """
+    changed = 0
+    for after_sku, upto_sku in sku_chunks(mysql_cur, only_unlinked):
+        if upto_sku is None:
+            changed += mysql_cur.execute(sql + " AND i.sku > %s", params + (after_sku,))
+        else:
+            changed += mysql_cur.execute(sql + " AND i.sku > %s AND i.sku <= %s",
+                                         params + (after_sku, upto_sku))
+        mysql_conn.commit()
+    return changed
+
+
+def link_via_platform(mysql_conn, mysql_cur, platform, inventory_column, full_rebuild=False):
+    """
+    Set product_id_internal from product_lookup for one platform
+
+    Only unlinked rows are visited or rewritten, so a re-run with nothing
+    left to link does no writes. In full-rebuild mode (no index on
+    product_id_internal) chunks are walked by primary key instead.
+    """
+    if not full_rebuild:
+        mysql_cur.execute("SELECT 1 FROM inventory WHERE product_id_internal IS NULL LIMIT 1")
+        if not mysql_cur.fetchone():
+            return 0
+
+    sql = f"""
+        UPDATE inventory i
+        JOIN product_lookup p
+          ON p.platform = %s AND p.product_id_platform = i.{inventory_column}
+        SET i.product_id_internal = p.product_id_internal
+        WHERE i.product_id_internal IS NULL
+    """
+    return update_chunked(mysql_conn, mysql_cur, sql, (platform,), only_unlinked=not full_rebuild)
+
+
+def drop_link_index(mysql_cur):
+    """Drop idx_product_id_internal so a full relink doesn't maintain it row by row"""
+    mysql_cur.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'inventory'
+          AND INDEX_NAME = 'idx_product_id_internal'
+        LIMIT 1
+    """)
+    if mysql_cur.fetchone():
+        mysql_cur.execute("ALTER TABLE inventory DROP INDEX idx_product_id_internal")
+
+
+def create_link_index(mysql_cur):
+    """Rebuild idx_product_id_internal online (MySQL's equivalent of CREATE INDEX CONCURRENTLY)"""
+    mysql_cur.execute("""
+        ALTER TABLE inventory
+        ADD INDEX idx_product_id_internal (product_id_internal),
+        ALGORITHM=INPLACE, LOCK=NONE
+    """)
+
+
+def stream_products(supa_conn, batches, stop):
+    """Stream StockX/Alias product IDs from Supabase onto `batches`, then a None sentinel"""
+    # Named cursor streams rows from the server instead of fetchall()
+    supa_cur = supa_conn.cursor(name='prod_stream')
+    supa_cur.itersize = LOOKUP_BATCH_SIZE
+    try:
+        supa_cur.execute("""
+            SELECT platform, product_id_platform, product_id_internal
+            FROM products
+            WHERE platform IN ('stockx', 'alias')
+              AND product_id_platform IS NOT NULL
+        """)
+        while not stop.is_set():
+            rows = supa_cur.fetchmany(LOOKUP_BATCH_SIZE)
+            if not rows:
+                break
+            batches.put(rows)
+    finally:
+        batches.put(None)
+        supa_cur.close()
+
+
+def link_inventory_products(full_rebuild=False):
+    """
+    Link inventory items to Supabase products via product_id_internal
+
+    With full_rebuild, every row is relinked from scratch (e.g. after the
+    products were re-migrated): the product_id_internal index is dropped,
+    all links are cleared and repopulated, then the index is rebuilt once.
+    """
 
     print("\n" + "="*80)
     print("LINKING INVENTORY TO SUPABASE PRODUCTS")
@@ -46,84 +176,98 @@ def link_inventory_products():
     supa_conn = psycopg2.connect(**SUPABASE_CONFIG)
 
     mysql_cur = mysql_conn.cursor(pymysql.cursors.DictCursor)
-    supa_cur = supa_conn.cursor()
 
-    # Step 1: Create lookup dictionaries from Supabase
-    print("📊 Building product lookup tables from Supabase...")
+    # Step 1: Load product lookup from Supabase into a MySQL temp table
+    print("📊 Loading product lookup table from Supabase into MySQL...")
 
-    # StockX products: product_id_platform (UUID) -> product_id_internal
-    supa_cur.execute("""
-        SELECT product_id_platform, product_id_internal
-        FROM products
-        WHERE platform = 'stockx'
-    """)
-    stockx_lookup = {row[0]: row[1] for row in supa_cur.fetchall()}
-    print(f"   ✅ Loaded {len(stockx_lookup):,} StockX products")
-
-    # Alias products: product_id_platform (catalogId) -> product_id_internal
-    supa_cur.execute("""
-        SELECT product_id_platform, product_id_internal
-        FROM products
-        WHERE platform = 'alias'
+    mysql_cur.execute("""
+        CREATE TEMPORARY TABLE product_lookup (
+            platform VARCHAR(16) NOT NULL,
+            product_id_platform VARCHAR(255) NOT NULL,
+            product_id_internal INT NOT NULL,
+            KEY idx_platform_id (platform, product_id_platform)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
     """)
-    alias_lookup = {row[0]: row[1] for row in supa_cur.fetchall()}
-    print(f"   ✅ Loaded {len(alias_lookup):,} Alias products\n")
 
-    # Step 2: Get inventory items that need linking
+    # Supabase fetch and MySQL insert run side by side: a reader thread
+    # streams the next batch while this thread writes the previous one
+    batches = queue.Queue(maxsize=2)
+    stop = threading.Event()
+
+    loaded = 0
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        reader = ex.submit(stream_products, supa_conn, batches, stop)
+        try:
+            while True:
+                rows = batches.get()
+                if rows is None:
+                    break
+                mysql_cur.executemany("""
+                    INSERT INTO product_lookup (platform, product_id_platform, product_id_internal)
+                    VALUES (%s, %s, %s)
+                """, rows)
+                loaded += len(rows)
+                print(f"   ... {loaded:,} products loaded")
+        except BaseException:
+            # Unblock the reader so the executor can shut down
+            stop.set()
+            while batches.get() is not None:
+                pass
+            raise
+        reader.result()  # Re-raise any Supabase error
+    print(f"   ✅ Loaded {loaded:,} StockX/Alias products\n")
+
+    # Step 2: Link inventory to products with a server-side JOIN
+    # StockX first, then Alias for anything StockX didn't match
+    stats = {}
+
+    if full_rebuild:
+        print("🗑️  Full rebuild: dropping idx_product_id_internal and clearing links...")
+        drop_link_index(mysql_cur)
+
+    # Once the index is dropped it is rebuilt whatever happens (errors,
+    # Ctrl+C): later runs' verification query relies on it
+    try:
+        if full_rebuild:
+            update_chunked(mysql_conn, mysql_cur, """
+                UPDATE inventory i
+                SET i.product_id_internal = NULL
+                WHERE i.product_id_internal IS NOT NULL
+            """, (), only_unlinked=False)
+
+        print("💾 Linking inventory via StockX product IDs...")
+        stats['stockx_linked'] = link_via_platform(mysql_conn, mysql_cur, 'stockx', 'stockx_productId', full_rebuild)
+
+        print("💾 Linking inventory via Alias catalog IDs...")
+        stats['alias_linked'] = link_via_platform(mysql_conn, mysql_cur, 'alias', 'alias_catalog_id', full_rebuild)
+        print(f"   ✅ Updated successfully\n")
+    finally:
+        if full_rebuild:
+            print("🔨 Rebuilding idx_product_id_internal...")
+            try:
+                create_link_index(mysql_cur)
+            except Exception as e:
+                print(f"   ❌ Index rebuild failed: {e}")
+                print("   🔧 Recreate it manually (then rerun with --full-rebuild):")
+                print("      ALTER TABLE inventory ADD INDEX idx_product_id_internal (product_id_internal), ALGORITHM=INPLACE, LOCK=NONE;")
+                raise
+            print(f"   ✅ Index rebuilt\n")
+
+    # Step 3: Classify whatever is still unlinked
     mysql_cur.execute("""
-        SELECT sku, stockx_productId, alias_catalog_id
+        SELECT
+            SUM(CASE WHEN stockx_productId IS NOT NULL OR alias_catalog_id IS NOT NULL THEN 1 ELSE 0 END) as not_found,
+            SUM(CASE WHEN stockx_productId IS NULL AND alias_catalog_id IS NULL THEN 1 ELSE 0 END) as no_platform_id
         FROM inventory
         WHERE product_id_internal IS NULL
     """)
-    inventory_items = mysql_cur.fetchall()
-    print(f"📦 Found {len(inventory_items):,} inventory items to link\n")
-
-    # Step 3: Link inventory to products
-    stats = {
-        'stockx_linked': 0,
-        'alias_linked': 0,
-        'not_found': 0,
-        'no_platform_id': 0
-    }
-
-    updates = []
-
-    for item in inventory_items:
-        sku = item['sku']
-        stockx_id = item['stockx_productId']
-        alias_id = item['alias_catalog_id']
-
-        product_id_internal = None
-
-        # Try StockX first
-        if stockx_id and stockx_id in stockx_lookup:
-            product_id_internal = stockx_lookup[stockx_id]
-            stats['stockx_linked'] += 1
-        # Try Alias if no StockX match
-        elif alias_id and alias_id in alias_lookup:
-            product_id_internal = alias_lookup[alias_id]
-            stats['alias_linked'] += 1
-        # No match found
-        elif stockx_id or alias_id:
-            stats['not_found'] += 1
-        else:
-            stats['no_platform_id'] += 1
-
-        if product_id_internal:
-            updates.append((product_id_internal, sku))
-
-    # Step 4: Batch update inventory table
-    if updates:
-        print(f"💾 Updating {len(updates):,} inventory items...")
-        mysql_cur.executemany("""
-            UPDATE inventory
-            SET product_id_internal = %s
-            WHERE sku = %s
-        """, updates)
-        mysql_conn.commit()
-        print(f"   ✅ Updated successfully\n")
+    result = mysql_cur.fetchone()
+    stats['not_found'] = int(result['not_found'] or 0)
+    stats['no_platform_id'] = int(result['no_platform_id'] or 0)
 
-    # Step 5: Show results
+    mysql_cur.execute("DROP TEMPORARY TABLE product_lookup")
+
+    # Step 4: Show results
     print("="*80)
     print("RESULTS")
     print("="*80)
@@ -133,21 +277,30 @@ def link_inventory_products():
     print(f"⚠️  No platform ID:          {stats['no_platform_id']:,}")
     print(f"\n📊 Total linked:             {stats['stockx_linked'] + stats['alias_linked']:,}")
 
-    # Step 6: Verification query
+    # Step 5: Verification query
+    # Linked count is an index range scan; total comes from table
+    # statistics (an InnoDB estimate), so no full-table scan is needed
     mysql_cur.execute("""
-        SELECT
-            COUNT(*) as total,
-            SUM(CASE WHEN product_id_internal IS NOT NULL THEN 1 ELSE 0 END) as linked,
-            SUM(CASE WHEN product_id_internal IS NULL THEN 1 ELSE 0 END) as unlinked
-        FROM inventory
+        SELECT COUNT(*) as linked
+        FROM inventory USE INDEX (idx_product_id_internal)
+        WHERE product_id_internal IS NOT NULL
     """)
-    result = mysql_cur.fetchone()
+    linked = mysql_cur.fetchone()['linked']
+
+    mysql_cur.execute("""
+        SELECT TABLE_ROWS as total
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'inventory'
+    """)
+    total = max(int(mysql_cur.fetchone()['total'] or 0), linked, 1)
+    unlinked = total - linked
+
     print(f"\n📋 Final Inventory Status:")
-    print(f"   Total items:    {result['total']:,}")
-    print(f"   Linked:         {result['linked']:,} ({result['linked']/result['total']*100:.1f}%)")
-    print(f"   Unlinked:       {result['unlinked']:,} ({result['unlinked']/result['total']*100:.1f}%)")
+    print(f"   Total items:    ~{total:,} (estimated)")
+    print(f"   Linked:         {linked:,} ({linked/total*100:.1f}%)")
+    print(f"   Unlinked:       ~{unlinked:,} ({unlinked/total*100:.1f}%)")
 
-    # Step 7: Show sample linked items
+    # Step 6: Show sample linked items
     mysql_cur.execute("""
         SELECT sku, item, size, stockx_productId, alias_catalog_id, product_id_internal
         FROM inventory
@@ -160,7 +313,6 @@ def link_inventory_products():
         print(f"   [{platform}] {row['item']} (Size {row['size']}) -> product_id_internal: {row['product_id_internal']}")
 
     mysql_cur.close()
-    supa_cur.close()
     mysql_conn.close()
     supa_conn.close()
 
@@ -168,8 +320,13 @@ def link_inventory_products():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Link inventory items to Supabase products")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="Clear and relink every inventory row (drops and rebuilds the product_id_internal index)")
+    args = parser.parse_args()
+
     try:
-        link_inventory_products()
+        link_inventory_products(full_rebuild=args.full_rebuild)
     except Exception as e:
         print(f"\n❌ Error: {e}\n")
         import traceback
@@ -11,17 +11,19 @@ This script:
 
 Strategy:
 - Extract unique item names from MySQL inventory
-- Query Supabase products for each unique name (semantic search)
+- Query Supabase products for the unique names in batches
 - Cache results for reuse
 - Link inventory → products via product_id_internal
 """
 
+import io
 import os
 import re
+import csv
 import pymysql
 import psycopg2
+from operator import itemgetter
 from dotenv import load_dotenv
-from collections import defaultdict
 
 load_dotenv()
 
@@ -41,6 +43,27 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
+LOOKUP_BATCH_SIZE = 2000  # Item names per products query
+
+# Best product per item name, chosen server-side: exact name match (both
+# UPPERCASE), preferring a style_id_platform that contains the style ID
+# from the item's brackets. match_count drives exact vs multi-match stats.
+# Prepared once per connection so each batch skips parse/plan.
+PREPARE_BEST_MATCH_SQL = """
+    PREPARE best_match (text[], text[]) AS
+    SELECT DISTINCT ON (v.name)
+        v.name,
+        p.product_id_internal,
+        p.product_name_platform,
+        p.platform,
+        COUNT(*) OVER (PARTITION BY v.name) AS match_count
+    FROM unnest($1, $2) AS v(name, style_id)
+    JOIN products p ON p.product_name_platform = v.name
+    ORDER BY
+        v.name,
+        position(lower(v.style_id) IN lower(coalesce(p.style_id_platform, ''))) > 0 DESC NULLS LAST
+"""
+
 
 def normalize_item_name(item_name):
     """
@@ -73,7 +96,7 @@ def extract_style_id_from_item(item_name):
 def build_item_to_product_cache(inventory_items):
     """
     Build cache mapping item names to product_id_internal
-    Queries Supabase once per unique item name
+    Queries Supabase once per LOOKUP_BATCH_SIZE unique item names
     """
     print("\n🔍 Building item → product mapping cache...")
 
@@ -91,59 +114,49 @@ def build_item_to_product_cache(inventory_items):
 
     print(f"   Found {len(unique_items):,} unique item names to match\n")
 
-    # Query Supabase for each unique name
+    # Query Supabase in batches of unique names
     conn = psycopg2.connect(**SUPABASE_CONFIG)
     cur = conn.cursor()
+    cur.execute(PREPARE_BEST_MATCH_SQL)
 
     cache = {}
     stats = {'exact_match': 0, 'no_match': 0, 'multiple_match': 0}
 
-    for i, (normalized_name, item_info) in enumerate(unique_items.items(), 1):
-        # Try exact name match first (both are now UPPERCASE)
-        cur.execute("""
-            SELECT product_id_internal, product_name_platform, platform, style_id_platform
-            FROM products
-            WHERE product_name_platform = %s
-            LIMIT 5
-        """, (normalized_name,))
-
-        matches = cur.fetchall()
-
-        if len(matches) == 1:
-            # Single exact match - best case
-            stats['exact_match'] += 1
-            cache[normalized_name] = {
-                'product_id_internal': matches[0][0],
-                'matched_name': matches[0][1],
-                'platform': matches[0][2],
-                'confidence': 'exact'
-            }
-        elif len(matches) > 1:
-            # Multiple matches - prioritize by style ID if available
-            stats['multiple_match'] += 1
-            extracted_style = item_info['style_id']
-
-            best_match = matches[0]  # Default to first
-            if extracted_style:
-                for match in matches:
-                    if match[3] and extracted_style.lower() in match[3].lower():
-                        best_match = match
-                        break
-
-            cache[normalized_name] = {
-                'product_id_internal': best_match[0],
-                'matched_name': best_match[1],
-                'platform': best_match[2],
-                'confidence': 'multi-match'
+    unique_names = list(unique_items.keys())
+
+    for batch_idx in range(0, len(unique_names), LOOKUP_BATCH_SIZE):
+        batch_names = unique_names[batch_idx:batch_idx + LOOKUP_BATCH_SIZE]
+        batch_styles = [unique_items[name]['style_id'] for name in batch_names]
+
+        # Many names per round-trip, one row back per matched name
+        cur.execute("EXECUTE best_match (%s, %s)", (batch_names, batch_styles))
+
+        for name, product_id, matched_name, platform, match_count in cur.fetchall():
+            if match_count == 1:
+                # Single exact match - best case
+                stats['exact_match'] += 1
+                confidence = 'exact'
+            else:
+                # Multiple matches - best by style ID already picked in SQL
+                stats['multiple_match'] += 1
+                confidence = 'multi-match'
+
+            cache[name] = {
+                'product_id_internal': product_id,
+                'matched_name': matched_name,
+                'platform': platform,
+                'confidence': confidence
             }
-        else:
-            # No match - try fuzzy match or leave unlinked
+
+        done = batch_idx + len(batch_names)
+        print(f"   Progress: {done:,}/{len(unique_names):,} ({done/len(unique_names)*100:.1f}%)")
+
+    # No match - leave unlinked
+    for normalized_name in unique_names:
+        if normalized_name not in cache:
             stats['no_match'] += 1
             cache[normalized_name] = None
 
-        if i % 100 == 0:
-            print(f"   Progress: {i:,}/{len(unique_items):,} ({i/len(unique_items)*100:.1f}%)")
-
     cur.close()
     conn.close()
 
@@ -156,55 +169,57 @@ def build_item_to_product_cache(inventory_items):
     return cache
 
 
+# MySQL camelCase -> Supabase snake_case inventory columns
+INVENTORY_COLUMN_MAP = {
+    'sku': 'sku',
+    'sold': 'sold',
+    'datePurchase': 'date_purchase',
+    'placeOfPurchase': 'place_of_purchase',
+    'item': 'item',
+    'size': 'size',
+    'costPrice': 'cost_price',
+    'salesTax': 'sales_tax',
+    'additionalCost': 'additional_cost',
+    'rebate': 'rebate',
+    'totalCost': 'total_cost',
+    'reshippingCost': 'reshipping_cost',
+    'reshippingDuties': 'reshipping_duties',
+    'reshippingReferenceNumber': 'reshipping_reference_number',
+    'paymentMethod': 'payment_method',
+    'salesTaxRefunded': 'sales_tax_refunded',
+    'salesTaxRefundDepositDate': 'sales_tax_refund_deposit_date',
+    'salesTaxRefundDepositAccount': 'sales_tax_refund_deposit_account',
+    'salesTaxRefundReferenceNumber': 'sales_tax_refund_reference_number',
+    'salesTaxRefundTotalAmount': 'sales_tax_refund_total_amount',
+    'refundDate': 'refund_date',
+    'location': 'location',
+    'plannedSalesMethod': 'planned_sales_method',
+    'referenceNumber': 'reference_number',
+    'deliveryDate': 'delivery_date',
+    'verificationDate': 'verification_date',
+    'createdAt': 'created_at',
+    'stockx_productId': 'stockx_product_id',
+    'stockx_variantId': 'stockx_variant_id',
+    'alias_catalog_id': 'alias_catalog_id',
+    'styleId': 'style_id',
+    'poolId': 'pool_id',
+    'poolKey': 'pool_key',
+    'comment': 'comment',
+    'updatedVia': 'updated_via',
+    'saleTrackerRowIndex': 'sale_tracker_row_index',
+}
+INVENTORY_COLUMN_ITEMS = tuple(INVENTORY_COLUMN_MAP.items())
+BOOL_COLUMNS = ('sold', 'sales_tax_refunded')
+
+
 def transform_inventory_item(item, item_cache):
     """Transform MySQL inventory item to Supabase format"""
-    transformed = {}
-
-    # Column mapping
-    column_map = {
-        'sku': 'sku',
-        'sold': 'sold',
-        'datePurchase': 'date_purchase',
-        'placeOfPurchase': 'place_of_purchase',
-        'item': 'item',
-        'size': 'size',
-        'costPrice': 'cost_price',
-        'salesTax': 'sales_tax',
-        'additionalCost': 'additional_cost',
-        'rebate': 'rebate',
-        'totalCost': 'total_cost',
-        'reshippingCost': 'reshipping_cost',
-        'reshippingDuties': 'reshipping_duties',
-        'reshippingReferenceNumber': 'reshipping_reference_number',
-        'paymentMethod': 'payment_method',
-        'salesTaxRefunded': 'sales_tax_refunded',
-        'salesTaxRefundDepositDate': 'sales_tax_refund_deposit_date',
-        'salesTaxRefundDepositAccount': 'sales_tax_refund_deposit_account',
-        'salesTaxRefundReferenceNumber': 'sales_tax_refund_reference_number',
-        'salesTaxRefundTotalAmount': 'sales_tax_refund_total_amount',
-        'refundDate': 'refund_date',
-        'location': 'location',
-        'plannedSalesMethod': 'planned_sales_method',
-        'referenceNumber': 'reference_number',
-        'deliveryDate': 'delivery_date',
-        'verificationDate': 'verification_date',
-        'createdAt': 'created_at',
-        'stockx_productId': 'stockx_product_id',
-        'stockx_variantId': 'stockx_variant_id',
-        'alias_catalog_id': 'alias_catalog_id',
-        'styleId': 'style_id',
-        'poolId': 'pool_id',
-        'poolKey': 'pool_key',
-        'comment': 'comment',
-        'updatedVia': 'updated_via',
-        'saleTrackerRowIndex': 'sale_tracker_row_index',
-    }
-
-    for mysql_col, supa_col in column_map.items():
-        value = item.get(mysql_col)
-        if supa_col in ['sold', 'sales_tax_refunded'] and value is not None:
-            value = bool(value)
-        transformed[supa_col] = value
+    # One comprehension over the prebuilt (mysql, supabase) pairs; only the two
+    # boolean columns need converting
+    transformed = {supa_col: item.get(mysql_col) for mysql_col, supa_col in INVENTORY_COLUMN_ITEMS}
+    for supa_col in BOOL_COLUMNS:
+        if transformed[supa_col] is not None:
+            transformed[supa_col] = bool(transformed[supa_col])
 
     # Link to products via item name cache
     item_name = item.get('item')
@@ -224,8 +239,28 @@ def transform_inventory_item(item, item_cache):
     return transformed
 
 
+def copy_rows(cur, table, columns, rows):
+    """Stream rows into a table with COPY (CSV, NULL as \\N)"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(['\\N' if value is None else value for value in row])
+    buf.seek(0)
+
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buf
+    )
+
+
 def insert_to_supabase(inventory_items):
-    """Insert transformed inventory into Supabase"""
+    """
+    Insert transformed inventory into Supabase
+
+    All rows are COPYed into a temporary staging table and upserted with
+    one INSERT ... SELECT, committed once. If that fails the rows are
+    upserted one by one so a single bad row doesn't sink the rest.
+    """
     print(f"\n💾 Inserting {len(inventory_items):,} items into Supabase...\n")
 
     conn = psycopg2.connect(**SUPABASE_CONFIG)
@@ -248,35 +283,54 @@ def insert_to_supabase(inventory_items):
     placeholders = ', '.join(['%s'] * len(columns))
     column_str = ', '.join(columns)
 
-    insert_sql = f"""
-        INSERT INTO inventory ({column_str})
-        VALUES ({placeholders})
+    # transform_inventory_item sets every column, so one C-level call builds each row
+    get_row = itemgetter(*columns)
+
+    upsert = """
         ON CONFLICT (sku) DO UPDATE SET
             sold = EXCLUDED.sold,
             location = EXCLUDED.location,
             product_id_internal = EXCLUDED.product_id_internal
     """
+    insert_sql = f"INSERT INTO inventory ({column_str}) VALUES ({placeholders})" + upsert
 
-    for i, item in enumerate(inventory_items, 1):
-        try:
-            values = tuple(item.get(col) for col in columns)
-            cur.execute(insert_sql, values)
-            stats['inserted'] += 1
+    rows = [get_row(item) for item in inventory_items]
 
-            if item['product_id_internal']:
-                stats['linked'] += 1
-            else:
-                stats['unlinked'] += 1
+    try:
+        cur.execute("CREATE TEMPORARY TABLE inventory_staging (LIKE inventory INCLUDING DEFAULTS)")
+        copy_rows(cur, 'inventory_staging', columns, rows)
+        print(f"   📥 Copied {len(rows):,} rows into staging")
+
+        cur.execute(f"INSERT INTO inventory ({column_str}) SELECT {column_str} FROM inventory_staging" + upsert)
+        cur.execute("DROP TABLE inventory_staging")
+        conn.commit()
+        inserted = inventory_items
+
+    except Exception as e:
+        print(f"   ⚠️  Bulk load failed ({e}), inserting row by row")
+        conn.rollback()
 
-            if i % 100 == 0:
+        inserted = []
+        for i, (item, values) in enumerate(zip(inventory_items, rows), 1):
+            try:
+                cur.execute(insert_sql, values)
                 conn.commit()
+                inserted.append(item)
+            except Exception as row_error:
+                conn.rollback()
+                stats['failed'] += 1
+                print(f"   ❌ Failed: {item['sku']} - {row_error}")
+
+            if i % 1000 == 0:
                 print(f"   Progress: {i:,}/{len(inventory_items):,} ({i/len(inventory_items)*100:.1f}%)")
 
-        except Exception as e:
-            stats['failed'] += 1
-            print(f"   ❌ Failed: {item['sku']} - {e}")
+    stats['inserted'] = len(inserted)
+    for item in inserted:
+        if item['product_id_internal']:
+            stats['linked'] += 1
+        else:
+            stats['unlinked'] += 1
 
-    conn.commit()
     cur.close()
     conn.close()
 
@@ -303,10 +357,10 @@ def create_index_on_products():
 
     indexes = [
         {
-            'name': 'idx_products_name_lower',
+            'name': 'idx_products_name_platform',
             'sql': """
-                CREATE INDEX IF NOT EXISTS idx_products_name_lower
-                ON products (LOWER(product_name_platform))
+                CREATE INDEX IF NOT EXISTS idx_products_name_platform
+                ON products (product_name_platform)
             """,
             'description': 'Name lookup index'
         },
@@ -15,21 +15,39 @@ Features:
 - Safe stop (Ctrl+C)
 - Duplicate prevention
 - Real-time progress
+- Embedding cache (EMBED_CACHE_PATH): reruns don't pay for texts already embedded
 """
 
+import io
 import os
-import time
+import csv
 import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import itertools
+import numpy as np
 import pymysql
 import psycopg2
+import psycopg2.pool
+from psycopg2 import sql
 import signal
 import sys
-from typing import List, Dict, Optional
-from queue import Queue
-from threading import Thread, Event
+from typing import List, Dict, Tuple, Iterable, Iterator, Optional
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
 from dotenv import load_dotenv
 import openai
 
+try:
+    import orjson  # Optional: several times faster than json for platform_data
+
+    def dumps_json(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    dumps_json = json.dumps
+
 load_dotenv()
 
 # Configuration
@@ -48,9 +66,18 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+INSERT_BATCH_SIZE = 500
+INSERT_WORKERS = 4  # Concurrent insert connections
+MIGRATED_ID_BATCH_SIZE = 10000
+EMBED_BATCH_SIZE = 100  # Texts per embeddings request
+EMBED_CONCURRENCY = 50  # Embedding requests in flight at once
+EMBED_RPM = int(os.getenv('EMBED_RPM', '3000'))  # Account rate limits for text-embedding-3-small
+EMBED_TPM = int(os.getenv('EMBED_TPM', '1000000'))
+EMBED_CACHE_PATH = os.getenv('EMBED_CACHE_PATH', 'embed_cache.sqlite3')  # Shared with migrate_alias_remaining.py
+
 stop_event = Event()
-stats = {'generated': 0, 'inserted': 0, 'failed': 0, 'skipped': 0}
+stats = {'generated': 0, 'cached': 0, 'staged': 0, 'inserted': 0, 'failed': 0, 'skipped': 0}
+stats_lock = Lock()  # Insert workers and the embedding loop both update stats
 
 def signal_handler(sig, frame):
     print("\n\n⚠️  Stopping gracefully... (Ctrl+C again to force quit)")
@@ -60,11 +87,14 @@ signal.signal(signal.SIGINT, signal_handler)
 
 # ==================== UTILITIES ====================
 
+# Built once; the normalizers run for every product
+_STYLE_ID_TRANS = str.maketrans('', '', '-_ ')
+_EMBED_TEXT_TRANS = str.maketrans('', '', '_-')
+
 def normalize_style_id(style_id: str) -> Optional[str]:
     if not style_id or str(style_id).strip() == '':
         return None
-    normalized = str(style_id).replace('-', '').replace(' ', '').replace('_', '')
-    normalized = normalized.upper()
+    normalized = str(style_id).translate(_STYLE_ID_TRANS).upper()
     if normalized != '0':
         normalized = normalized.lstrip('0') or '0'
     return normalized if normalized else None
@@ -72,7 +102,7 @@ def normalize_style_id(style_id: str) -> Optional[str]:
 def normalize_text_for_embedding(text: str) -> str:
     if not text:
         return ""
-    return text.replace("_", "").replace("-", "")
+    return text.translate(_EMBED_TEXT_TRANS)
 
 def generate_embedding_text_stockx(title: str, style_id: Optional[str] = None) -> str:
     normalized_title = normalize_text_for_embedding(title) if title else ""
@@ -88,261 +118,607 @@ def generate_embedding_text_alias(name: str, sku: Optional[str] = None) -> str:
         return f"{normalized_name} {normalized_sku}".strip()
     return normalized_name
 
-def generate_embedding(text: str, retry_count: int = 3) -> Optional[List[float]]:
+class RateLimiter:
+    """
+    Token bucket shared by all embedding workers
+
+    Requests wait for capacity up front instead of discovering the limit
+    through 429s. pause() stops every waiter until a Retry-After has passed.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount: int = 1):
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+def retry_after(error: openai.RateLimitError) -> float:
+    """Seconds the API asked us to wait (1s if it didn't say)"""
+    try:
+        return float(error.response.headers.get('retry-after', 1))
+    except (AttributeError, ValueError):
+        return 1.0
+
+async def generate_embeddings_batch(client: openai.AsyncOpenAI, texts: List[str],
+                                    limiters: List[RateLimiter], retry_count: int = 3) -> Optional[List[List[float]]]:
+    """
+    Generate embeddings for multiple texts in ONE API call
+
+    `limiters` is (requests/min, tokens/min); tokens are estimated at 4
+    characters each. A 429 pauses both limiters for its Retry-After; only
+    network errors and 5xx are retried with exponential backoff.
+    """
+    requests_limiter, tokens_limiter = limiters
+    token_estimate = sum(len(text) // 4 + 1 for text in texts)
+
     for attempt in range(retry_count):
         if stop_event.is_set():
             return None
+        await requests_limiter.acquire()
+        await tokens_limiter.acquire(token_estimate)
         try:
-            response = client.embeddings.create(input=text, model="text-embedding-3-small")
-            return response.data[0].embedding
-        except Exception as e:
+            response = await client.embeddings.create(input=texts, model="text-embedding-3-small")
+            return [item.embedding for item in response.data]
+        except openai.RateLimitError as e:
+            wait = retry_after(e)
+            requests_limiter.pause(wait)
+            tokens_limiter.pause(wait)
+        except (openai.APIConnectionError, openai.InternalServerError):
             if attempt < retry_count - 1:
-                time.sleep(2 ** attempt)
-            else:
-                return None
+                await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            print(f"   ❌ Embedding request failed: {e}")
+            return None
     return None
 
 # ==================== DATA FETCHING ====================
 
-def fetch_stockx_inventory_subset() -> List[Dict]:
-    migrated_ids = get_migrated_ids('stockx')
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    query = """
-        SELECT DISTINCT sp.*
-        FROM stockx_products sp
-        JOIN (
-            SELECT item, SUBSTRING_INDEX(SUBSTRING_INDEX(item, '[', -1), ']', 1) AS extracted_styleId
-            FROM inventory WHERE item LIKE '%[%]%'
-        ) i ON sp.styleId = i.extracted_styleId
+def load_migrated_ids(mysql_cursor, platform: str):
     """
-    cursor.execute(query)
-    results = cursor.fetchall()
-    print(f"\n✅ StockX Inventory Query - Sample verification:")
-    if results:
-        print(f"   {results[0].get('title', 'N/A')} | Style ID: {results[0].get('styleId', 'N/A')}")
-    cursor.close()
-    conn.close()
-    return [r for r in results if r['productId'] not in migrated_ids]
+    Copy already-migrated product IDs from Supabase into a MySQL temp table
 
-def fetch_alias_inventory_subset() -> List[Dict]:
-    migrated_ids = get_migrated_ids('alias')
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    query = """
-        SELECT DISTINCT ap.*
-        FROM alias_products ap
-        JOIN (
-            SELECT item, REPLACE(SUBSTRING_INDEX(SUBSTRING_INDEX(item, '[', -1), ']', 1), '-', ' ') AS extracted_styleId
-            FROM inventory WHERE item LIKE '%[%]%'
-        ) i ON ap.sku = i.extracted_styleId
+    Fetch queries LEFT JOIN tmp_migrated so the exclusion runs in MySQL and
+    migrated rows never cross the wire. The table is session-local, so
+    call this on the same connection that runs the fetch.
     """
-    cursor.execute(query)
-    results = cursor.fetchall()
-    print(f"\n✅ Alias Inventory Query - Sample verification:")
-    if results:
-        print(f"   {results[0].get('name', 'N/A')} | SKU: {results[0].get('sku', 'N/A')}")
-    cursor.close()
-    conn.close()
-    return [r for r in results if r['catalogId'] not in migrated_ids]
-
-def get_migrated_ids(platform: str) -> set:
-    """Get already migrated product IDs from Supabase"""
+    mysql_cursor.execute("DROP TEMPORARY TABLE IF EXISTS tmp_migrated")
+    mysql_cursor.execute("""
+        CREATE TEMPORARY TABLE tmp_migrated (
+            id VARCHAR(255) NOT NULL PRIMARY KEY
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
     try:
         conn = psycopg2.connect(**SUPABASE_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT product_id_platform FROM products WHERE platform = %s", (platform,))
-        migrated_ids = {row[0] for row in cursor.fetchall()}
+        cursor = conn.cursor(name='migrated_ids')
+        cursor.itersize = MIGRATED_ID_BATCH_SIZE
+        # Staged rows count too: they reach products in the final merge
+        cursor.execute("""
+            SELECT product_id_platform FROM products WHERE platform = %s
+            UNION
+            SELECT product_id_platform FROM products_stage WHERE platform = %s
+        """, (platform, platform))
+        migrated = 0
+        while True:
+            rows = cursor.fetchmany(MIGRATED_ID_BATCH_SIZE)
+            if not rows:
+                break
+            mysql_cursor.executemany("INSERT IGNORE INTO tmp_migrated (id) VALUES (%s)", rows)
+            migrated += len(rows)
         cursor.close()
         conn.close()
-        print(f"   ✅ Found {len(migrated_ids):,} already-migrated {platform} products")
-        return migrated_ids
+        print(f"   ✅ Found {migrated:,} already-migrated {platform} products")
     except Exception as e:
         print(f"   ⚠️  WARNING: Could not check for migrated {platform} products: {e}")
-        print(f"   ⚠️  Returning empty set - may cause duplicates!")
-        return set()
+        print(f"   ⚠️  Excluding nothing - may cause duplicates!")
 
-def fetch_stockx_with_style_id_exclude_migrated() -> List[Dict]:
-    migrated_ids = get_migrated_ids('stockx')
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    cursor.execute("""
-        SELECT * FROM stockx_products
-        WHERE styleId IS NOT NULL AND styleId != ''
+def load_inventory_style_ids(mysql_cursor, extract_sql: str):
+    """
+    Materialize the distinct style IDs bracketed in inventory item names
+
+    `extract_sql` turns `item` into the ID. Extracting once into an indexed
+    temp table lets the inventory-subset queries join on a key instead of
+    evaluating SUBSTRING_INDEX per inventory row inside the join.
+    """
+    mysql_cursor.execute("DROP TEMPORARY TABLE IF EXISTS inv_style_ids")
+    mysql_cursor.execute("""
+        CREATE TEMPORARY TABLE inv_style_ids (
+            sid VARCHAR(255) NOT NULL PRIMARY KEY
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    mysql_cursor.execute(f"""
+        INSERT IGNORE INTO inv_style_ids (sid)
+        SELECT DISTINCT {extract_sql}
+        FROM inventory WHERE item LIKE '%[%]%'
     """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return [r for r in results if r['productId'] not in migrated_ids]
 
-def fetch_stockx_without_style_id_exclude_migrated() -> List[Dict]:
-    migrated_ids = get_migrated_ids('stockx')
+def stream_products(platform: str, query: str, extract_sql: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Yield rows of `query` streamed from MySQL as they arrive
+
+    The query may LEFT JOIN tmp_migrated, which is loaded for `platform`
+    on the same connection first (as is inv_style_ids, given `extract_sql`).
+    SSDictCursor keeps only the rows being consumed in memory, so embedding
+    starts on the first row.
+    """
     conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    cursor.execute("""
-        SELECT * FROM stockx_products
-        WHERE styleId IS NULL OR styleId = ''
+    try:
+        cursor = conn.cursor()
+        load_migrated_ids(cursor, platform)
+        if extract_sql:
+            load_inventory_style_ids(cursor, extract_sql)
+        cursor.close()
+
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        # Rows are read at embedding pace; don't let the server give up on us
+        cursor.execute("SET SESSION net_write_timeout = 3600")
+        cursor.execute(query)
+        yield from cursor
+        cursor.close()
+    finally:
+        conn.close()
+
+def fetch_stockx_inventory_subset() -> Iterator[Dict]:
+    query = """
+        SELECT sp.*
+        FROM inv_style_ids i
+        JOIN stockx_products sp ON sp.styleId = i.sid
+        LEFT JOIN tmp_migrated m ON m.id = sp.productId
+        WHERE m.id IS NULL
+    """
+    extract_sql = "SUBSTRING_INDEX(SUBSTRING_INDEX(item, '[', -1), ']', 1)"
+    for i, row in enumerate(stream_products('stockx', query, extract_sql)):
+        if i == 0:
+            print(f"\n✅ StockX Inventory Query - Sample verification:")
+            print(f"   {row.get('title', 'N/A')} | Style ID: {row.get('styleId', 'N/A')}")
+        yield row
+
+def fetch_alias_inventory_subset() -> Iterator[Dict]:
+    query = """
+        SELECT ap.*
+        FROM inv_style_ids i
+        JOIN alias_products ap ON ap.sku = i.sid
+        LEFT JOIN tmp_migrated m ON m.id = ap.catalogId
+        WHERE m.id IS NULL
+    """
+    extract_sql = "REPLACE(SUBSTRING_INDEX(SUBSTRING_INDEX(item, '[', -1), ']', 1), '-', ' ')"
+    for i, row in enumerate(stream_products('alias', query, extract_sql)):
+        if i == 0:
+            print(f"\n✅ Alias Inventory Query - Sample verification:")
+            print(f"   {row.get('name', 'N/A')} | SKU: {row.get('sku', 'N/A')}")
+        yield row
+
+def fetch_stockx_with_style_id_exclude_migrated() -> Iterator[Dict]:
+    return stream_products('stockx', """
+        SELECT sp.* FROM stockx_products sp
+        LEFT JOIN tmp_migrated m ON m.id = sp.productId
+        WHERE sp.styleId IS NOT NULL AND sp.styleId != '' AND m.id IS NULL
     """)
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return [r for r in results if r['productId'] not in migrated_ids]
 
-def fetch_alias_exclude_migrated() -> List[Dict]:
-    migrated_ids = get_migrated_ids('alias')
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor(pymysql.cursors.DictCursor)
-    cursor.execute("SELECT * FROM alias_products")
-    results = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return [r for r in results if r['catalogId'] not in migrated_ids]
+def fetch_stockx_without_style_id_exclude_migrated() -> Iterator[Dict]:
+    return stream_products('stockx', """
+        SELECT sp.* FROM stockx_products sp
+        LEFT JOIN tmp_migrated m ON m.id = sp.productId
+        WHERE (sp.styleId IS NULL OR sp.styleId = '') AND m.id IS NULL
+    """)
 
-# ==================== TRANSFORMATION ====================
+def fetch_alias_exclude_migrated() -> Iterator[Dict]:
+    return stream_products('alias', """
+        SELECT ap.* FROM alias_products ap
+        LEFT JOIN tmp_migrated m ON m.id = ap.catalogId
+        WHERE m.id IS NULL
+    """)
 
-def transform_stockx_product(product: Dict) -> Dict:
-    style_id = product.get('styleId')
-    product_name = product.get('title', '')
-    platform_data = {
-        'productType': product.get('productType'),
-        'urlKey': product.get('urlKey'),
-        'brand': product.get('brand'),
-        'imageLink': product.get('imageLink'),
-        'gender': product.get('productAttributes_gender'),
-        'season': product.get('productAttributes_season'),
-        'releaseDate': str(product.get('productAttributes_releaseDate')) if product.get('productAttributes_releaseDate') else None,
-        'retailPrice': float(product.get('productAttributes_retailPrice')) if product.get('productAttributes_retailPrice') else None,
-        'colorway': product.get('productAttributes_colorway'),
-        'color': product.get('productAttributes_color')
-    }
-    return {
-        'product_id_platform': product.get('productId'),
-        'platform': 'stockx',
-        'platform_id': None,
-        'product_name_platform': product_name,
-        'style_id_platform': style_id,
-        'style_id_normalized': normalize_style_id(style_id),
-        'platform_data': json.dumps(platform_data),
-        'keyword_used': product.get('keywordUsed'),
-        'embedding': None,
-        'embedding_text': generate_embedding_text_stockx(product_name, style_id)
-    }
+# ==================== TRANSFORMATION ====================
 
-def transform_alias_product(product: Dict) -> Dict:
-    product_name = product.get('name', '')
-    sku = product.get('sku')
-    platform_data = {'sku': sku, 'gender': product.get('gender')}
-    return {
-        'product_id_platform': product.get('catalogId'),
-        'platform': 'alias',
-        'platform_id': None,
-        'product_name_platform': product_name,
-        'style_id_platform': None,
-        'style_id_normalized': None,
-        'platform_data': json.dumps(platform_data),
-        'keyword_used': product.get('keywordUsed'),
-        'embedding': None,
-        'embedding_text': generate_embedding_text_alias(product_name, sku)
-    }
+# Products travel as tuples in this column order, from transform to COPY
+INSERT_COLUMNS = (
+    'product_id_platform', 'platform', 'platform_id',
+    'product_name_platform', 'style_id_platform', 'style_id_normalized',
+    'platform_data', 'embedding', 'embedding_text', 'keyword_used'
+)
+EMBEDDING = INSERT_COLUMNS.index('embedding')
+EMBEDDING_TEXT = INSERT_COLUMNS.index('embedding_text')
+
+def with_embedding(row: Tuple, embedding: List[float]) -> Tuple:
+    return row[:EMBEDDING] + (embedding,) + row[EMBEDDING + 1:]
+
+# platform_data key -> stockx_products column, for fields copied as-is
+STOCKX_PLATFORM_DATA_COLUMNS = (
+    ('productType', 'productType'),
+    ('urlKey', 'urlKey'),
+    ('brand', 'brand'),
+    ('imageLink', 'imageLink'),
+    ('gender', 'productAttributes_gender'),
+    ('season', 'productAttributes_season'),
+    ('colorway', 'productAttributes_colorway'),
+    ('color', 'productAttributes_color'),
+)
+
+def transform_stockx_product(product: Dict) -> Tuple:
+    get = product.get
+    style_id = get('styleId')
+    product_name = get('title', '')
+    release_date = get('productAttributes_releaseDate')
+    retail_price = get('productAttributes_retailPrice')
+    platform_data = {key: get(column) for key, column in STOCKX_PLATFORM_DATA_COLUMNS}
+    platform_data['releaseDate'] = str(release_date) if release_date else None
+    platform_data['retailPrice'] = float(retail_price) if retail_price else None
+    return (
+        get('productId'), 'stockx', None,
+        product_name, style_id, normalize_style_id(style_id),
+        dumps_json(platform_data), None, generate_embedding_text_stockx(product_name, style_id), get('keywordUsed')
+    )
+
+def transform_alias_product(product: Dict) -> Tuple:
+    get = product.get
+    product_name = get('name', '')
+    sku = get('sku')
+    platform_data = {'sku': sku, 'gender': get('gender')}
+    return (
+        get('catalogId'), 'alias', None,
+        product_name, None, None,
+        dumps_json(platform_data), None, generate_embedding_text_alias(product_name, sku), get('keywordUsed')
+    )
 
 # ==================== ASYNC QUEUE ====================
 
-def insert_worker(queue: Queue):
+# One shared UNLOGGED table for the whole run: writers only COPY into it
+# (no WAL, no indexes, no conflict checks) and merge_staged_products()
+# folds it into products once at the end
+# Only the loaded columns, without products' defaults: a copied
+# product_id_internal nextval() default would burn a sequence value per
+# staged row on top of the one the merge takes
+CREATE_STAGE_SQL = f"""
+    CREATE UNLOGGED TABLE IF NOT EXISTS products_stage AS
+    SELECT {', '.join(INSERT_COLUMNS)} FROM products
+    WITH NO DATA
+"""
+COPY_STAGE_SQL = (
+    f"COPY products_stage ({', '.join(INSERT_COLUMNS)}) "
+    "FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+)
+MERGE_STAGE_SQL = f"""
+    INSERT INTO products ({', '.join(INSERT_COLUMNS)})
+    SELECT DISTINCT ON (product_id_platform) {', '.join(INSERT_COLUMNS)}
+    FROM products_stage
+    ORDER BY product_id_platform
+    ON CONFLICT (product_id_platform) DO UPDATE SET
+        product_name_platform = EXCLUDED.product_name_platform,
+        style_id_normalized = EXCLUDED.style_id_normalized,
+        platform_data = EXCLUDED.platform_data,
+        embedding = EXCLUDED.embedding,
+        embedding_text = EXCLUDED.embedding_text,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+def create_stage_table():
     conn = psycopg2.connect(**SUPABASE_CONFIG)
     cursor = conn.cursor()
-    insert_query = """
-        INSERT INTO products (
-            product_id_platform, platform, platform_id,
-            product_name_platform, style_id_platform, style_id_normalized,
-            platform_data, embedding, embedding_text, keyword_used
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s::jsonb, %s, %s, %s)
-        ON CONFLICT (product_id_platform) DO UPDATE SET
-            product_name_platform = EXCLUDED.product_name_platform,
-            style_id_normalized = EXCLUDED.style_id_normalized,
-            platform_data = EXCLUDED.platform_data,
-            embedding = EXCLUDED.embedding,
-            embedding_text = EXCLUDED.embedding_text,
-            updated_at = CURRENT_TIMESTAMP
+    cursor.execute(CREATE_STAGE_SQL)
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+def merge_staged_products() -> int:
     """
+    Upsert everything in products_stage into products, then drop the stage
 
-    while not stop_event.is_set() or not queue.empty():
+    Duplicates (e.g. from an earlier interrupted run) collapse in one
+    DISTINCT ON sort. If this fails the stage is kept, and the next run
+    merges it along with its own rows. Returns the number of rows merged.
+    """
+    conn = psycopg2.connect(**SUPABASE_CONFIG)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET statement_timeout = '0'")
+        cursor.execute(MERGE_STAGE_SQL)
+        merged = cursor.rowcount
+        cursor.execute("DROP TABLE products_stage")
+        conn.commit()
+        return merged
+    finally:
+        cursor.close()
+        conn.close()
+
+def embedding_is_halfvec(cursor) -> bool:
+    """True if products.embedding is halfvec (float16), False for vector"""
+    cursor.execute("""
+        SELECT format_type(atttypid, NULL)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    return cursor.fetchone()[0] == 'halfvec'
+
+def copy_row(product: Tuple, halfvec: bool) -> List:
+    """One products_stage CSV row; NULLs as \\N, embeddings as pgvector literals"""
+    row = []
+    for i, value in enumerate(product):
+        if value is None:
+            row.append('\\N')
+        elif i == EMBEDDING and halfvec:
+            # float16 precision (~4 significant digits): all a halfvec column
+            # keeps, and half the COPY payload of full float repr
+            row.append('[' + ','.join([f'{x:.4g}' for x in value]) + ']')
+        elif i == EMBEDDING:
+            row.append('[' + ','.join(map(repr, value)) + ']')
+        else:
+            row.append(value)
+    return row
+
+def flush_inserts(conn, cursor, batch: List[Tuple], halfvec: bool):
+    """COPY a batch of products into products_stage and commit"""
+    # Repeats within a batch are dropped here (last one wins) to save COPY
+    # payload; the DISTINCT ON merge dedups across batches and runs
+    rows = {p[0]: copy_row(p, halfvec) for p in batch}
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows.values())
+    buf.seek(0)
+    try:
+        cursor.copy_expert(COPY_STAGE_SQL, buf)
+        conn.commit()
+        with stats_lock:
+            stats['staged'] += len(rows)
+        print(f"   💾 Staged: {stats['staged']:,} | Generated: {stats['generated']:,} | Failed: {stats['failed']} | Skipped: {stats['skipped']:,}")
+    except Exception as e:
+        conn.rollback()
+        with stats_lock:
+            stats['failed'] += len(rows)
+        print(f"   ❌ Batch insert of {len(rows)} products failed: {e}")
+
+def insert_worker(queue: Queue, pool: psycopg2.pool.ThreadedConnectionPool, halfvec: bool):
+    """Consume the shared queue on a pooled connection until a None sentinel arrives"""
+    conn = pool.getconn()
+    cursor = conn.cursor()
+
+    batch = []
+    done = False
+    while not done:
+        # Drain up to INSERT_BATCH_SIZE products; a quiet second or a stop
+        # request flushes whatever has accumulated so far
         try:
             product = queue.get(timeout=1)
             if product is None:
-                break
-            cursor.execute(insert_query, (
-                product['product_id_platform'], product['platform'], product['platform_id'],
-                product['product_name_platform'], product['style_id_platform'],
-                product['style_id_normalized'], product['platform_data'],
-                product['embedding'], product['embedding_text'], product['keyword_used']
-            ))
-            conn.commit()
-            stats['inserted'] += 1
-            if stats['inserted'] % 100 == 0:
-                print(f"   💾 Inserted: {stats['inserted']:,} | Generated: {stats['generated']:,} | Failed: {stats['failed']} | Skipped: {stats['skipped']:,}")
-            queue.task_done()
-        except Exception as e:
-            if not stop_event.is_set():
-                stats['failed'] += 1
+                done = True
+            else:
+                batch.append(product)
+                if len(batch) < INSERT_BATCH_SIZE:
+                    continue
+        except Empty:
+            if stop_event.is_set() and queue.empty():
+                done = True
+            elif not batch:
+                continue
+
+        if batch:
+            flush_inserts(conn, cursor, batch, halfvec)
+            batch = []
     cursor.close()
-    conn.close()
+    pool.putconn(conn)
+
+def cache_format(halfvec: bool) -> Tuple[str, type]:
+    """(table, numpy dtype) of the embedding cache for a halfvec or vector column"""
+    return ('embeddings', np.float16) if halfvec else ('embeddings_f32', np.float32)
+
+def open_embedding_cache(halfvec: bool, path: str = EMBED_CACHE_PATH) -> sqlite3.Connection:
+    """
+    Open the on-disk embedding cache (sha256(text) -> vector bytes)
+
+    Vectors are kept at the column's precision, float16 for halfvec and
+    float32 for vector, each in its own table so neither reads the other.
+    """
+    table, _ = cache_format(halfvec)
+    cache = sqlite3.connect(path)
+    cache.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            text_hash BLOB PRIMARY KEY,
+            vector BLOB NOT NULL
+        )
+    """)
+    return cache
+
+def lookup_embeddings(cache: sqlite3.Connection, hashes: List[bytes], halfvec: bool) -> Dict[bytes, List[float]]:
+    table, dtype = cache_format(halfvec)
+    rows = cache.execute(
+        f"SELECT text_hash, vector FROM {table} WHERE text_hash IN ({','.join('?' * len(hashes))})",
+        hashes
+    ).fetchall()
+    return {
+        text_hash: np.frombuffer(vector, dtype=dtype).astype(np.float32).tolist()
+        for text_hash, vector in rows
+    }
+
+def store_embeddings(cache: sqlite3.Connection, hashes: List[bytes], embeddings: List[List[float]], halfvec: bool):
+    """Write new vectors through (~3KB each as float16, ~6KB as float32)"""
+    table, dtype = cache_format(halfvec)
+    cache.executemany(
+        f"INSERT OR REPLACE INTO {table} (text_hash, vector) VALUES (?, ?)",
+        [(text_hash, np.asarray(embedding, dtype=dtype).tobytes())
+         for text_hash, embedding in zip(hashes, embeddings)]
+    )
+    cache.commit()
+
+async def embed_products(products: Iterable[Tuple], queue: Queue, halfvec: bool) -> int:
+    """
+    Embed products with EMBED_CONCURRENCY requests in flight, queueing each for insertion
+
+    Each request carries up to EMBED_BATCH_SIZE texts, minus any already in
+    the embedding cache. Workers pull the next
+    chunk from a shared iterator, so only EMBED_CONCURRENCY tasks exist
+    however large the phase is. Returns how many products were taken
+    before a stop was requested.
+    """
+    products_iter = iter(products)
+    taken = 0
+
+    limiters = (RateLimiter(EMBED_RPM), RateLimiter(EMBED_TPM))
+    cache = open_embedding_cache(halfvec)
+
+    # Retries are ours (see generate_embeddings_batch), not the client's
+    async with openai.AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0) as client:
+        async def worker():
+            nonlocal taken
+            while not stop_event.is_set():
+                chunk = list(itertools.islice(products_iter, EMBED_BATCH_SIZE))
+                if not chunk:
+                    return
+                taken += len(chunk)
+
+                to_embed = [p for p in chunk if p[EMBEDDING_TEXT]]
+                stats['skipped'] += len(chunk) - len(to_embed)
+                if not to_embed:
+                    continue
+
+                # Texts embedded before (this run or an earlier one) skip the API
+                hashes = [hashlib.sha256(p[EMBEDDING_TEXT].encode()).digest() for p in to_embed]
+                cached = lookup_embeddings(cache, hashes, halfvec)
+                misses = []
+                for product, text_hash in zip(to_embed, hashes):
+                    if text_hash in cached:
+                        queue.put(with_embedding(product, cached[text_hash]))
+                    else:
+                        misses.append((product, text_hash))
+                stats['cached'] += len(to_embed) - len(misses)
+                if not misses:
+                    continue
+
+                embeddings = await generate_embeddings_batch(client, [p[EMBEDDING_TEXT] for p, _ in misses], limiters)
+                if embeddings:
+                    for (product, _), embedding in zip(misses, embeddings):
+                        queue.put(with_embedding(product, embedding))
+                    store_embeddings(cache, [h for _, h in misses], embeddings, halfvec)
+                    stats['generated'] += len(misses)
+                else:
+                    with stats_lock:
+                        stats['failed'] += len(misses)
 
-def process_with_queue(products: List[Dict], phase_name: str):
+        try:
+            await asyncio.gather(*(worker() for _ in range(EMBED_CONCURRENCY)))
+        finally:
+            cache.close()
+    return taken
+
+def process_with_queue(products: Iterable[Tuple], phase_name: str):
+    # Several writers share the queue so inserts overlap each other's
+    # round trips; upserts on distinct IDs only contend on row locks
     queue = Queue()
-    worker = Thread(target=insert_worker, args=(queue,))
-    worker.start()
+    pool = psycopg2.pool.ThreadedConnectionPool(1, INSERT_WORKERS, **SUPABASE_CONFIG)
+
+    # Embeddings are written (and cached) at the column's precision
+    conn = pool.getconn()
+    halfvec = embedding_is_halfvec(conn.cursor())
+    conn.rollback()
+    pool.putconn(conn)
+
+    workers = [Thread(target=insert_worker, args=(queue, pool, halfvec)) for _ in range(INSERT_WORKERS)]
+    for worker in workers:
+        worker.start()
 
-    print(f"\n🚀 {phase_name}: Processing {len(products):,} products...")
+    print(f"\n🚀 {phase_name}: Streaming products from MySQL...")
 
-    for i, product in enumerate(products):
+    # Whatever happens while embedding (e.g. the MySQL stream dropping), the
+    # writers get their sentinels: they are non-daemon and would otherwise
+    # keep the process alive forever
+    try:
+        taken = asyncio.run(embed_products(products, queue, halfvec))
         if stop_event.is_set():
-            print(f"\n⚠️  Stopped at product {i+1:,}/{len(products):,}")
-            break
-
-        embedding_text = product['embedding_text']
-        if embedding_text:
-            embedding = generate_embedding(embedding_text)
-            if embedding:
-                product['embedding'] = embedding
-                stats['generated'] += 1
-                queue.put(product)
-            else:
-                stats['failed'] += 1
+            print(f"\n⚠️  Stopped after {taken:,} products")
         else:
-            stats['skipped'] += 1
+            print(f"\n✅ {phase_name}: Embedded {taken:,} products")
+    finally:
+        print(f"\n⏳ Waiting for {phase_name} insertions to complete...")
+        for _ in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+        pool.closeall()
+
+# ==================== VECTOR INDEXES ====================
+
+def drop_vector_indexes() -> List[tuple]:
+    """
+    Drop the vector indexes on products for the duration of the bulk load
 
-    print(f"\n⏳ Waiting for {phase_name} insertions to complete...")
-    queue.put(None)
-    worker.join()
+    Every inserted embedding would otherwise be added to the HNSW/IVFFlat
+    graph one at a time; building once after the load is much cheaper.
+    Returns the dropped indexes' (name, definition) so they can be rebuilt.
+    """
+    conn = psycopg2.connect(**SUPABASE_CONFIG)
+    conn.autocommit = True  # Required for DROP INDEX CONCURRENTLY
+    cursor = conn.cursor()
 
-# ==================== MAIN ====================
+    cursor.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = 'products'::regclass
+          AND am.amname IN ('hnsw', 'ivfflat')
+    """)
+    indexes = cursor.fetchall()
 
-def main():
-    print("=" * 80)
-    print("SUPABASE FULL MIGRATION - ALL PRODUCTS")
-    print("=" * 80)
-    print("\n💰 Estimated Cost: ~$7.40 (text-embedding-3-small)")
-    print("⏱️  Estimated Time: 8-12 hours")
-    print("📊 Total Products: ~462,000")
-    print("\nPress Ctrl+C anytime to stop gracefully\n")
+    for name, _ in indexes:
+        print(f"   🗑️  Dropping {name} for the bulk load")
+        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+
+    cursor.close()
+    conn.close()
+    return indexes
+
+def rebuild_vector_indexes(indexes: List[tuple]):
+    """Recreate indexes dropped by drop_vector_indexes() from their saved definitions"""
+    if not indexes:
+        return
 
+    conn = psycopg2.connect(**SUPABASE_CONFIG)
+    conn.autocommit = True  # Required for CREATE INDEX CONCURRENTLY
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("SET statement_timeout = '0'")
+        cursor.execute("SET maintenance_work_mem = '2GB'")
+
+        for name, definition in indexes:
+            print(f"\n🔨 Rebuilding {name}...")
+            rebuild_start = time.time()
+            cursor.execute(definition.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1))
+            print(f"   ✅ Rebuilt in {(time.time() - rebuild_start)/60:.1f} minutes")
+    finally:
+        cursor.close()
+        conn.close()
+
+# ==================== MAIN ====================
+
+def run_phases():
     # PHASE 1: Inventory
     print("=" * 80)
     print("🎯 PHASE 1: Inventory-Matched Products (PRIORITY)")
     print("=" * 80)
-    stockx_inv = fetch_stockx_inventory_subset()
-    alias_inv = fetch_alias_inventory_subset()
-    print(f"   StockX: {len(stockx_inv):,}")
-    print(f"   Alias: {len(alias_inv):,}")
-
-    all_phase1 = []
-    for p in stockx_inv:
-        all_phase1.append(transform_stockx_product(p))
-    for p in alias_inv:
-        all_phase1.append(transform_alias_product(p))
-
-    if all_phase1:
-        process_with_queue(all_phase1, "Phase 1")
+    # Generators: each query only runs once the previous one is exhausted
+    all_phase1 = itertools.chain(
+        map(transform_stockx_product, fetch_stockx_inventory_subset()),
+        map(transform_alias_product, fetch_alias_inventory_subset())
+    )
+    process_with_queue(all_phase1, "Phase 1")
 
     if stop_event.is_set():
         print("\n❌ Stopped during Phase 1")
@@ -352,15 +728,8 @@ def main():
     print("\n" + "=" * 80)
     print("📋 PHASE 2: All StockX Products WITH Style IDs")
     print("=" * 80)
-    stockx_with_style = fetch_stockx_with_style_id_exclude_migrated()
-    print(f"   Remaining: {len(stockx_with_style):,} products")
-
-    all_phase2 = []
-    for p in stockx_with_style:
-        all_phase2.append(transform_stockx_product(p))
-
-    if all_phase2:
-        process_with_queue(all_phase2, "Phase 2")
+    all_phase2 = map(transform_stockx_product, fetch_stockx_with_style_id_exclude_migrated())
+    process_with_queue(all_phase2, "Phase 2")
 
     if stop_event.is_set():
         print("\n❌ Stopped during Phase 2")
@@ -370,25 +739,54 @@ def main():
     print("\n" + "=" * 80)
     print("📝 PHASE 3: Products WITHOUT Style IDs + All Alias")
     print("=" * 80)
-    stockx_no_style = fetch_stockx_without_style_id_exclude_migrated()
-    alias_all = fetch_alias_exclude_migrated()
-    print(f"   StockX (no styleId): {len(stockx_no_style):,}")
-    print(f"   Alias (remaining): {len(alias_all):,}")
+    all_phase3 = itertools.chain(
+        map(transform_stockx_product, fetch_stockx_without_style_id_exclude_migrated()),
+        map(transform_alias_product, fetch_alias_exclude_migrated())
+    )
+    process_with_queue(all_phase3, "Phase 3")
 
-    all_phase3 = []
-    for p in stockx_no_style:
-        all_phase3.append(transform_stockx_product(p))
-    for p in alias_all:
-        all_phase3.append(transform_alias_product(p))
+def main():
+    print("=" * 80)
+    print("SUPABASE FULL MIGRATION - ALL PRODUCTS")
+    print("=" * 80)
+    print("\n💰 Estimated Cost: ~$7.40 (text-embedding-3-small)")
+    print("⏱️  Estimated Time: 8-12 hours")
+    print("📊 Total Products: ~462,000")
+    print("\nPress Ctrl+C anytime to stop gracefully\n")
 
-    if all_phase3:
-        process_with_queue(all_phase3, "Phase 3")
+    # Inside the guarded block: if stage creation fails, the dropped
+    # indexes are still rebuilt (or their definitions printed)
+    vector_indexes = []
+    try:
+        vector_indexes = drop_vector_indexes()
+        create_stage_table()
+        run_phases()
+    finally:
+        # Also after a stop or error: whatever was staged still gets merged
+        # and indexed
+        try:
+            print("\n🔀 Merging staged products into products...")
+            stats['inserted'] = merge_staged_products()
+            print(f"   ✅ Merged {stats['inserted']:,} products")
+        except Exception as e:
+            print(f"\n❌ Merge failed (products_stage kept for the next run): {e}")
+        try:
+            rebuild_vector_indexes(vector_indexes)
+        except Exception as e:
+            print(f"\n❌ Index rebuild failed: {e}")
+            for name, definition in vector_indexes:
+                print(f"⚠️  {name} was dropped for the load; recreate it with:\n   {definition}")
+
+    if stop_event.is_set():
+        return
 
     # SUMMARY
     print("\n" + "=" * 80)
     print("✅ MIGRATION COMPLETE!")
     print("=" * 80)
     print(f"   Generated: {stats['generated']:,}")
+    print(f"   From cache: {stats['cached']:,}")
+    print(f"   Staged: {stats['staged']:,}")
     print(f"   Inserted: {stats['inserted']:,}")
     print(f"   Failed: {stats['failed']}")
     print(f"   Skipped: {stats['skipped']:,}")
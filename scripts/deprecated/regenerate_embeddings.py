@@ -6,23 +6,39 @@ Regenerates embeddings based on UPPERCASE product_name_platform.
 Processes in order of product_id_internal (insert order).
 
 Speed optimizations:
-- Batch processing (100 items at a time)
-- Parallel embedding generation (10 concurrent threads)
+- Batch processing (up to 2048 inputs per OpenAI request)
+- Concurrent embedding requests (asyncio, 16 in flight)
+- Paced by OpenAI's x-ratelimit-* headers (no 429 backoff tax)
 - Async insertion queue
 - Progress tracking
 
 Estimated time: ~2-3 hours for 124K products
 Estimated cost: ~$2.00
+
+DB writers run with synchronous_commit off: a crash can lose the last
+few commits' updates, which a rerun simply redoes.
 """
 
+import io
 import os
+import re
+import sys
 import time
-from queue import Queue
+import logging
+import logging.handlers
+import asyncio
+import importlib.util
+from queue import Queue, Empty
 from threading import Thread, Event
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, RateLimitError
 import psycopg2
+import psycopg2.pool
 from dotenv import load_dotenv
 
+# Optional: with h2 installed, httpx multiplexes requests over HTTP/2
+HTTP2 = importlib.util.find_spec('h2') is not None
+
 load_dotenv()
 
 # Configuration
@@ -35,95 +51,290 @@ SUPABASE_CONFIG = {
     'port': int(os.getenv('SUPABASE_PORT', '5432'))
 }
 
-client = OpenAI(api_key=OPENAI_API_KEY)
 stop_event = Event()
-stats = {'generated': 0, 'updated': 0, 'failed': 0}
+# Worker-side messages (retries, errors) go through a queue to a listener
+# thread, so the event loop and DB writers never block on stdout
+log_queue = Queue(-1)
+log = logging.getLogger('regenerate_embeddings')
+log.setLevel(logging.INFO)
+log.addHandler(logging.handlers.QueueHandler(log_queue))
+log.propagate = False
+
+# Only the event loop thread writes stats; each update worker counts into
+# its own dict, summed into stats['updated'] once the workers are joined
+stats = {'generated': 0, 'updated': 0, 'failed': 0, 'skipped': 0}
+
+BATCH_SIZE = 2048  # Inputs per OpenAI request (API maximum)
+MAX_BATCH_CHARS = 200000  # ~50K tokens; keeps a request well under the per-request token cap
+EMBED_CONCURRENCY = 16  # OpenAI requests in flight at once (each carries up to BATCH_SIZE inputs)
+NUM_UPDATERS = 4  # Parallel DB writers, one pooled connection each (mind Supabase's connection limit)
+UPDATE_BATCH_SIZE = 1000  # Rows per COPY + UPDATE
+
+
+# x-ratelimit-reset-* durations look like "20ms", "1s", "6m0s"
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    """Seconds in an OpenAI reset header (0 if missing or unparseable)"""
+    return sum(float(n) * _DURATION_SECONDS[unit] for n, unit in _DURATION_RE.findall(value or ''))
+
+
+def retry_after(error):
+    """Seconds the API asked us to wait (1s if it didn't say)"""
+    try:
+        return float(error.response.headers.get('retry-after', 1))
+    except (AttributeError, ValueError):
+        return 1.0
+
+
+class RateBudget:
+    """
+    Pauses new requests when OpenAI's rate-limit headers say the budget is nearly spent
+
+    Every response reports the requests and tokens left in the current
+    window and when each resets. Once either drops below one batch's worth,
+    requests wait for the reset instead of running into 429s.
+    """
 
-BATCH_SIZE = 100
-NUM_WORKERS = 10  # Parallel OpenAI API calls
+    def __init__(self, min_requests=5, min_tokens=MAX_BATCH_CHARS // 4):
+        self.min_requests = min_requests
+        self.min_tokens = min_tokens
+        self.resume_at = 0.0
 
+    def pause(self, seconds):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
 
-def generate_embedding(text, retry_count=3):
-    """Generate embedding with retries"""
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def update(self, headers):
+        try:
+            remaining_requests = int(headers.get('x-ratelimit-remaining-requests', self.min_requests))
+            remaining_tokens = int(headers.get('x-ratelimit-remaining-tokens', self.min_tokens))
+        except ValueError:
+            return
+        if remaining_requests < self.min_requests:
+            self.pause(parse_duration(headers.get('x-ratelimit-reset-requests')))
+        if remaining_tokens < self.min_tokens:
+            self.pause(parse_duration(headers.get('x-ratelimit-reset-tokens')))
+
+
+rate_budget = RateBudget()
+
+
+async def generate_embeddings(client, texts, retry_count=3):
+    """
+    Generate embeddings for multiple texts in ONE API call, with retries
+
+    Waits on rate_budget before sending. A 429 pauses every request for its
+    Retry-After; other errors are retried with exponential backoff.
+    """
     for attempt in range(retry_count):
         if stop_event.is_set():
             return None
+        await rate_budget.wait()
         try:
-            response = client.embeddings.create(
-                input=text,
+            raw = await client.embeddings.with_raw_response.create(
+                input=texts,
                 model="text-embedding-3-small"
             )
-            return response.data[0].embedding
+            rate_budget.update(raw.headers)
+            response = raw.parse()
+            return [item.embedding for item in response.data]
+        except RateLimitError as e:
+            if attempt < retry_count - 1:
+                wait = retry_after(e)
+                log.warning(f"   ⏸️  Rate limited, pausing {wait:.1f}s")
+                rate_budget.pause(wait)
+            else:
+                log.error(f"   ❌ Failed after {retry_count} attempts: {e}")
+                return None
         except Exception as e:
             if attempt < retry_count - 1:
-                time.sleep(2 ** attempt)
+                await asyncio.sleep(2 ** attempt)
             else:
-                print(f"   ❌ Failed after {retry_count} attempts: {e}")
+                log.error(f"   ❌ Failed after {retry_count} attempts: {e}")
                 return None
     return None
 
 
-def embedding_worker(task_queue, result_queue):
-    """Worker thread to generate embeddings"""
-    while not stop_event.is_set():
-        try:
-            task = task_queue.get(timeout=1)
-            if task is None:  # Poison pill
-                break
+def embedding_is_halfvec(cur):
+    """True if products.embedding is halfvec (float16), False for vector"""
+    cur.execute("""
+        SELECT format_type(atttypid, NULL)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    return cur.fetchone()[0] == 'halfvec'
+
+
+def format_embedding(embedding, halfvec):
+    """
+    pgvector literal: float16 precision (~4 significant digits) for a
+    halfvec column, which is all it keeps; full float repr for vector
+    """
+    if halfvec:
+        return '[' + ','.join([f'{x:.4g}' for x in embedding]) + ']'
+    return '[' + ','.join(map(repr, embedding)) + ']'
+
+
+def iter_batches(groups):
+    """
+    Split (product_ids, embedding_text) groups into embedding batches
+
+    A batch closes at BATCH_SIZE inputs or once MAX_BATCH_CHARS of text is
+    collected.
+    """
+    batch = []
+    chars = 0
+    for product_ids, embedding_text in groups:
+        batch.append((product_ids, embedding_text))
+        chars += len(embedding_text)
+        if len(batch) >= BATCH_SIZE or chars >= MAX_BATCH_CHARS:
+            yield batch
+            batch = []
+            chars = 0
+    if batch:
+        yield batch
 
-            product_id_internal, embedding_text = task
-            embedding = generate_embedding(embedding_text)
 
-            if embedding:
-                result_queue.put((product_id_internal, embedding))
-                stats['generated'] += 1
-            else:
-                stats['failed'] += 1
+def put_all(result_queue, results):
+    """Queue results one by one, blocking while the DB writers catch up"""
+    for result in results:
+        result_queue.put(result)
 
-            task_queue.task_done()
 
-        except Exception:
-            continue
+async def embed_batch(client, batch, result_queue, semaphore):
+    """Embed one batch and hand its (product_ids, embedding) pairs to the DB writers"""
+    try:
+        # OpenAI returns embeddings in input order
+        embeddings = await generate_embeddings(client, [text for _, text in batch])
+
+        if embeddings and len(embeddings) == len(batch):
+            results = list(zip((product_ids for product_ids, _ in batch), embeddings))
+            # result_queue is bounded; block in a thread, not on the event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, put_all, result_queue, results)
+            stats['generated'] += len(batch)
+        else:
+            stats['failed'] += sum(len(product_ids) for product_ids, _ in batch)
+    finally:
+        semaphore.release()
+
+
+async def embed_products(groups, result_queue, total, start_time, updater_stats):
+    """
+    Embed (product_ids, embedding_text) groups with at most EMBED_CONCURRENCY requests in flight
+
+    One event loop drives all requests over a shared keep-alive connection
+    pool; a new batch is only taken from `groups` once a request slot frees up.
+    Progress reads the update workers' own counters (`updater_stats`) as a
+    lagging snapshot.
+    """
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    http_client = httpx.AsyncClient(
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=EMBED_CONCURRENCY,
+            max_keepalive_connections=EMBED_CONCURRENCY,
+            keepalive_expiry=60  # Outlive the pauses between batches, so TLS is set up once
+        ),
+        timeout=httpx.Timeout(60.0)
+    )
+    tasks = []
+    submitted = 0
+    next_report = 1000
+
+    # max_retries=0: rate limits are handled by rate_budget, not the SDK's own backoff
+    async with AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0) as client:
+        for batch in iter_batches(groups):
+            if stop_event.is_set():
+                break
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(embed_batch(client, batch, result_queue, semaphore)))
+            submitted += sum(len(product_ids) for product_ids, _ in batch)
 
+            # Progress update
+            if submitted >= next_report or submitted == total:
+                next_report = (submitted // 1000 + 1) * 1000
+                elapsed = time.time() - start_time
+                rate = submitted / elapsed if elapsed > 0 else 0
+                eta = (total - submitted) / rate if rate > 0 else 0
 
-def update_worker(result_queue):
-    """Worker thread to update database"""
-    conn = psycopg2.connect(**SUPABASE_CONFIG)
+                print(f"   Progress: {submitted:,}/{total:,} ({submitted/total*100:.1f}%)")
+                updated = sum(local_stats['updated'] for local_stats in updater_stats)
+                print(f"   Generated: {stats['generated']:,} | Updated: {updated:,} | Failed: {stats['failed']}")
+                print(f"   Rate: {rate:.1f} products/sec | ETA: {eta/60:.1f} min\n")
+
+        await asyncio.gather(*tasks)
+
+
+def update_worker(result_queue, pool, local_stats):
+    """Worker thread to update database on its own pooled connection, counting into `local_stats`"""
+    conn = pool.getconn()
     cur = conn.cursor()
+    # One-off bulk update: a crash just means re-running, so skip the WAL flush per commit
+    cur.execute("SET synchronous_commit = off")
 
-    while not stop_event.is_set():
+    # Per-connection staging table for the batched UPDATE; columns take products' types
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS upd_stage ON COMMIT DELETE ROWS AS
+        SELECT product_id_internal AS id, embedding AS emb
+        FROM products
+        WITH NO DATA
+    """)
+    conn.commit()
+    halfvec = embedding_is_halfvec(cur)
+
+    done = False
+    while not done and not stop_event.is_set():
         try:
             batch = []
             # Collect batch
-            while len(batch) < 50:
+            while len(batch) < UPDATE_BATCH_SIZE:
                 try:
                     result = result_queue.get(timeout=1)
                     if result is None:  # Poison pill
+                        done = True
                         break
                     batch.append(result)
-                except:
+                except Empty:
                     break
 
             if not batch:
                 continue
 
-            # Batch update
-            for product_id_internal, embedding in batch:
-                cur.execute("""
-                    UPDATE products
-                    SET embedding = %s::vector
-                    WHERE product_id_internal = %s
-                """, (embedding, product_id_internal))
-                stats['updated'] += 1
-
-            conn.commit()
+            # Batch update: COPY the batch into upd_stage, then one UPDATE ... FROM
+            buf = io.StringIO()
+            updated = 0
+            for product_ids, embedding in batch:
+                # One embedding fans out to every product sharing its text
+                literal = format_embedding(embedding, halfvec)
+                for product_id_internal in product_ids:
+                    buf.write(f"{product_id_internal}\t{literal}\n")
+                updated += len(product_ids)
+            buf.seek(0)
+            cur.copy_expert("COPY upd_stage (id, emb) FROM STDIN", buf)
+            cur.execute("""
+                UPDATE products
+                SET embedding = s.emb
+                FROM upd_stage s
+                WHERE products.product_id_internal = s.id
+            """)
+
+            conn.commit()  # Also empties upd_stage
+            local_stats['updated'] += updated
 
         except Exception as e:
-            print(f"   ❌ Update error: {e}")
+            log.error(f"   ❌ Update error: {e}")
             conn.rollback()
 
     cur.close()
-    conn.close()
+    pool.putconn(conn)
 
 
 def main():
@@ -132,7 +343,8 @@ def main():
     print("="*80)
     print("\n⚡ Speed optimizations:")
     print(f"   - Batch size: {BATCH_SIZE}")
-    print(f"   - Parallel workers: {NUM_WORKERS}")
+    print(f"   - Concurrent requests: {EMBED_CONCURRENCY}")
+    print(f"   - DB writers: {NUM_UPDATERS}")
     print(f"   - Model: text-embedding-3-small")
 
     # Fetch all products that need embedding regeneration
@@ -140,18 +352,36 @@ def main():
     conn = psycopg2.connect(**SUPABASE_CONFIG)
     cur = conn.cursor()
 
+    # Products without a name have nothing to embed; they are left as they are
     cur.execute("""
         SELECT
-            product_id_internal,
-            product_name_platform
+            count(*) FILTER (WHERE product_name_platform <> ''),
+            count(DISTINCT UPPER(product_name_platform)) FILTER (WHERE product_name_platform <> ''),
+            count(*) FILTER (WHERE product_name_platform IS NULL OR product_name_platform = '')
         FROM products
-        ORDER BY product_id_internal
     """)
+    total, unique_names, stats['skipped'] = cur.fetchone()
+    cur.close()
 
-    products = cur.fetchall()
-    total = len(products)
+    # Identical UPPERCASE names (matching current state) embed identically:
+    # Postgres groups them, so each is sent to OpenAI once and the vector fans
+    # out to every product_id_internal in the group. Groups are streamed from
+    # a server-side cursor as the embedding loop consumes them.
+    cur = conn.cursor(name='regen_stream')
+    cur.itersize = 2000
+    cur.execute("""
+        SELECT
+            array_agg(product_id_internal ORDER BY product_id_internal),
+            UPPER(product_name_platform)
+        FROM products
+        WHERE product_name_platform <> ''
+        GROUP BY UPPER(product_name_platform)
+        ORDER BY MIN(product_id_internal)
+    """)
 
-    print(f"   ✅ Found {total:,} products to process")
+    print(f"   ✅ Found {total:,} products to process ({unique_names:,} unique names)")
+    if stats['skipped']:
+        print(f"   ⏭️  Skipping {stats['skipped']:,} products without a name")
     print(f"\n💰 Estimated cost: ${total * 0.02 / 1000000:.2f}")
     print(f"⏱️  Estimated time: {total / 1000:.1f} minutes\n")
 
@@ -160,55 +390,36 @@ def main():
         print("❌ Cancelled")
         return
 
-    # Setup queues and workers
-    task_queue = Queue(maxsize=500)
-    result_queue = Queue(maxsize=500)
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    log_listener.start()
 
-    # Start embedding workers
-    workers = []
-    for i in range(NUM_WORKERS):
-        worker = Thread(target=embedding_worker, args=(task_queue, result_queue), daemon=True)
-        worker.start()
-        workers.append(worker)
+    # Setup result queue and DB writers
+    result_queue = Queue(maxsize=UPDATE_BATCH_SIZE * NUM_UPDATERS)
 
-    # Start update worker
-    updater = Thread(target=update_worker, args=(result_queue,), daemon=True)
-    updater.start()
+    # Start update workers, each draining result_queue on its own connection
+    pool = psycopg2.pool.ThreadedConnectionPool(1, NUM_UPDATERS, **SUPABASE_CONFIG)
+    updaters = []
+    updater_stats = [{'updated': 0} for _ in range(NUM_UPDATERS)]
+    for local_stats in updater_stats:
+        updater = Thread(target=update_worker, args=(result_queue, pool, local_stats), daemon=True)
+        updater.start()
+        updaters.append(updater)
 
-    # Process products
+    # Process products: embedding runs on one event loop in this thread
     print(f"\n🚀 Processing {total:,} products...\n")
     start_time = time.time()
 
-    for i, (product_id_internal, product_name) in enumerate(products, 1):
-        if stop_event.is_set():
-            break
-
-        # Use UPPERCASE name for embedding (matching current state)
-        embedding_text = product_name.upper() if product_name else ""
-        task_queue.put((product_id_internal, embedding_text))
-
-        # Progress update
-        if i % 1000 == 0 or i == total:
-            elapsed = time.time() - start_time
-            rate = i / elapsed if elapsed > 0 else 0
-            eta = (total - i) / rate if rate > 0 else 0
-
-            print(f"   Progress: {i:,}/{total:,} ({i/total*100:.1f}%)")
-            print(f"   Generated: {stats['generated']:,} | Updated: {stats['updated']:,} | Failed: {stats['failed']}")
-            print(f"   Rate: {rate:.1f} products/sec | ETA: {eta/60:.1f} min\n")
-
-    # Wait for completion
-    print("⏳ Waiting for workers to finish...")
-    task_queue.join()
+    asyncio.run(embed_products(cur, result_queue, total, start_time, updater_stats))
 
     # Stop workers
-    for _ in range(NUM_WORKERS):
-        task_queue.put(None)
-    for worker in workers:
-        worker.join()
-
-    result_queue.put(None)
-    updater.join()
+    print("⏳ Waiting for workers to finish...")
+    for _ in range(NUM_UPDATERS):
+        result_queue.put(None)
+    for updater in updaters:
+        updater.join()
+    pool.closeall()
+    stats['updated'] = sum(local_stats['updated'] for local_stats in updater_stats)
+    log_listener.stop()  # Flushes any queued messages
 
     # Final stats
     elapsed = time.time() - start_time
@@ -218,6 +429,7 @@ def main():
     print(f"✅ Generated:  {stats['generated']:,}")
     print(f"✅ Updated:    {stats['updated']:,}")
     print(f"❌ Failed:     {stats['failed']:,}")
+    print(f"⏭️  Skipped:    {stats['skipped']:,}")
     print(f"\n⏱️  Total time: {elapsed/60:.1f} minutes")
     print(f"⚡ Rate: {total/elapsed:.1f} products/sec")
 
@@ -0,0 +1,494 @@
+"""
+Vector Index Builder
+====================
+
+Single implementation behind the vector index scripts:
+- create_vector_index_aggressive.py -> build_vector_index('aggressive')
+- create_vector_index_minimal.py    -> build_vector_index('minimal')
+- create_indexes_safe.py            -> build_vector_index('safe', conn)
+
+Modes:
+- aggressive: HNSW on a halfvec column, high memory first
+- safe:       IVFFlat with optimal lists, pre-flight memory check
+- minimal:    IVFFlat with 1/4 of optimal lists, low memory first
+
+Every mode builds CONCURRENTLY with parallel maintenance workers, watches
+progress from a second connection, verifies the index is valid, and falls
+back through its strategy ladder when a build fails.
+"""
+
+import os
+import math
+import time
+import threading
+import psycopg2
+from psycopg2 import sql
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SUPABASE_CONFIG = {
+    'host': os.getenv('SUPABASE_HOST'),
+    'database': os.getenv('SUPABASE_DATABASE'),
+    'user': os.getenv('SUPABASE_USER'),
+    'password': os.getenv('SUPABASE_PASSWORD'),
+    'port': int(os.getenv('SUPABASE_PORT', '5432'))
+}
+
+INDEX_NAME = 'idx_products_embedding'
+EMBEDDING_DIM = 1536  # text-embedding-3-small
+HALFVEC_SQL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'sql', 'convert_embedding_to_halfvec.sql'
+)
+MIN_LISTS = 10
+
+MEMORY_UNITS = {'kB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+# Build monitoring
+PROGRESS_POLL_SECONDS = 2
+PROGRESS_PRINT_SECONDS = 30
+STALL_TIMEOUT_SECONDS = 600  # Cancel a strategy whose progress counters stop moving
+INITIALIZING_TIMEOUT_SECONDS = 60  # Cancel a strategy stuck this long before its build starts
+# Phases that legitimately run long without moving those counters (k-means,
+# waiting on other transactions), so they are never treated as a stall
+UNCOUNTED_PHASES = ('initializing', 'k-means', 'waiting')
+
+# Per-mode strategy ladders: (maintenance_work_mem, lists divisor of optimal)
+# A divisor of None means MIN_LISTS; HNSW modes ignore the divisor.
+MODES = {
+    'aggressive': {
+        'method': 'hnsw',
+        'halfvec': True,
+        'preflight': False,
+        'ladder': [('2GB', 1), ('1GB', 1), ('512MB', 1), ('256MB', 1), ('128MB', 1), ('64MB', 1)],
+    },
+    'safe': {
+        'method': 'ivfflat',
+        'halfvec': False,
+        'preflight': True,
+        'ladder': [('512MB', 1), ('256MB', 1), ('128MB', 1), ('256MB', 2), ('128MB', 4)],
+    },
+    'minimal': {
+        'method': 'ivfflat',
+        'halfvec': False,
+        'preflight': False,
+        'ladder': [('64MB', 4), ('96MB', 4), ('128MB', 4), ('128MB', 8), ('64MB', None)],
+    },
+}
+
+# Composed once; only the index name, operator class and parameters vary
+CREATE_IVFFLAT_SQL = sql.SQL("""
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS {idx}
+    ON products
+    USING ivfflat (embedding {opclass})
+    WITH (lists = {lists})
+""")
+CREATE_HNSW_SQL = sql.SQL("""
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS {idx}
+    ON products
+    USING hnsw (embedding {opclass})
+    WITH (m = {m}, ef_construction = {ef_construction})
+""")
+SET_MEMORY_SQL = sql.SQL("SET maintenance_work_mem = {}")
+
+
+def estimate_embedding_count(cur):
+    """
+    Estimate products with embeddings from planner statistics
+
+    reltuples * (1 - null_frac) after ANALYZE is O(1), unlike
+    COUNT(*) which scans the whole table. The index parameters
+    are only sized from this, so a few percent of error is harmless.
+    """
+    cur.execute("ANALYZE products")
+    cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass")
+    total = max(0, cur.fetchone()[0])
+
+    cur.execute("""
+        SELECT null_frac FROM pg_stats
+        WHERE tablename = 'products' AND attname = 'embedding'
+    """)
+    row = cur.fetchone()
+    null_frac = row[0] if row else 0
+
+    return int(total * (1 - null_frac))
+
+
+def configure_hnsw_params(vector_count):
+    """Pick (m, ef_construction) for an HNSW index based on row count"""
+    if vector_count < 100_000:
+        return 16, 64
+    elif vector_count < 1_000_000:
+        return 24, 100
+    else:
+        return 32, 128
+
+
+def configure_ivfflat_params(row_count):
+    """
+    Pick IVFFlat lists/probes for a row count
+
+    Up to 1M rows: lists = rows / 1000 (at least 10)
+    Over 1M rows:  lists = sqrt(rows)
+    probes = sqrt(lists) in both bands
+    """
+    if row_count <= 1_000_000:
+        lists = max(MIN_LISTS, row_count // 1000)
+    else:
+        lists = int(math.sqrt(row_count))
+    return {'lists': lists, 'probes': max(1, int(math.sqrt(lists)))}
+
+
+def set_default_probes(cur, lists):
+    """Persist ivfflat.probes = sqrt(lists) as the database default so later sessions pick it up"""
+    probes = max(1, int(math.sqrt(lists)))
+    try:
+        cur.execute("SELECT current_database()")
+        db_name = cur.fetchone()[0]
+        cur.execute(sql.SQL("ALTER DATABASE {} SET ivfflat.probes = {}").format(
+            sql.Identifier(db_name), sql.Literal(probes)))
+        print(f"   🔎 ivfflat.probes = {probes} set as database default")
+    except Exception as e:
+        print(f"   ⚠️  Could not set ivfflat.probes default: {e}")
+        print(f"   💡 Run SET ivfflat.probes = {probes} per session instead")
+
+
+def configure_async_io(cur):
+    """
+    Use PostgreSQL 18 asynchronous I/O for the index build's heap scans
+
+    io_method is server-wide (postmaster) and can't be SET per session, so
+    only report it; maintenance_io_concurrency is per-session and controls
+    how many reads the build keeps in flight.
+    """
+    cur.execute("SELECT current_setting('server_version_num')::int >= 180000")
+    if not cur.fetchone()[0]:
+        print("   ℹ️  PostgreSQL < 18: asynchronous I/O not available")
+        return
+
+    cur.execute("SHOW io_method")
+    io_method = cur.fetchone()[0]
+    cur.execute("SET maintenance_io_concurrency = 32")
+    if io_method != 'io_uring':
+        print(f"   ℹ️  io_method = {io_method} (io_uring must be enabled in postgresql.conf)")
+
+
+def parse_memory(value):
+    """Convert a Postgres memory setting ('512MB', '65536kB') to bytes"""
+    for unit, factor in MEMORY_UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value) * 1024  # Bare numbers are kB
+
+
+def estimate_ivfflat_bytes(rows, dim, lists, bytes_per_dim=4):
+    """
+    Approximate memory pgvector needs to build an IVFFlat index
+
+    The k-means step holds a sample of 50 vectors per list plus the
+    list centers in maintenance_work_mem.
+    """
+    samples = min(rows, lists * 50)
+    return (samples + lists) * (dim * bytes_per_dim + 8)
+
+
+def embedding_type(cur):
+    """Return the embedding column's type, e.g. 'vector(1536)' or 'halfvec(1536)'"""
+    cur.execute("""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+    """)
+    return cur.fetchone()[0]
+
+
+def embedding_opclass(cur):
+    """Cosine operator class matching the embedding column type (vector or halfvec)"""
+    return 'halfvec_cosine_ops' if embedding_type(cur).startswith('halfvec') else 'vector_cosine_ops'
+
+
+def convert_to_halfvec(cur):
+    """
+    Store embeddings as halfvec (2 bytes/dim instead of 4)
+
+    Every HNSW/IVFFlat index on products is dropped first (a
+    vector_cosine_ops index can't be rebuilt on halfvec), then
+    HALFVEC_SQL_PATH runs: the column rewrite, plus
+    find_platform_matched_product_ids redefined to cast its query to
+    halfvec. Same conversion as running that script by hand.
+    """
+    column_type = embedding_type(cur)
+    if column_type.startswith('halfvec'):
+        return
+
+    print(f"\n🔄 Converting embedding column {column_type} -> halfvec({EMBEDDING_DIM})...")
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE i.indrelid = 'products'::regclass
+          AND am.amname IN ('hnsw', 'ivfflat')
+    """)
+    for (name,) in cur.fetchall():
+        print(f"   🗑️  Dropping {name} (tied to the old column type)")
+        cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+
+    with open(HALFVEC_SQL_PATH) as f:
+        cur.execute(f.read())
+    print(f"   ✅ Embedding column and find_platform_matched_product_ids converted")
+
+
+def index_state(cur):
+    """Return True/False for a valid/invalid idx_products_embedding, None if it doesn't exist"""
+    cur.execute("""
+        SELECT indisvalid FROM pg_index
+        WHERE indexrelid = to_regclass(%s)
+    """, (INDEX_NAME,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def drop_index(cur):
+    """Drop idx_products_embedding (e.g. the invalid leftover of a failed CONCURRENTLY build)"""
+    cur.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(INDEX_NAME)))
+
+
+def execute_with_progress(conn, cur, statement):
+    """
+    Run a CREATE INDEX while a second connection watches its progress
+
+    Polls pg_stat_progress_create_index for the building backend. The
+    build is cancelled with pg_cancel_backend(), so the next strategy
+    starts right away, if it stays in 'initializing' for
+    INITIALIZING_TIMEOUT_SECONDS, or if its progress counters don't move
+    for STALL_TIMEOUT_SECONDS (outside UNCOUNTED_PHASES). Re-raises
+    whatever the build raised (QueryCanceled if cancelled).
+    """
+    pid = conn.get_backend_pid()
+    errors = []
+
+    def build():
+        try:
+            cur.execute(statement)
+        except Exception as e:
+            errors.append(e)
+
+    # Connected before the build starts: if this fails, nothing is left running
+    monitor = psycopg2.connect(**SUPABASE_CONFIG)
+    monitor.autocommit = True
+    mon_cur = monitor.cursor()
+
+    builder = threading.Thread(target=build)
+    builder.start()
+
+    last_progress = None
+    last_change = last_print = phase_start = time.monotonic()
+
+    try:
+        while builder.is_alive():
+            builder.join(PROGRESS_POLL_SECONDS)
+            if not builder.is_alive():
+                break
+
+            mon_cur.execute("""
+                SELECT phase, blocks_done, blocks_total, tuples_done, tuples_total
+                FROM pg_stat_progress_create_index
+                WHERE pid = %s
+            """, (pid,))
+            progress = mon_cur.fetchone()
+            if progress is None:
+                continue
+
+            now = time.monotonic()
+            phase, blocks_done, blocks_total, tuples_done, tuples_total = progress
+
+            if last_progress is None or phase != last_progress[0]:
+                phase_start = now
+
+            if last_progress is None or phase != last_progress[0] or now - last_print >= PROGRESS_PRINT_SECONDS:
+                print(f"      ⏳ {phase}: blocks {blocks_done:,}/{blocks_total:,}, "
+                      f"tuples {tuples_done:,}/{tuples_total:,}")
+                last_print = now
+
+            if phase == 'initializing' and now - phase_start > INITIALIZING_TIMEOUT_SECONDS:
+                print(f"      ⏹️  Still initializing after {INITIALIZING_TIMEOUT_SECONDS}s, cancelling build")
+                mon_cur.execute("SELECT pg_cancel_backend(%s)", (pid,))
+                builder.join()
+            elif progress != last_progress or any(p in phase for p in UNCOUNTED_PHASES):
+                last_progress = progress
+                last_change = now
+            elif now - last_change > STALL_TIMEOUT_SECONDS:
+                print(f"      ⏹️  No progress in '{phase}' for {STALL_TIMEOUT_SECONDS // 60} min, cancelling build")
+                mon_cur.execute("SELECT pg_cancel_backend(%s)", (pid,))
+                builder.join()
+    finally:
+        mon_cur.close()
+        monitor.close()
+
+    if errors:
+        raise errors[0]
+
+
+def build_strategies(mode, product_count):
+    """Expand a mode's ladder into concrete strategies for this row count"""
+    config = MODES[mode]
+    strategies = []
+
+    if config['method'] == 'hnsw':
+        m, ef_construction = configure_hnsw_params(product_count)
+        for memory, _ in config['ladder']:
+            strategies.append({
+                'memory': memory,
+                'params': {'m': m, 'ef_construction': ef_construction},
+                'desc': f"{memory}, m = {m}, ef_construction = {ef_construction}",
+            })
+    else:
+        optimal_lists = configure_ivfflat_params(product_count)['lists']
+        for memory, divisor in config['ladder']:
+            lists = MIN_LISTS if divisor is None else max(MIN_LISTS, optimal_lists // divisor)
+            strategies.append({
+                'memory': memory,
+                'params': {'lists': lists},
+                'desc': f"{memory}, {lists} lists",
+            })
+
+    return strategies
+
+
+def preflight(cur, product_count, strategies, bytes_per_dim):
+    """Skip IVFFlat strategies whose k-means sample can't fit in maintenance_work_mem"""
+    cur.execute("SELECT vector_dims(embedding) FROM products WHERE embedding IS NOT NULL LIMIT 1")
+    dim = cur.fetchone()[0]
+
+    cur.execute("SHOW maintenance_work_mem")
+    print(f"   💾 Current maintenance_work_mem: {cur.fetchone()[0]}, vector dims: {dim}")
+
+    fitting = []
+    for strategy in strategies:
+        required = estimate_ivfflat_bytes(product_count, dim, strategy['params']['lists'], bytes_per_dim)
+        if required <= parse_memory(strategy['memory']):
+            fitting.append(strategy)
+        else:
+            print(f"   NOTICE: ivfflat build would not fit into maintenance_work_mem "
+                  f"({strategy['desc']}, needs ~{required // 1024 ** 2}MB), skipping")
+
+    # Estimate is approximate; if it rules everything out, try them all anyway
+    return fitting or strategies
+
+
+def build_vector_index(mode, conn=None):
+    """
+    Create idx_products_embedding using the given mode's strategy ladder
+
+    Opens its own connection unless one is passed in. Returns True if a
+    valid index exists when done.
+    """
+    config = MODES[mode]
+    own_conn = conn is None
+    if own_conn:
+        conn = psycopg2.connect(**SUPABASE_CONFIG)
+    conn.autocommit = True  # Required for CREATE INDEX CONCURRENTLY
+    cur = conn.cursor()
+
+    try:
+        print(f"\n🎯 Creating vector index ({mode} mode, {config['method'].upper()})...")
+        configure_async_io(cur)
+
+        product_count = estimate_embedding_count(cur)
+        if product_count == 0:
+            print("   ⚠️  No products with embeddings, skipping index")
+            return False
+
+        print(f"   📊 Found {product_count:,} products with embeddings")
+
+        if config['halfvec']:
+            convert_to_halfvec(cur)
+
+        # Match the operator class to whatever type the column holds now
+        opclass = embedding_opclass(cur)
+
+        state = index_state(cur)
+        if state:
+            print(f"   ⚠️  Index already exists")
+            return True
+        if state is False:
+            print(f"   🗑️  Dropping invalid index from a previous attempt")
+            drop_index(cur)
+
+        strategies = build_strategies(mode, product_count)
+        if config['preflight'] and config['method'] == 'ivfflat':
+            strategies = preflight(cur, product_count, strategies, 2 if opclass.startswith('halfvec') else 4)
+
+        create_sql = CREATE_HNSW_SQL if config['method'] == 'hnsw' else CREATE_IVFFLAT_SQL
+
+        for i, strategy in enumerate(strategies, 1):
+            print(f"\n   Strategy {i}/{len(strategies)}: {strategy['desc']}")
+
+            try:
+                cur.execute(SET_MEMORY_SQL.format(sql.Literal(strategy['memory'])))
+                cur.execute("SET max_parallel_maintenance_workers = 7")
+                cur.execute("SET max_parallel_workers = 8")
+
+                # Let the build use more than the planner's default worker count
+                cur.execute("ALTER TABLE products SET (parallel_workers = 8)")
+                try:
+                    execute_with_progress(conn, cur, create_sql.format(
+                        idx=sql.Identifier(INDEX_NAME),
+                        opclass=sql.SQL(opclass),
+                        **{k: sql.Literal(v) for k, v in strategy['params'].items()},
+                    ))
+                finally:
+                    cur.execute("ALTER TABLE products RESET (parallel_workers)")
+
+                if not index_state(cur):
+                    print(f"      ❌ Index build finished but index is INVALID")
+                    drop_index(cur)
+                    continue
+
+                print(f"      ✅ Vector index created ({strategy['desc']})")
+                if config['method'] == 'ivfflat':
+                    set_default_probes(cur, strategy['params']['lists'])
+                return True
+
+            except Exception as e:
+                error_msg = str(e).lower()
+
+                # A failed CONCURRENTLY build leaves an invalid index behind
+                drop_index(cur)
+
+                if 'memory' in error_msg:
+                    print(f"      ❌ Insufficient memory: {e}")
+                else:
+                    print(f"      ❌ Error: {e}")
+
+                if i < len(strategies):
+                    print(f"      🔄 Trying next strategy...")
+
+        print(f"\n   ⚠️  All strategies failed, vector index not created")
+        print(f"   💡 Similarity search will still work, just slower without index")
+        print(f"   💡 Contact Supabase support to increase maintenance_work_mem limit")
+        return False
+
+    finally:
+        cur.close()
+        if own_conn:
+            conn.close()
+
+
+def main(mode):
+    print("\n" + "="*80)
+    print(f"CREATE VECTOR INDEX - {mode.upper()} MODE")
+    print("="*80)
+
+    try:
+        created = build_vector_index(mode)
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return
+
+    print("\n" + "="*80)
+    print("✅ DONE" if created else "⚠️  DONE WITHOUT INDEX")
+    print("="*80 + "\n")
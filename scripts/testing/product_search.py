@@ -18,9 +18,14 @@ SUPABASE_USER = os.getenv("SUPABASE_USER")
 SUPABASE_PASSWORD = os.getenv("SUPABASE_PASSWORD")
 SUPABASE_PORT = os.getenv("SUPABASE_PORT", "5432")
 
+HNSW_EF_SEARCH = 100  # Candidate list size per search; higher = better recall, slower
+
 # Initialize OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# The query vector is cast to the column's own type so the index matches
+_embedding_type = None
+
 
 def get_supabase_connection():
     """Create Supabase connection"""
@@ -28,6 +33,19 @@ def get_supabase_connection():
     return psycopg2.connect(conn_string)
 
 
+def embedding_type(cursor):
+    """Type of products.embedding ('vector' or 'halfvec'), looked up once per process"""
+    global _embedding_type
+    if _embedding_type is None:
+        cursor.execute("""
+            SELECT format_type(atttypid, NULL)
+            FROM pg_attribute
+            WHERE attrelid = 'products'::regclass AND attname = 'embedding'
+        """)
+        _embedding_type = cursor.fetchone()[0]
+    return _embedding_type
+
+
 def create_query_embedding(query_text):
     """Generate embedding for search query"""
     try:
@@ -41,62 +59,63 @@ def create_query_embedding(query_text):
         return None
 
 
-def search_products(query, limit=10, platform_filter=None, min_similarity=0.7):
+def search_products_with_vec(query_embedding, platforms, limit, min_similarity):
     """
-    Search for products using vector similarity
+    Nearest products to an already-embedded query, in one round trip
 
     Args:
-        query: Search query string (e.g., "metallic reimagined")
-        limit: Number of results to return (default 10)
-        platform_filter: Filter by platform ("alias" or "stockx"), None for both
-        min_similarity: Minimum cosine similarity score (0-1, default 0.7)
+        query_embedding: Query vector from create_query_embedding()
+        platforms: Platforms to search, each getting its own top `limit`
+                   (None in the list means all platforms)
+        limit: Number of results per platform
+        min_similarity: Minimum cosine similarity score (0-1)
 
     Returns:
-        List of matching products with their details
+        List of matching products with their details, nearest first
     """
-    print(f"\n🔍 Searching for: '{query}'")
-    print(f"   Platform filter: {platform_filter or 'All'}")
-    print(f"   Min similarity: {min_similarity}")
-    print(f"   Results limit: {limit}\n")
-
-    # Create embedding for query
-    query_embedding = create_query_embedding(query)
-    if not query_embedding:
-        print("❌ Failed to create query embedding")
-        return []
-
     # Connect to Supabase
     conn = get_supabase_connection()
     cursor = conn.cursor()
 
     try:
-        # Build SQL query with optional platform filter
-        platform_condition = ""
-        params = [query_embedding, query_embedding, min_similarity]
-
-        if platform_filter:
-            platform_condition = "AND platform = %s"
-            params.append(platform_filter)
-
-        params.append(limit)
-
-        sql = f"""
-        SELECT
-            product_id_platform,
-            platform,
-            product_name_platform,
-            style_id_platform,
-            style_id_normalized,
-            embedding_text,
-            keyword_used,
-            1 - (embedding <=> %s::vector) AS similarity
-        FROM products
-        WHERE embedding IS NOT NULL
-          AND 1 - (embedding <=> %s::vector) >= %s
-          {platform_condition}
-        ORDER BY similarity DESC
-        LIMIT %s
-        """
+        vector_type = embedding_type(cursor)
+        cursor.execute("SET LOCAL hnsw.ef_search = %s", (HNSW_EF_SEARCH,))
+
+        # One arm per platform, UNION ALL'd into a single query. Each arm
+        # ORDERs BY the bare distance so the HNSW index serves it (an
+        # expression on it forces a full scan); the similarity threshold
+        # is applied to the top results below. Within an arm the vector is
+        # bound and cast once: ORDER BY reuses the selected distance. (A
+        # CTE/join for it would make the probe a join column, which the
+        # index can't order by.)
+        arms = []
+        params = []
+        for platform in platforms:
+            platform_condition = ""
+            params.append(query_embedding)
+            if platform:
+                platform_condition = "AND platform = %s"
+                params.append(platform)
+            params.append(limit)
+
+            arms.append(f"""
+            (SELECT
+                product_id_platform,
+                platform,
+                product_name_platform,
+                style_id_platform,
+                style_id_normalized,
+                embedding_text,
+                keyword_used,
+                embedding <=> %s::{vector_type} AS distance
+            FROM products
+            WHERE embedding IS NOT NULL
+              {platform_condition}
+            ORDER BY distance
+            LIMIT %s)
+            """)
+
+        sql = " UNION ALL ".join(arms) + " ORDER BY distance"
 
         cursor.execute(sql, params)
         results = cursor.fetchall()
@@ -104,6 +123,9 @@ def search_products(query, limit=10, platform_filter=None, min_similarity=0.7):
         # Format results
         products = []
         for row in results:
+            similarity = 1 - row[7]
+            if similarity < min_similarity:
+                break  # Rows are nearest first; the rest are further away
             product = {
                 "product_id_platform": row[0],
                 "platform": row[1],
@@ -112,7 +134,7 @@ def search_products(query, limit=10, platform_filter=None, min_similarity=0.7):
                 "style_id_normalized": row[4],
                 "embedding_text": row[5],
                 "keyword_used": row[6],
-                "similarity": round(row[7], 4)
+                "similarity": round(similarity, 4)
             }
             products.append(product)
 
@@ -126,11 +148,41 @@ def search_products(query, limit=10, platform_filter=None, min_similarity=0.7):
         conn.close()
 
 
+def search_products(query, limit=10, platform_filter=None, min_similarity=0.7):
+    """
+    Search for products using vector similarity
+
+    Args:
+        query: Search query string (e.g., "metallic reimagined")
+        limit: Number of results to return (default 10)
+        platform_filter: Filter by platform ("alias" or "stockx"), None for both
+        min_similarity: Minimum cosine similarity score (0-1, default 0.7)
+
+    Returns:
+        List of matching products with their details
+    """
+    print(f"\n🔍 Searching for: '{query}'")
+    print(f"   Platform filter: {platform_filter or 'All'}")
+    print(f"   Min similarity: {min_similarity}")
+    print(f"   Results limit: {limit}\n")
+
+    # Create embedding for query
+    query_embedding = create_query_embedding(query)
+    if not query_embedding:
+        print("❌ Failed to create query embedding")
+        return []
+
+    return search_products_with_vec(query_embedding, [platform_filter], limit, min_similarity)
+
+
 def search_alias_and_stockx(query, limit_per_platform=5, min_similarity=0.7):
     """
     Search for matching products on both Alias and StockX
     Returns separate lists for each platform
 
+    The query is embedded once and both platforms are searched in a
+    single database round trip.
+
     Args:
         query: Search query string
         limit_per_platform: Number of results per platform (default 5)
@@ -139,23 +191,26 @@ def search_alias_and_stockx(query, limit_per_platform=5, min_similarity=0.7):
     Returns:
         dict with 'alias' and 'stockx' keys containing product lists
     """
-    alias_results = search_products(
-        query,
-        limit=limit_per_platform,
-        platform_filter="alias",
-        min_similarity=min_similarity
-    )
+    print(f"\n🔍 Searching for: '{query}'")
+    print("   Platforms: alias + stockx")
+    print(f"   Min similarity: {min_similarity}")
+    print(f"   Results limit: {limit_per_platform} per platform\n")
+
+    query_embedding = create_query_embedding(query)
+    if not query_embedding:
+        print("❌ Failed to create query embedding")
+        return {"alias": [], "stockx": []}
 
-    stockx_results = search_products(
-        query,
+    results = search_products_with_vec(
+        query_embedding,
+        ["alias", "stockx"],
         limit=limit_per_platform,
-        platform_filter="stockx",
         min_similarity=min_similarity
     )
 
     return {
-        "alias": alias_results,
-        "stockx": stockx_results
+        "alias": [p for p in results if p["platform"] == "alias"],
+        "stockx": [p for p in results if p["platform"] == "stockx"]
     }
 
 
@@ -54,7 +54,8 @@ def test_threshold(min_similarity, sample_size=50):
                 product_id_internal,
                 product_name_platform,
                 style_id_platform,
-                1 - (embedding <=> %s::vector) AS similarity
+                -- Untyped literal: takes the column's type (vector or halfvec)
+                1 - (embedding <=> %s) AS similarity
             FROM products
             WHERE platform = 'stockx'
               AND embedding IS NOT NULL
@@ -0,0 +1,59 @@
+-- Store product embeddings as halfvec (float16) instead of vector (float32)
+-- Requires pgvector >= 0.7
+--
+-- 1536 dims x 2 bytes instead of 4: half the table/TOAST size, half the
+-- bytes shipped per insert, and a smaller HNSW/IVFFlat index to scan.
+-- text-embedding-3-small recall is effectively unchanged at float16.
+
+-- Vector indexes are tied to the column type; drop before converting
+DROP INDEX IF EXISTS products_embedding_idx;
+DROP INDEX IF EXISTS idx_products_embedding;
+DROP INDEX IF EXISTS idx_products_embedding_cosine;
+
+-- Rewrites the table once
+ALTER TABLE products
+ALTER COLUMN embedding TYPE halfvec(1536)
+USING embedding::halfvec(1536);
+
+-- Similarity search keeps its vector(1536) signature so callers don't change;
+-- the query embedding is cast to match the column (and its index)
+CREATE OR REPLACE FUNCTION find_platform_matched_product_ids(
+  query_embedding vector(1536),
+  match_threshold float DEFAULT 0.7,
+  match_count int DEFAULT 3
+)
+RETURNS TABLE (
+  product_id_internal INTEGER,
+  product_name VARCHAR,
+  product_style_id VARCHAR,
+  style_id_normalized VARCHAR,
+  platform VARCHAR,
+  product_id_platform VARCHAR,
+  platform_data JSONB,
+  similarity float,
+  embedding_text TEXT
+)
+LANGUAGE sql STABLE
+AS $$
+  SELECT
+    p.product_id_internal,
+    p.product_name_platform as product_name,
+    p.style_id_platform as product_style_id,
+    p.style_id_normalized,
+    p.platform,
+    p.product_id_platform,
+    p.platform_data,
+    1 - (p.embedding <=> query_embedding::halfvec(1536)) as similarity,
+    p.embedding_text
+  FROM products p
+  WHERE
+    p.embedding IS NOT NULL
+    AND p.product_name_platform IS NOT NULL
+    AND p.product_name_platform != ''
+    AND 1 - (p.embedding <=> query_embedding::halfvec(1536)) > match_threshold
+  ORDER BY p.embedding <=> query_embedding::halfvec(1536)
+  LIMIT match_count;
+$$;
+
+-- Then rebuild the vector index (picks halfvec_cosine_ops automatically):
+--   python scripts/active/create_hnsw_index.py